@@ -11,33 +11,63 @@ import signal
 import websocket
 import logging
 import os.path
+import time
+import tracemalloc
 from datetime import datetime
 
 from modules import dev_tools
+from modules import replay
 from modules import utils
 from modules import common
 from modules import graph as g
 from modules import frame_handler
 from modules import base
+from modules import scheduler
+from modules import request_tracker
+from modules import script_capture
+from modules import manager
+from modules import memory
+from modules import metrics
+from modules import profiling
+from modules import writer
 
 class ChromeHandler(base.Handler):
     """ChromeHandler attaches to the browser target."""
 
-    def handle_new_browsing_session(self):
+    def handle_new_browsing_session(self, session_id=None):
+        if session_id:
+            # The session was started (and logged) by manager.ChromeManager.
+            if not g.Session.instance:
+                g.Session(session_id, self.user_agent)
+            return
         session_id = utils.random_string_digits(32)
-        session = g.Session(session_id, self.user_agent)
-        session.log(self.logger)
         print("Current session: " + session_id)
-        user = g.User(self.user_id)
-        user.log(self.logger)
-        user_edge = g.SessionEdge(self.user_id, g.Session.Instance().get_session_id())
-        user_edge.log(self.logger)
-
-    def __init__(self, debug=False):
-        """The top-level handler which listens for message across devtools."""
-        self.messages = list()
+        g.new_browsing_session(session_id, self.user_agent, self.user_id,
+                               self.logger)
+
+    def __init__(self, debug=False, chrome=None, record=None, target=None,
+                 session_id=None):
+        """The top-level handler which listens for message across devtools.
+
+        chrome -- An already created DevTools interface (e.g., a
+                  replay.ReplayInterface). By default we connect to Chrome.
+        record -- If set, every received message is recorded to this file.
+        target -- The targetInfo of a single tab to audit (see
+                  manager.ChromeManager). By default we discover and audit
+                  every tab.
+        session_id -- The id of an already started session.
+        """
+        self.target = target
+        # Messages waiting to be parsed, see scheduler.EventScheduler.
+        self.messages = scheduler.EventScheduler()
         self.targets_attached = set()
-        self.request_map = dict()
+        # sessionId -> targetId of the targets we attached to.
+        self.sessions = dict()
+        # Seconds it took to attach to each target and enable its domains.
+        self.attach_latency = dict()
+        # Main frame id -> the Page.getFrameTree reply fetched when we
+        # attached to a page that existed already.
+        self.frame_trees = dict()
 
         self.user_id = utils.get_user_id()
         self.called = 0
@@ -45,72 +75,251 @@ class ChromeHandler(base.Handler):
         # Attach to the browser id
         self.handler_id = "ChromeHandler"
         base.Handler.__init__(self, self.handler_id, debug)
-        
-        self._init_connections()
-        
-        # Initializes logger
-        self.file_cache = utils.FileCache(common.SCRIPT_CACHE)
-        self.logger = utils.ObjectManager("neo4j-csvs")
-        # Maintains a list of messages that need to be parsed.
+        # Maintains the frame cache. Its handlers (and its ScriptHandler's)
+        # are compiled into our dispatch table, after our own.
         self.frame_handler = frame_handler.FrameHandler(self)
-        self.handle_new_browsing_session()
+        self.register_subhandler(self.frame_handler)
 
-    def _init_connections(self):
-        self.chrome = dev_tools.ChromeInterface()
+        self._init_connections(chrome, record)
+
+        # Initializes logger
+        self.file_cache = utils.FileCache(common.SCRIPT_CACHE, is_bytes=True)
+        # Only the async client can fetch sources off the message loop.
+        if common.CAPTURE_SCRIPTS and isinstance(
+                self.chrome, dev_tools.AsyncChromeInterface):
+            self.script_capture = script_capture.ScriptCapture(
+                self.chrome, self.file_cache)
+        else:
+            self.script_capture = None
+            if common.CAPTURE_SCRIPTS and not isinstance(
+                    self.chrome, replay.ReplayInterface):
+                self.log.warning("Script capture is disabled, it needs the "
+                                 "async DevTools client.")
+        self.logger = utils.ObjectManager(common.CSV_DIR)
+        # The requests in flight, see request_tracker.RequestTracker.
+        self.requests = request_tracker.RequestTracker(self.logger)
+        with utils.handler_context('handle_new_browsing_session'):
+            self.handle_new_browsing_session(session_id)
+        self.memory = self._init_memory()
+        self.metrics_exporter = self._init_metrics()
+
+    def _init_memory(self):
+        """Tracks the sizes of our long-lived structures, see memory.py."""
+        reporter = memory.MemoryReporter.Instance()
+        frames = self.frame_handler
+        managers = [self.logger, frames, frames.script_handler]
+        reporter.track("message_queue", "Messages waiting to be handled.",
+                       lambda: len(self.messages))
+        reporter.track("frames", "Frames in the frame cache.",
+                       lambda: len(frames.entries))
+        reporter.track("frame_scripts", "Scripts of the cached frames, "
+                       "parsed and pending.",
+                       lambda: sum(len(f.scripts) + len(f.pending_scripts)
+                                   for f in list(frames.entries.values())))
+        reporter.track("requests", "Requests in flight.",
+                       lambda: len(self.requests))
+        reporter.track("sessions", "Sessions of the targets we attached to.",
+                       lambda: len(self.sessions))
+        reporter.track("seen_index", "Nodes written during this session.",
+                       lambda: len(utils.ObjectManager.seen))
+        reporter.track("loggers", "Open loggers of the current segments.",
+                       lambda: sum(len(m.loggers) for m in managers))
+        reporter.track("logger_ids", "Ids the open loggers deduplicate.",
+                       lambda: sum(len(l.ids) for m in managers
+                                   for l in list(m.loggers.values())))
+        reporter.track("occurrences", "Sightings of written nodes since the "
+                       "last rotation.",
+                       lambda: sum(len(m.occurrences) for m in managers))
+        reporter.track("script_cache_index", "Scripts in the script cache.",
+                       lambda: len(self.file_cache))
+        reporter.track("url_cache", "Entries of the URL caches.",
+                       lambda: sum(func.cache_info().currsize
+                                   for func in [g.parse_url, g.resource_id]))
+        reporter.track("writer_queue", "Rotated segments waiting to be "
+                       "written.",
+                       lambda: len(writer.BackgroundWriter.Instance()))
+        if self.script_capture:
+            reporter.track("script_capture", "Scripts waiting to be fetched.",
+                           lambda: len(self.script_capture.pending))
+        reporter.start()
+        return reporter
+
+    def _init_metrics(self):
+        """Registers our gauges and starts exporting the metrics."""
+        if not self.metrics:
+            return None
+        self.metrics.gauge("auditor_queue_depth",
+                           "Messages waiting to be handled.",
+                           lambda: len(self.messages))
+        self.metrics.gauge("auditor_frames_cached", "Frames in the cache.",
+                           lambda: len(self.frame_handler.entries))
+        self.metrics.gauge("auditor_requests_in_flight",
+                           "Requests that haven't finished yet.",
+                           lambda: len(self.requests))
+        self.metrics.gauge("auditor_events_dropped",
+                           "Events dropped before decoding, since no handler "
+                           "handles them.",
+                           lambda: self.chrome.events_dropped)
+        self.metrics.gauge("auditor_writer_queue_depth",
+                           "Rotated segments waiting to be written.",
+                           lambda: len(writer.BackgroundWriter.Instance()))
+        # The stats we used to only log, the logs may well go to /dev/null.
+        self.metrics.gauge("auditor_attach_seconds",
+                           "How long attaching to each target took.",
+                           lambda: dict(self.attach_latency), label="target")
+        self.metrics.gauge("auditor_message_queue",
+                           "The stats of the message queue.",
+                           self.messages.stats, label="stat")
+        self.metrics.gauge("auditor_frame_cache",
+                           "The stats of the frame cache.",
+                           self.frame_handler.stats, label="stat")
+        self.metrics.gauge("auditor_requests", "The stats of the requests.",
+                           self.requests.stats, label="stat")
+        self.metrics.gauge("auditor_writer", "The stats of the writer.",
+                           lambda: writer.BackgroundWriter.Instance().stats(),
+                           label="stat")
+        if self.script_capture:
+            self.metrics.gauge("auditor_script_capture",
+                               "The stats of the script capture.",
+                               self.script_capture.stats, label="stat")
+        self.memory.export(self.metrics)
+        # The tabs of manager.ChromeManager can't share a port.
+        port = None if self.target else common.METRICS_PORT
+        path = common.METRICS_FILE
+        if path and self.target:
+            path = "{}.{}".format(path, self.target['targetId'])
+        if port is None and not path:
+            return None
+        return metrics.MetricsExporter(port, path)
+
+    def _init_connections(self, chrome=None, record=None):
+        if chrome is None:
+            chrome = dev_tools.AsyncChromeInterface() \
+                if common.ASYNC_CLIENT else dev_tools.ChromeInterface()
+        if record:
+            chrome.recorder = replay.MessageRecorder(record)
+        else:
+            # Only decode the events we handle, recordings keep everything.
+            chrome.subscribe(self.subscriptions())
+        self.chrome = chrome
+        self.frame_handler.chrome = chrome
         version_output = self.chrome.attach_to_browser_target()
         self.user_agent = version_output['User-Agent']
         session_id_m, msgs = self.chrome.Target.attachToBrowserTarget()
         self.browser_session_id = session_id_m['result']['sessionId']
-        self.target_id = msgs[0]['params']['targetInfo']['targetId']
+        if msgs:
+            self.target_id = msgs[0]['params']['targetInfo']['targetId']
+        else:
+            # The async client leaves the attachedToTarget event in its
+            # queue, so we ask for the target's info instead.
+            info, msgs = self.chrome.Target.getTargetInfo(
+                sessionId=self.browser_session_id)
+            self.messages.extend(msgs)
+            self.target_id = info['result']['targetInfo']['targetId'] \
+                if isinstance(info, dict) and 'result' in info else None
+        # The targets that exist already, we didn't see them being created.
+        if self.target:
+            self.attach_to_targets([self.target], bootstrap=True)
+            return
         targets, msgs = self.chrome.Target.getTargets()
         self.messages.extend(msgs)
         targets = targets['result']['targetInfos']
-        for target in targets:
-            self.attach_to_target(target)
+        self.attach_to_targets(targets, bootstrap=True)
 
     def attach_to_target(self, info, m=None):
         """Enables the DevTool's domains that we need messages from."""
-        # Register for messages
-        def enable(func, **kwargs):
-            kwargs['sessionId'] = session_id
-            result, msgs = func(**kwargs)
-            if 'Timeout' in result:
-                self.log.error("NoReturn: {}:{}:{}:{}".format(
-                    func, dict(kwargs), target_id, m))
-            self.messages.extend(msgs)
-            return result
+        self.attach_to_targets([info], m)
 
-        target_id = info['targetId']
-        if target_id in self.targets_attached:
-            self.log.warning("Have already attached {}".format(info))
-        else:
-            self.targets_attached.add(target_id)
+    def attach_to_targets(self, infos, m=None, bootstrap=False):
+        """Attaches to every target in @infos concurrently.
 
-        # Attach to the target.
-        session_id_m, msgs = self.chrome.Target.attachToTarget(
-            targetId=target_id, flatten=True)
+        All Target.attachToTarget commands are issued at once, followed by a
+        single batch with the enables for every new session. If @bootstrap,
+        the batch also fetches the frame tree of every page, which the
+        FrameHandler needs for the pages it didn't see being created (see
+        self.frame_trees).
+        """
+        start = time.perf_counter()
+        for info in infos:
+            target_id = info['targetId']
+            if target_id in self.targets_attached:
+                self.log.warning("Have already attached {}".format(info))
+            else:
+                self.targets_attached.add(target_id)
+
+        # Attach to the targets.
+        attach_times = list()
+        results, msgs = self.chrome.batch(
+            [("Target.attachToTarget",
+              {'targetId': info['targetId'], 'flatten': True})
+             for info in infos], attach_times)
         self.messages.extend(msgs)
 
-        if 'error' in session_id_m:
-            self.log.error("Error Attaching {}-{}".format(info, session_id_m))
-            return
-
+        # targetId -> when its last reply arrived.
+        replied = dict()
+        attached = list()
+        calls = list()
+        owners = list()
+        for info, session_id_m, replied_at in zip(infos, results,
+                                                  attach_times):
+            if 'error' in session_id_m or 'Timeout' in session_id_m:
+                self.log.error("Error Attaching {}-{}".format(info,
+                                                              session_id_m))
+                continue
+            session_id = utils.get_session_id(session_id_m)
+            self.sessions[session_id] = info['targetId']
+
+            print("called", self.called)
+            self.called +=1
+            attached.append(info)
+            replied[info['targetId']] = replied_at
+
+            # Enable the inspectors we need.
+            for method, params in self.enables:
+                # With a single target, the manager discovers the targets.
+                if self.target and method == "Target.setDiscoverTargets":
+                    continue
+                calls.append((method, dict(params, sessionId=session_id)))
+                owners.append(info)
+            if bootstrap and info.get('type') == 'page':
+                calls.append(("Page.getFrameTree", {'sessionId': session_id}))
+                owners.append(info)
+
+        enable_times = list()
+        results, msgs = self.chrome.batch(calls, enable_times)
         self.messages.extend(msgs)
-        session_id = utils.get_session_id(session_id_m)
-
-
-        print("called", self.called)
-        self.called +=1
-
-        # Enable the inspectors we need.
-        enable(self.chrome.Target.setDiscoverTargets, discover=True)
+        for (method, params), info, result, replied_at in zip(
+                calls, owners, results, enable_times):
+            if 'Timeout' in result:
+                self.log.error("NoReturn: {}:{}:{}:{}".format(
+                    method, params, info['targetId'], m))
+            elif method == "Page.getFrameTree":
+                if 'result' in result:
+                    root = result['result']['frameTree']['frame']
+                    self.frame_trees[root['id']] = result
+            elif replied_at is not None:
+                replied[info['targetId']] = max(replied[info['targetId']],
+                                                replied_at)
+
+        for info in attached:
+            # From the start of the batches to the last reply of the target.
+            latency = replied[info['targetId']] - start
+            self.attach_latency[info['targetId']] = latency
+            self.log.info("Attached to {} in {:.1f}ms".format(
+                info['targetId'], latency * 1000))
+
+    # The domains we enable on every target.
+    enables = [
+        ("Target.setDiscoverTargets", {'discover': True}),
         # we will handle windowOpen in targetCreated, set windowOpen=False
-        enable(self.chrome.Target.setAutoAttach, autoAttach=False,
-               flatten=True, waitForDebuggerOnStart=False, windowOpen=False)
-        enable(self.chrome.Page.enable)
-        enable(self.chrome.Network.enable)
-        enable(self.chrome.Debugger.enable)
-        enable(self.chrome.Page.setLifecycleEventsEnabled, enabled=True)
+        ("Target.setAutoAttach", {'autoAttach': False, 'flatten': True,
+                                  'waitForDebuggerOnStart': False,
+                                  'windowOpen': False}),
+        ("Page.enable", {}),
+        ("Network.enable", {}),
+        ("Debugger.enable", {}),
+        ("Page.setLifecycleEventsEnabled", {'enabled': True}),
+    ]
 
     def msg_loop(self):
         """The message loop is the main loop for parsing received messages.
@@ -118,7 +327,7 @@ class ChromeHandler(base.Handler):
         1. Check if any new messages exists.
         2. If we have a message, then we check if this is a message we want
            to parse.
-        3. If so, get the corresponding parsing method using self.handlers
+        3. If so, get the corresponding parsing methods using self.dispatch
         4. Finally, if the handler returns True it implies we need to shutdown.
 
         * If a KeyboardInterrupt is received, then we will begin shutting down.
@@ -131,11 +340,10 @@ class ChromeHandler(base.Handler):
                 m = self.chrome.pop_messages()
                 self.messages.extend(m)
                 while len(self.messages):
-                    m = self.messages.pop(0)
-                    shutdown = self.run_cycle(m)
-                    if shutdown:
-                        self.shutdown("shutdown")
-                        break
+                    m = self.messages.pop()
+                    # run_cycle already shut us down.
+                    if self.run_cycle(m):
+                        return
             except KeyboardInterrupt:
                 self.log.info("KeyboardInterrupt, shutting down.")
                 self.shutdown("shutdown")
@@ -157,23 +365,18 @@ class ChromeHandler(base.Handler):
                                                            pierce=True)
         self.messages.extend(msgs)
 
-    def handle_frame_attached(self, m):
-        self.frame_handler.handle_frame_attached(m)
-
-    def handle_frame_navigated(self, m):
-        self.frame_handler.handle_frame_navigated(m)
-
     def handle_response_received(self, m):
         p = m['params']
         r = p['response']
 
-        self.frame_handler.handle_response_received(m)
-        request_id = p['requestId']
-        #XXX: Is the request map still necessary?
-        if request_id in self.request_map:
-            request = self.request_map[request_id]
-            edge = g.ResponseEdge.from_m(m, request)
-            edge.log(self.logger)
+        # The response edge is logged once the request finished.
+        self.requests.response_received(m)
+
+    def handle_loading_finished(self, m):
+        self.requests.loading_finished(m)
+
+    def handle_loading_failed(self, m):
+        self.requests.loading_failed(m)
 
     def handle_request_sent(self, m):
         p = m['params']
@@ -184,8 +387,7 @@ class ChromeHandler(base.Handler):
             return
 
         edge = g.RequestEdge.from_m(m)
-        self.frame_handler.handle_request_sent(m)
-        self.request_map[p['requestId']] = edge
+        self.requests.request_sent(m, edge)
         edge.log(self.logger)
 
     def handle_download_begin(self, m):
@@ -193,31 +395,9 @@ class ChromeHandler(base.Handler):
         edge.log(self.logger)
 
     def handle_script_parsed(self, m):
-        self.frame_handler.handle_script_parsed(m)
-        return
-        #TODO: How do we want to handle the script cache going forward?
-        p = m['params']
-        script_id = p['scriptId']
-        url = p['url']
-        s_hash = p['hash']
-        frame_id = p['executionContextAuxData']['frameId']
-        frame = self.frame_handler.get_frame(frame_id)
-        # We need to create a script node, and a script2frame node.
-        script = g.Script.from_m(m, frame_id, frame.loader_id)
-        self.logger.add(g.SCRIPT, script)
-        return
-        try:
-            msg, new_messages = self.chrome.Debugger.getScriptSource(
-                scriptId=script_id)
-            self.messages.extend(new_messages)
-            if msg:
-                src = msg['result']['scriptSource']
-                self.file_cache.cache_file(src, s_hash)
-        except websocket._exceptions.WebSocketConnectionClosedException:
-            #XXX. The target has been deatched, but we are still parsing
-            # incoming messages from it. However, we can't request anything
-            # from browser, since this target no longer exists.
-            return
+        # The source is fetched and cached in the background.
+        if self.script_capture:
+            self.script_capture.submit(m)
 
     def handle_window_open(self, m):
         #TODO 11/13/2019 need to confirm whether this is duplicated with target_created 
@@ -240,10 +420,9 @@ class ChromeHandler(base.Handler):
     #     print("\033[92m {}\033[00m" .format("[+] Frame " + m['params']['frameId'] + " loaded in " + str(stop - start) + "s"))
 
     def handle_target_created(self, m):
-        if (m.get('params') and not m['params']['targetInfo']['attached']
+        if (not self.target and m.get('params') and not m['params']['targetInfo']['attached']
                 and m['params']['targetInfo']['type'] == 'page'):
             self.attach_to_target(m['params']['targetInfo'])
-        self.frame_handler.handle_target_created(m)
 
     def handle_target_attached(self, m):
         p = m['params']
@@ -252,14 +431,33 @@ class ChromeHandler(base.Handler):
             session_id = m['sessionId']
             try:
                 self.log.debug("Attaching to {}".format(m))
-                result, msgs = self.chrome.Runtime.runIfWaitingForDebugger(
-                    sessionId=session_id)
+                # Nothing to wait for, the target just resumes.
+                result, msgs = self.chrome.notify(
+                    "Runtime.runIfWaitingForDebugger", sessionId=session_id)
                 self.messages.extend(msgs)
             except websocket._exceptions.WebSocketTimeoutException:
                 self.log.error("Could not start target {}".format(m))
-                return
 
-        self.frame_handler.handle_attached_to_target(m)
+    def handle_target_destroyed(self, m):
+        target_id = m['params']['targetId']
+        self.targets_attached.discard(target_id)
+        self.frame_handler.handle_target_destroyed(target_id)
+        # Our tab is gone, so we are done.
+        return self.is_own_target(target_id)
+
+    def handle_target_detached(self, m):
+        p = m['params']
+        # targetId is deprecated, but the session tells us the target.
+        target_id = self.sessions.pop(p.get('sessionId'), None) \
+            or p.get('targetId')
+        if not target_id:
+            return
+        self.targets_attached.discard(target_id)
+        self.frame_handler.handle_target_destroyed(target_id)
+        return self.is_own_target(target_id)
+
+    def is_own_target(self, target_id):
+        return bool(self.target) and target_id == self.target['targetId']
 
     def handle_target_info_changed(self, m):
         p = m['params']
@@ -268,27 +466,133 @@ class ChromeHandler(base.Handler):
 
     def shutdown(self, m):
         """Exit routine, closes DevTools socket & flushes all logs to disk."""
-        # Call base.Handler's shutdown routine.
-        base.Handler.shutdown(self, m)
-        self.frame_handler.handle_shutdown()
+        # Shuts the FrameHandler down, which logs the frames it cached.
+        with utils.handler_context('handle_shutdown'):
+            base.Handler.shutdown(self, m)
+        if self.script_capture:
+            self.script_capture.close()
+            self.log.info("Script capture: {}".format(
+                self.script_capture.stats()))
+        self.file_cache.close()
         self.chrome.close()
+        with utils.handler_context('handle_shutdown'):
+            self.requests.flush()
         self.logger.flush_all(exiting=True)
+        self.log.info("Message queue: {}".format(self.messages.stats()))
+        self.log.info("Frame cache: {}".format(self.frame_handler.stats()))
+        self.log.info("Requests: {}".format(self.requests.stats()))
+        self.log.info("Writer: {}".format(
+            writer.BackgroundWriter.Instance().stats()))
+        self.log.info("URL cache: {}".format(g.url_cache_info()))
+        self.log.info("Dispatch: {}".format(self.dispatch_stats()))
+        if self.metrics_exporter:
+            self.metrics_exporter.close()
+        if profiling.Profiler.instance:
+            profiling.Profiler.instance.stop()
+        self.memory.stop()
         self.log.info("{}'s handler is shutdown (flushing complete).".format(
             self.handler_id))
 
     handlers = {
         "Network.responseReceived": handle_response_received,
         "Network.requestWillBeSent": handle_request_sent,
-        "Page.frameAttached" : handle_frame_attached,
-        "Page.frameNavigated" : handle_frame_navigated,
+        "Network.loadingFinished": handle_loading_finished,
+        "Network.loadingFailed": handle_loading_failed,
         "Page.downloadWillBegin" : handle_download_begin,
         "Debugger.scriptParsed" : handle_script_parsed,
         "Page.windowOpen" : handle_window_open,
         "Page.javascriptDialogOpening": handle_js_dialog_opening,
         "Target.targetCreated" : handle_target_created,
         "Target.attachedToTarget" : handle_target_attached,
+        "Target.detachedFromTarget" : handle_target_detached,
+        "Target.targetDestroyed" : handle_target_destroyed,
         "Target.targetInfoChanged" : handle_target_info_changed,
     }
 
 if __name__ == '__main__':
-    manager = ChromeHandler().msg_loop()
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--record", metavar="FILE",
+                        help="Record the DevTools stream to FILE (.gz to "
+                             "compress).")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="Replay a recorded DevTools stream instead of "
+                             "attaching to Chrome.")
+    parser.add_argument("--sync-client", action="store_true",
+                        help="Use the synchronous DevTools client, which "
+                             "polls the socket (no script capture).")
+    # The async client is the default now.
+    parser.add_argument("--async-client", action="store_true",
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--no-provenance", action="store_true",
+                        help="Don't record which handler created/logged each "
+                             "element.")
+    parser.add_argument("--processes", action="store_true",
+                        help="Audit every tab in its own process (not with "
+                             "--record or --replay).")
+    parser.add_argument("--no-script-capture", action="store_true",
+                        help="Don't fetch the source of parsed scripts.")
+    parser.add_argument("--output-format", choices=["csv", "segment"],
+                        default=common.OUTPUT_FORMAT,
+                        help="Write neo4j CSVs or compact segment files.")
+    parser.add_argument("--metrics-port", type=int,
+                        default=common.METRICS_PORT,
+                        help="Serve Prometheus metrics on "
+                             "127.0.0.1:PORT/metrics (not with --processes).")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile every CDP method from the start, "
+                             "instead of waiting for SIGUSR2.")
+    parser.add_argument("--profile-dir", metavar="DIR",
+                        default=common.PROFILE_DIR,
+                        help="Where the profiles are written.")
+    parser.add_argument("--metrics-file", metavar="FILE",
+                        default=common.METRICS_FILE,
+                        help="Write the Prometheus metrics to FILE every {} "
+                             "seconds.".format(common.METRICS_INTERVAL))
+    parser.add_argument("--memory-interval", type=float, metavar="SECONDS",
+                        default=common.MEMORY_INTERVAL,
+                        help="Log the sizes of our structures every SECONDS.")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Trace allocations from the start, instead of "
+                             "from the first SIGUSR1.")
+    args = parser.parse_args()
+    if args.processes and (args.record or args.replay):
+        # The tabs' processes each have their own connection.
+        parser.error("--processes can't be combined with --record or "
+                     "--replay")
+    if args.no_provenance:
+        common.PROVENANCE = False
+    if args.no_script_capture:
+        common.CAPTURE_SCRIPTS = False
+    if args.sync_client:
+        common.ASYNC_CLIENT = False
+    common.OUTPUT_FORMAT = args.output_format
+    common.METRICS_PORT = args.metrics_port
+    common.METRICS_FILE = args.metrics_file
+    common.PROFILE_DIR = args.profile_dir
+    # kill -USR2 <pid> toggles profiling. With --processes, the manager
+    # forwards it to the tabs' processes, which inherit this handler.
+    profiler = profiling.Profiler.Instance()
+    profiler.install_signal_handler()
+    if args.profile:
+        profiler.toggle = True
+    # kill -USR1 <pid> writes a tracemalloc snapshot (see memory.py).
+    common.MEMORY_INTERVAL = args.memory_interval
+    memory.MemoryReporter.Instance().install_signal_handler()
+    if args.trace_memory:
+        tracemalloc.start(common.MEMORY_FRAMES)
+
+    if args.replay:
+        chrome = replay.ReplayInterface(args.replay)
+        start = time.perf_counter()
+        ChromeHandler(chrome=chrome).msg_loop()
+        elapsed = time.perf_counter() - start
+        events = chrome.events_served + chrome.events_dropped
+        print("Replayed {} messages ({} dropped) in {:.2f}s ({:.0f} msgs/s)"
+              .format(events, chrome.events_dropped, elapsed,
+                      events / elapsed if elapsed else 0))
+    elif args.processes:
+        manager.ChromeManager(ChromeHandler).main_msg_loop()
+    else:
+        ChromeHandler(record=args.record).msg_loop()
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+"""
+Benchmark -- Measures the auditor's ingest throughput on synthetic traffic.
+
+A synthetic browsing session (see modules/workload.py) is pushed through the
+real ChromeHandler dispatch and ObjectManager sinks by way of the replay
+interface. We report messages/sec, the time spent in each handler and the
+peak RSS of the process. Each scenario runs in its own process, since the
+auditor's Session and FrameHandler are singletons.
+"""
+import argparse
+import collections
+import functools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from modules import common
+from modules import replay
+from modules import workload
+
+
+def timed(stats, name, func):
+    """Wraps a handler function so its calls are counted and timed."""
+    @functools.wraps(func)
+    def wrapper(self, m):
+        start = time.perf_counter()
+        try:
+            return func(self, m)
+        finally:
+            entry = stats[name]
+            entry[0] += 1
+            entry[1] += time.perf_counter() - start
+    return wrapper
+
+
+def instrument(handler, stats):
+    """Times every handler function in @handler and its subhandlers.
+
+    The FrameHandler is a subhandler of the ChromeHandler, and the
+    ScriptHandler one of the FrameHandler, so their functions are timed too.
+    FrameHandler.handle_target_destroyed is called by the ChromeHandler's
+    handler rather than dispatched, so its time counts towards that one.
+    """
+    handler.handlers = {method: timed(stats, "{}:{}".format(
+                            handler.__class__.__name__, func.__name__), func)
+                        for method, func in handler.handlers.items()}
+    for subhandler in handler.subhandlers:
+        instrument(subhandler, stats)
+    handler.compile_dispatch()
+
+
+def output_size(dirname):
+    size = 0
+    for root, dirs, files in os.walk(dirname):
+        size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return size
+
+
+def run(params, seed=0):
+    """Runs a single workload in this process and returns its results."""
+    # Imported here, since the auditor creates its output relative to cwd.
+    from auditor import ChromeHandler
+    from modules import graph
+    from modules import writer
+
+    # Serialize the workload up front (like a recording), so we pay for
+    # decoding during the run just like pop_messages() does against a live
+    # browser.
+    lines = [json.dumps(r, separators=(',', ':')) for r in
+             workload.Workload(seed=seed, **params).records()]
+    chrome = replay.ReplayInterface(lines)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    stats = collections.defaultdict(lambda: [0, 0.0])
+    start = time.perf_counter()
+    handler = ChromeHandler(chrome=chrome)
+    instrument(handler, stats)
+    handler.msg_loop()
+    elapsed = time.perf_counter() - start
+
+    messages = chrome.events_served + chrome.events_dropped
+    return {
+        "params": params,
+        "messages": messages,
+        "dropped": chrome.events_dropped,
+        "seconds": elapsed,
+        "msgs_per_sec": messages / elapsed,
+        "handlers": {name: {"calls": calls, "seconds": seconds}
+                     for name, (calls, seconds) in stats.items()},
+        "rss_before_kb": rss_before,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "output_bytes": output_size("neo4j-csvs"),
+        "url_cache": graph.url_cache_info(),
+        "writer": writer.BackgroundWriter.Instance().stats(),
+    }
+
+
+def report(name, result):
+    print("== {} {}".format(name, result["params"]))
+    print("{} messages ({} dropped) in {:.2f}s: {:.0f} msgs/s".format(
+        result["messages"], result["dropped"], result["seconds"],
+        result["msgs_per_sec"]))
+    print("peak RSS {:.1f} MB (workload {:.1f} MB), output {:.1f} MB".format(
+        result["peak_rss_kb"] / 1024, result["rss_before_kb"] / 1024,
+        result["output_bytes"] / 2**20))
+    print("url cache hit rate: {}".format(", ".join(
+        "{} {:.1%}".format(name, c["hit_rate"])
+        for name, c in sorted(result["url_cache"].items()))))
+    w = result["writer"]
+    print("background writer: {} rotations, {:.1f} MB, flush max {:.1f} ms "
+          "total {:.1f} ms, queue high water {}".format(
+              w["rotations"], w["bytes_written"] / 2**20,
+              w["max_flush_seconds"] * 1e3, w["flush_seconds"] * 1e3,
+              w["high_water"]))
+    handlers = sorted(result["handlers"].items(),
+                      key=lambda h: h[1]["seconds"], reverse=True)
+    print("{:<50} {:>8} {:>10} {:>10}".format("handler", "calls", "total ms",
+                                              "mean us"))
+    for name, h in handlers:
+        print("{:<50} {:>8} {:>10.1f} {:>10.1f}".format(
+            name, h["calls"], h["seconds"] * 1e3,
+            h["seconds"] / h["calls"] * 1e6 if h["calls"] else 0))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("scenarios", nargs="*",
+                        default=sorted(workload.SCENARIOS),
+                        help="Scenarios to run {}.".format(
+                            sorted(workload.SCENARIOS)))
+    parser.add_argument("--tabs", type=int)
+    parser.add_argument("--pages", type=int)
+    parser.add_argument("--iframes", type=int)
+    parser.add_argument("--requests", type=int,
+                        help="Requests per page.")
+    parser.add_argument("--scripts", type=int,
+                        help="Scripts parsed by each page's main frame.")
+    parser.add_argument("--domains", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-provenance", action="store_true",
+                        help="Run without the who_created/who_logged/handler "
+                             "columns.")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="Run without the write-ahead journal.")
+    parser.add_argument("--output-format", choices=["csv", "segment"],
+                        default=common.OUTPUT_FORMAT)
+    parser.add_argument("--json", metavar="FILE",
+                        help="Also write the results to FILE.")
+    parser.add_argument("--save", metavar="FILE",
+                        help="Write the workload as a replay recording to "
+                             "FILE instead of running it.")
+    parser.add_argument("--single", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    overrides = {k: getattr(args, k) for k in
+                 ["tabs", "pages", "iframes", "requests", "scripts",
+                  "domains"] if getattr(args, k) is not None}
+
+    if args.save:
+        params = dict(workload.SCENARIOS[args.scenarios[0]], **overrides)
+        recorder = replay.MessageRecorder(args.save)
+        for record in workload.Workload(seed=args.seed, **params).records():
+            recorder.write(record)
+        recorder.close()
+        return
+
+    if args.no_provenance:
+        common.PROVENANCE = False
+    if args.no_journal:
+        common.JOURNAL = False
+    common.OUTPUT_FORMAT = args.output_format
+
+    if args.single:
+        # Child process: run one scenario in a scratch directory.
+        params = dict(workload.SCENARIOS[args.scenarios[0]], **overrides)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            # Keep the auditor's own prints out of our output.
+            stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+            try:
+                result = run(params, args.seed)
+            finally:
+                sys.stdout = stdout
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for name in args.scenarios:
+        cmd = [sys.executable, os.path.abspath(__file__), name, "--single",
+               "--seed", str(args.seed)]
+        for k, v in overrides.items():
+            cmd += ["--{}".format(k), str(v)]
+        if args.no_provenance:
+            cmd.append("--no-provenance")
+        if args.no_journal:
+            cmd.append("--no-journal")
+        cmd += ["--output-format", args.output_format]
+        output = subprocess.run(cmd, check=True, stdout=subprocess.PIPE,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        results[name] = json.loads(output.stdout.decode().splitlines()[-1])
+        report(name, results[name])
+
+    if args.json:
+        with open(args.json, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
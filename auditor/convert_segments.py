@@ -0,0 +1,30 @@
+#!/usr/bin/python3
+"""
+Converts the segment files written with --output-format segment back to the
+neo4j CSV layout (e.g., frames.<timestamp>.seg -> frames.<timestamp>.csv).
+"""
+import argparse
+import glob
+import os
+
+from modules import common
+from modules import segment
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("dirname", nargs="?", default=common.CSV_DIR)
+    parser.add_argument("--remove", action="store_true",
+                        help="Remove each segment once it is converted.")
+    args = parser.parse_args()
+
+    pattern = os.path.join(args.dirname, "*.{}".format(segment.EXTENSION))
+    for filename in sorted(glob.glob(pattern)):
+        out_path = segment.to_csv(filename)
+        print("{} -> {}".format(filename, out_path))
+        if args.remove:
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+#!/usr/bin/python3
+"""
+Exports a neo4j-csvs directory (csv or segment files) as a neo4j-admin
+import bundle. Run the generated import.sh to bulk load it into neo4j.
+"""
+import argparse
+
+from modules import bulk_import
+from modules import common
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("dirname", nargs="?", default=common.CSV_DIR)
+    parser.add_argument("--out", default="neo4j-import",
+                        help="Directory the bundle is written to.")
+    args = parser.parse_args()
+    print(bulk_import.export(args.dirname, args.out))
+
+
+if __name__ == '__main__':
+    main()
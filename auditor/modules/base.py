@@ -1,14 +1,29 @@
 import logging
+import time
+from collections import Counter
 
 from modules import utils
 from modules import common
+from modules import metrics
+from modules import profiling
 
 class Handler(object):
     def __init__(self, id, debug=False):
         self.id = id
-        self.debug = debug
         self.subhandlers = list()
+        # The handler we are a subhandler of.
+        self.parent = None
+        # method -> ((handler, func), ...), see compile_dispatch.
+        self.dispatch = dict()
+        self.handled = Counter()
+        self.dropped = Counter()
+        # Latency of each handler function and event lag, see metrics.py.
+        self.metrics = metrics.Metrics.Instance() if common.METRICS else None
+        self.metrics_name = self.__class__.__name__
+        # The msgs/ logs are disabled, and run_cycle must not write to them
+        # (subhandlers such as the FrameHandler are created with debug=True).
         debug = False
+        self.debug = debug
 
         log_handler = logging.FileHandler("/dev/null".format(self.id))
         log = logging.getLogger(self.id)
@@ -21,27 +36,88 @@ class Handler(object):
             self.debug_logger = utils.FileLogger(
                 "msgs/msgs-{}.log".format(self.id))
 
+        self.compile_dispatch()
+        if self.metrics:
+            self.metrics.dispatcher(self)
+
     def run_cycle(self, m):
         """Run msg loop cycle for message m."""
-        shutdown = False
-
-        if m and 'method' in m and m['method'] in self.handlers:
-            if self.debug:
-                self.debug_logger.write(m)
-
-            shutdown = shutdown or self.handlers[m['method']](self, m)
-
-        # Pass the message to any subhandlers that need it.
+        method = m.get('method') if m else None
+        callbacks = self.dispatch.get(method)
+        if callbacks is None:
+            self.dropped[method] += 1
+            return False
+        self.handled[method] += 1
+
+        if utils.current_handler.get() is None:
+            # The outermost handler records how far behind the browser we
+            # are, and profiles the message (see profiling.py).
+            if self.metrics:
+                self.metrics.observe_lag(m)
+            profiler = profiling.Profiler.instance
+            if profiler and (profiler.enabled or profiler.toggle):
+                return profiler.run(self._dispatch, m, callbacks)
+        return self._dispatch(m, callbacks)
+
+    def _dispatch(self, m, callbacks):
+        """Calls the @callbacks compiled for @m's method, see
+        compile_dispatch."""
+        method = m['method']
+        shutdown = list()
+        for handler, func in callbacks:
+            if handler.debug:
+                handler.debug_logger.write(m)
+
+            with utils.handler_context(func.__name__):
+                if self.metrics:
+                    start = time.perf_counter()
+                    result = func(handler, m)
+                    self.metrics.observe_latency(
+                        handler.metrics_name, method,
+                        time.perf_counter() - start)
+                else:
+                    result = func(handler, m)
+            if result:
+                shutdown.append(handler)
+
+        # Each handler that asked for it is shut down, subhandlers first.
+        for handler in reversed(shutdown):
+            handler.shutdown(m)
+        return bool(shutdown) and shutdown[0] is self
+
+    def compile_dispatch(self):
+        """Compiles the handlers of this handler and its subhandlers into
+        self.dispatch, method -> ((handler, func), ...), in the order the
+        message is passed down: a handler before its subhandlers, and the
+        subhandlers in the order they were registered. Recompiles the
+        handlers this handler is registered with as well."""
+        dispatch = dict()
+        for method, func in self.handlers.items():
+            dispatch[method] = [(self, func)]
         for handler in self.subhandlers:
-            handler.run_cycle(m)
-
-        if shutdown:
-            self.shutdown(m)
+            for method, callbacks in handler.dispatch.items():
+                dispatch.setdefault(method, list()).extend(callbacks)
+        self.dispatch = {method: tuple(callbacks)
+                         for method, callbacks in dispatch.items()}
+        if self.parent:
+            self.parent.compile_dispatch()
+
+    def subscriptions(self):
+        """The methods this handler and its subhandlers handle, i.e., the
+        events we need from DevTools."""
+        return set(self.dispatch)
+
+    def dispatch_stats(self):
+        """Per method counts of the messages we handled and dropped (none
+        of our handlers handles them)."""
+        return {"handled": dict(self.handled), "dropped": dict(self.dropped)}
 
     def register_subhandler(self, handler):
         """Registers a subhandler, which this handler will propagate the msg to
            after it has handled the message."""
         self.subhandlers.append(handler)
+        handler.parent = self
+        self.compile_dispatch()
 
     def shutdown(self, m):
         """Shutdown the handler and all subhandlers."""
@@ -64,7 +140,7 @@ class Handler(object):
 class ObjectHandler(Handler, utils.ObjectManager):
 
     def __init__(self, id, handler=None, debug=True):
-        utils.ObjectManager.__init__(self, dirname="neo4j-csvs")
+        utils.ObjectManager.__init__(self, dirname=common.CSV_DIR)
         Handler.__init__(self, id, debug)
 
         self.handler = handler
@@ -0,0 +1,174 @@
+"""
+BulkImport -- Turns a neo4j-csvs directory into a neo4j-admin import bundle.
+
+For every label we write a typed header file (id:ID, :START_ID, :END_ID,
+:LABEL/:TYPE, ...) and one gzip'd data part per log rotation, with the rows
+reordered to the header's columns. An import.sh script runs neo4j-admin on
+the bundle.
+"""
+import csv
+import glob
+import gzip
+import os
+from collections import OrderedDict
+
+from modules import common
+from modules import graph as g
+from modules import segment
+
+
+NODE_LABELS = {
+    g.FRAME: "Frame",
+    g.SCRIPT: "Script",
+    g.PARSER: "Parser",
+    g.RESOURCE: "Resource",
+    g.HOST: "Host",
+    g.USER: "User",
+    g.SESSION: "Session",
+    g.REDIRECT: "Redirect",
+    g.TARGET: "Target",
+}
+
+EDGE_TYPES = {
+    g.REQUEST_EDGE: "REQUEST",
+    g.RESPONSE_EDGE: "RESPONSE",
+    g.NAVIGATED: "NAVIGATED",
+    g.VERSION: "VERSION",
+    g.CREATED: "CREATED",
+    g.OPENED: "OPENED",
+    g.PARENT: "PARENT",
+    g.FRAME_ATTACHED: "FRAME_ATTACHED",
+    g.STARTED: "STARTED",
+    g.DOWNLOAD: "DOWNLOAD",
+    g.TARGET_EDGE: "OPENED_TAB",
+}
+
+# Properties that are not strings.
+PROPERTY_TYPES = {
+    "requests": "int",
+    "responses": "int",
+    "scripts_parsed": "int",
+    "status": "int",
+    "encodedDataLength": "int",
+    "duration": "float",
+    "timestamp": "float",
+    "wallTime": "float",
+}
+
+IMPORT_OPTIONS = [
+    "--delimiter='{}'".format(common.DELIM),
+    "--multiline-fields=true",
+    "--ignore-empty-strings=true",
+    # A process writes each node once (see utils.SeenIndex), but every tab's
+    # process writes its own copy, e.g., of a shared host or the session.
+    "--skip-duplicate-nodes=true",
+    # Edges may point at nodes we never logged (e.g., script initiators).
+    "--skip-bad-relationships=true",
+]
+
+
+# Logs that are not part of the graph.
+SKIPPED_LABELS = {common.OCCURRENCES}
+
+
+def label_of(filename):
+    """frames.1571234567.123.csv -> frames"""
+    return os.path.basename(filename).split('.')[0]
+
+
+def read_header(filename):
+    if filename.endswith("." + segment.EXTENSION):
+        return segment.read_columns(filename)
+    with open(filename, newline='') as infile:
+        return next(csv.reader(infile, delimiter=common.DELIM), [])
+
+
+def read_rows(filename):
+    """Yields the header and then each row of a csv or segment file."""
+    if filename.endswith("." + segment.EXTENSION):
+        yield from segment.iter_rows(filename)
+        return
+    with open(filename, newline='') as infile:
+        yield from csv.reader(infile, delimiter=common.DELIM)
+
+
+def typed_header(columns, is_edge):
+    header = list()
+    for column in columns:
+        if is_edge and column == "start":
+            header.append(":START_ID")
+        elif is_edge and column == "end":
+            header.append(":END_ID")
+        elif not is_edge and column == "id":
+            header.append("id:ID")
+        elif column in PROPERTY_TYPES:
+            header.append("{}:{}".format(column, PROPERTY_TYPES[column]))
+        else:
+            header.append(column)
+    header.append(":TYPE" if is_edge else ":LABEL")
+    return header
+
+
+def export(dirname, out_dir):
+    """Writes the import bundle for @dirname to @out_dir."""
+    os.makedirs(out_dir, exist_ok=True)
+    files = OrderedDict()
+    for filename in sorted(glob.glob(os.path.join(dirname, "*.csv")) +
+                           glob.glob(os.path.join(dirname, "*." +
+                                                  segment.EXTENSION))):
+        label = label_of(filename)
+        if label not in SKIPPED_LABELS:
+            files.setdefault(label, list()).append(filename)
+
+    args = list()
+    for label, filenames in files.items():
+        # The columns of a label may differ between rotations.
+        columns = list()
+        for filename in filenames:
+            for column in read_header(filename):
+                if column not in columns:
+                    columns.append(column)
+        if not columns:
+            continue
+
+        is_edge = "start" in columns and "end" in columns
+        if is_edge:
+            name = EDGE_TYPES.get(label, label.upper().replace('-', '_'))
+        else:
+            name = NODE_LABELS.get(label, label.title().replace('-', ''))
+
+        header_path = "{}.header.csv".format(label)
+        with open(os.path.join(out_dir, header_path), 'w', newline='') as f:
+            csv.writer(f, delimiter=common.DELIM, lineterminator='\n') \
+                .writerow(typed_header(columns, is_edge))
+
+        parts = [header_path]
+        for i, filename in enumerate(filenames):
+            part_path = "{}.part{:04d}.csv.gz".format(label, i)
+            parts.append(part_path)
+            with gzip.open(os.path.join(out_dir, part_path), 'wt',
+                           newline='') as outfile:
+                writer = csv.writer(outfile, delimiter=common.DELIM,
+                                    lineterminator='\n')
+                rows = read_rows(filename)
+                file_columns = next(rows, [])
+                order = [file_columns.index(c) if c in file_columns else None
+                         for c in columns]
+                for row in rows:
+                    writer.writerow([row[i] if i is not None and i < len(row)
+                                     else '' for i in order] + [name])
+
+        kind = "relationships" if is_edge else "nodes"
+        args.append("--{}={}={}".format(kind, name, ",".join(parts)))
+
+    script_path = os.path.join(out_dir, "import.sh")
+    with open(script_path, 'w') as script:
+        script.write("#!/bin/sh\n")
+        script.write("# Usage: DATABASE=<name> ./import.sh\n")
+        script.write('cd "$(dirname "$0")"\n')
+        script.write("neo4j-admin import --database=\"${DATABASE:-neo4j}\" \\\n")
+        for arg in IMPORT_OPTIONS + args:
+            script.write("    {} \\\n".format(arg))
+        script.write('    "$@"\n')
+    os.chmod(script_path, 0o755)
+    return script_path
@@ -8,6 +8,15 @@ LOG_FILE_TEMPLATE = path.join(LOG_DIR, "chrome-audit-{0}.log")
 
 CSV_DIR = "neo4j-csvs"
 DELIM=";"
+# Output written by utils.ObjectManager: "csv", or "segment" for the compact
+# columnar format in modules/segment.py (see convert_segments.py).
+OUTPUT_FORMAT = "csv"
+# Node labels that are written once per session, no matter how often the logs
+# rotate (see utils.SeenIndex). Later sightings of a node are counted in the
+# OCCURRENCES log instead of being written again.
+DEDUP_LABELS = ("frames", "scripts", "parser", "resources", "hosts",
+                "redirect", "user", "session")
+OCCURRENCES = "occurrences"
 
 
 if RTP_EVALUATION:
@@ -16,6 +25,70 @@ else:
     stream = sys.stdout
 
 SCRIPT_CACHE = "script-cache"
+# Use the asyncio DevTools client (dev_tools.AsyncChromeInterface) instead of
+# the synchronous one. Script capture needs it.
+ASYNC_CLIENT = True
+# Fetch the source of every new script in the background (needs the async
+# DevTools client, see script_capture.ScriptCapture).
+CAPTURE_SCRIPTS = True
+CAPTURE_WORKERS = 4
+# Scripts waiting to be fetched. Once it is full, new scripts are skipped
+# (until they are parsed again) rather than blocking the message loop.
+CAPTURE_QUEUE = 1000
+# Seconds we wait for the queued scripts at shutdown.
+CAPTURE_DRAIN_TIMEOUT = 5
+# The number of frames FrameHandler keeps cached. Frames are evicted when
+# their target is destroyed or they are detached, and the least recently used
+# frames are logged and evicted once we exceed this budget.
+MAX_FRAMES = 20000
+# Requests that don't finish within REQUEST_TTL seconds (browser time) are
+# dropped by request_tracker.RequestTracker, as are the oldest requests once
+# more than MAX_REQUESTS are in flight.
+REQUEST_TTL = 300
+MAX_REQUESTS = 50000
+# Seconds manager.ChromeManager waits for a tab's process to shut down.
+TARGET_SHUTDOWN_TIMEOUT = 10
+# Parsed URLs and resource ids cached by graph.parse_url/graph.resource_id.
+URL_CACHE_SIZE = 65536
+# Rotated logs are flushed by the writer thread of writer.BackgroundWriter,
+# rotations block once WRITER_QUEUE of them are waiting.
+BACKGROUND_FLUSH = True
+WRITER_QUEUE = 16
+# Journal every row, so the rows of a segment that wasn't flushed yet can be
+# recovered after a crash (see journal.Journal and recover.py). The rows are
+# buffered; the writer thread writes and fsyncs the journals every
+# JOURNAL_SYNC_INTERVAL seconds, or once a journal has JOURNAL_BATCH rows
+# waiting.
+JOURNAL = True
+JOURNAL_DIR = "journal"
+JOURNAL_BATCH = 1024
+JOURNAL_SYNC_INTERVAL = 0.05
+# Record handler latencies and event lag (see metrics.py). They are served
+# on 127.0.0.1:METRICS_PORT and/or written to METRICS_FILE every
+# METRICS_INTERVAL seconds, if either is set.
+METRICS = True
+METRICS_PORT = None
+METRICS_FILE = None
+METRICS_INTERVAL = 15
+# Where profiling.Profiler writes its profiles, how often it samples the
+# stack (seconds) and how many functions summary.txt lists per method.
+PROFILE_DIR = "profiles"
+PROFILE_INTERVAL = 0.005
+PROFILE_TOP = 25
+# memory.MemoryReporter logs the sizes of our long-lived structures every
+# MEMORY_INTERVAL seconds, and appends them to MEMORY_DIR/<pid>.sizes.jsonl.
+# On SIGUSR1 it writes the MEMORY_TOP lines that allocated the most (see
+# tracemalloc) to MEMORY_DIR, tracing MEMORY_FRAMES frames per allocation.
+MEMORY_INTERVAL = 300
+MEMORY_DIR = "memory"
+MEMORY_TOP = 25
+MEMORY_FRAMES = 1
+# The JSON decoder of the DevTools clients: "auto" (the fastest one that is
+# installed), "orjson", "ujson" or "json".
+JSON_DECODER = "auto"
+# Record which handler created/logged each element (the who_created,
+# who_logged and handler columns). Disable in production to drop them.
+PROVENANCE = True
 LOG_LEVEL = logging.INFO
 logging.basicConfig(stream=stream, level=LOG_LEVEL)
 
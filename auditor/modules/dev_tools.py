@@ -1,14 +1,86 @@
 #!/usr/bin/python3
 
+import asyncio
 import json
+import logging
+import queue
+import threading
 import time
 
 import requests
 import websocket
 import sys
 
+from modules import common
+
 
 TIMEOUT = 2
+# How long pop_messages() may block waiting for the first event.
+POLL_TIMEOUT = 0.1
+# Chrome serializes events with their method first.
+EVENT_PREFIX = '{"method":"'
+
+
+def get_decoder(name=None):
+    """Returns the loads() of JSON decoder @name: "json", "orjson" or
+    "ujson". The default, common.JSON_DECODER, is "auto", which picks the
+    fastest one that is installed."""
+    name = name or common.JSON_DECODER
+    for candidate in (["orjson", "ujson", "json"] if name == "auto"
+                      else [name]):
+        try:
+            return __import__(candidate).loads
+        except ImportError:
+            if name != "auto":
+                raise
+    return json.loads
+
+
+def event_method(message, start=0):
+    """Returns the method of a raw event (at @start of @message), without
+    decoding it. Returns None if the event doesn't start with its method
+    (e.g., command replies)."""
+    if message.startswith(EVENT_PREFIX, start):
+        start += len(EVENT_PREFIX)
+        end = message.find('"', start)
+        if end > 0:
+            return message[start:end]
+    return None
+
+
+def decode(message, loads, subscriptions=None):
+    """Decodes the raw @message. Events whose method isn't in
+    @subscriptions are dropped (None) before they are decoded, if we can
+    tell their method from the raw message."""
+    if subscriptions is None:
+        return loads(message)
+    method = event_method(message)
+    if method is not None:
+        return loads(message) if method in subscriptions else None
+    parsed_message = loads(message)
+    if 'method' in parsed_message and \
+            parsed_message['method'] not in subscriptions:
+        return None
+    return parsed_message
+
+
+def get_version(host, port):
+    """Waits for the browser's DevTools endpoint and returns its version."""
+    connected = False
+    timer = 0
+    response = None
+    while not connected:
+        try:
+            response = requests.get(
+                'http://{}:{}/json/version'.format(host, port))
+            connected = True
+        except requests.exceptions.ConnectionError:
+            time.sleep(1)
+            timer += 10
+    if response:
+        return json.loads(response.text)
+    else:
+        raise Exception('ERROR: Connection Failed to dev tool')
 
 
 class DevToolsError(Exception):
@@ -30,7 +102,7 @@ class GenericElement(object):
 
         def generic_function(**args):
 
-            messages = self.parent.pop_messages()
+            messages = self.parent._recv_pending()
             self.parent.message_counter += 1
             message_id = int('{}{}'.format(id(self), self.parent.message_counter))
             message_id = self.parent.message_counter
@@ -43,6 +115,8 @@ class GenericElement(object):
             self.parent.ws.send(json.dumps(call_obj))
             result, err = self.parent.wait_result(message_id)
             err.extend(messages)
+            if self.parent.recorder:
+                self.parent.recorder.record_reply(func_name, result, err)
             return (result, err)
 
         return generic_function
@@ -51,54 +125,65 @@ class GenericElement(object):
 class ChromeInterface(object):
     message_counter = 0
 
-    def __init__(self, host='localhost', port=9222, tab=0, timeout=TIMEOUT, auto_connect=True):
+    def __init__(self, host='localhost', port=9222, tab=0, timeout=TIMEOUT,
+                 auto_connect=True, recorder=None):
         self.host = host
         self.port = port
         self.ws = None
         self.tabs = None
         self.timeout = timeout
+        # If set, every message we receive is written to the recorder.
+        self.recorder = recorder
+        self.loads = get_decoder()
+        # The events we handle, see subscribe().
+        self.subscriptions = None
+        self.events_dropped = 0
+
+    def subscribe(self, methods):
+        """Drops every event whose method isn't in @methods, before it is
+        decoded. None receives every event."""
+        self.subscriptions = frozenset(methods) if methods is not None \
+            else None
+
+    def _decode(self, message):
+        parsed_message = decode(message, self.loads, self.subscriptions)
+        if parsed_message is None:
+            self.events_dropped += 1
+        return parsed_message
 
     def get_tabs(self):
         response = requests.get('http://{}:{}/json'.format(self.host, self.port))
         self.tabs = json.loads(response.text)
 
     def attach_to_browser_target(self):
-        connected = False
-        timer = 0
-        response = None
-        while not connected:
-            try:
-                response = requests.get(
-                    'http://{}:{}/json/version'.format(self.host,self.port))
-                connected = True
-            except requests.exceptions.ConnectionError:
-                time.sleep(1)
-                timer += 10
-        if response:
-            self.info = json.loads(response.text)
-        else:
-            raise Exception('ERROR: Connection Failed to dev tool')
+        self.info = get_version(self.host, self.port)
         self.ws = websocket.create_connection(self.info['webSocketDebuggerUrl'])
         self.ws.settimeout(self.timeout)
-        return json.loads(response.text)
+        if self.recorder:
+            self.recorder.record_version(self.info)
+        return dict(self.info)
 
     def connect(self, tab=0, update_tabs=True):
         if update_tabs or self.tabs is None:
             self.get_tabs()
         wsurl = self.tabs[tab]['webSocketDebuggerUrl']
-        self.close()
+        if self.ws:
+            self.ws.close()
         self.ws = websocket.create_connection(wsurl)
         self.ws.settimeout(self.timeout)
 
     def connect_targetID(self, targetID):
         wsurl = 'ws://{}:{}/devtools/page/{}'.format(self.host, self.port, targetID)
-        self.close()
+        if self.ws:
+            self.ws.close()
         self.ws = websocket.create_connection(wsurl)
         self.ws.settimeout(self.timeout)
 
     def close(self):
         if self.ws:
             self.ws.close()
+        if self.recorder:
+            self.recorder.close()
 
     # Blocking
     def wait_message(self, timeout=None):
@@ -147,7 +232,9 @@ class ChromeInterface(object):
                 return ("Timeout", messages)
 
 
-            parsed_message = json.loads(message)
+            parsed_message = self._decode(message)
+            if parsed_message is None:
+                continue
 
             if 'result' in parsed_message and parsed_message['id'] == result_id:
                 matching_result = parsed_message
@@ -159,21 +246,366 @@ class ChromeInterface(object):
 
         return (matching_result, messages)
 
-    # Non Blocking
-    def pop_messages(self):
+    # Blocking
+    def wait_results(self, result_ids, received=None):
+        """Waits for the replies to all of @result_ids, in any order. If
+        @received (a dict) is given, it maps the ids to the perf_counter()
+        time their reply arrived at."""
+        messages = []
+        results = dict.fromkeys(result_ids, "Timeout")
+        remaining = set(result_ids)
+        while remaining:
+            try:
+                message = self.ws.recv()
+            except websocket._exceptions.WebSocketTimeoutException:
+                break
+
+            parsed_message = self._decode(message)
+            if parsed_message is None:
+                continue
+            if parsed_message.get('id') in remaining:
+                results[parsed_message['id']] = parsed_message
+                remaining.remove(parsed_message['id'])
+                if received is not None:
+                    received[parsed_message['id']] = time.perf_counter()
+            else:
+                messages.append(parsed_message)
+
+        return ([results[i] for i in result_ids], messages)
+
+    # Blocking
+    def batch(self, calls, timings=None):
+        """Pipelines @calls, a list of (method, params), on the socket.
+
+        Every command is sent before we wait for any reply, so the batch
+        costs a single round trip. Returns (results, msgs). If @timings (a
+        list) is given, it receives the perf_counter() time each reply
+        arrived at (None if it timed out).
+        """
+        messages = self._recv_pending()
+        result_ids = []
+        for method, params in calls:
+            params = dict(params)
+            self.message_counter += 1
+            call_obj = {'id': self.message_counter, 'method': method,
+                        'params': params}
+            session_id = params.pop('sessionId', None)
+            if session_id:
+                call_obj['sessionId'] = session_id
+            self.ws.send(json.dumps(call_obj))
+            result_ids.append(self.message_counter)
+
+        received = dict()
+        results, err = self.wait_results(result_ids, received)
+        err.extend(messages)
+        if timings is not None:
+            timings.extend(received.get(i) for i in result_ids)
+        if self.recorder and not calls:
+            self.recorder.record_events(err)
+        elif self.recorder:
+            # The events are kept with the batch's last reply.
+            for i, ((method, params), result) in enumerate(zip(calls, results)):
+                self.recorder.record_reply(
+                    method, result, err if i == len(calls) - 1 else [])
+        return (results, err)
+
+    def pop_messages(self, timeout=POLL_TIMEOUT):
+        """Returns the pending events, waiting up to @timeout for the first
+        (0 doesn't wait)."""
+        messages = self._recv_pending(timeout)
+        if self.recorder:
+            self.recorder.record_events(messages)
+        return messages
+
+    def _recv_pending(self, timeout=0):
         messages = []
+        if timeout:
+            # Block until the first message, so an idle loop doesn't spin.
+            self.ws.settimeout(timeout)
+            try:
+                parsed_message = self._decode(self.ws.recv())
+                if parsed_message is not None:
+                    messages.append(parsed_message)
+            except websocket._exceptions.WebSocketTimeoutException:
+                self.ws.settimeout(self.timeout)
+                return messages
         self.ws.settimeout(0)
         while True:
             try:
                 message = self.ws.recv()
-                parsed_message = json.loads(message)
-                messages.append(parsed_message)
+                parsed_message = self._decode(message)
+                if parsed_message is not None:
+                    messages.append(parsed_message)
             except BlockingIOError:
                 break
         self.ws.settimeout(self.timeout)
         return messages
 
+    def notify(self, method, **params):
+        """Sends a command whose reply we don't need. The reply of the next
+        command could be mistaken for it, so we still wait for it."""
+        domain, name = method.split('.', 1)
+        return getattr(getattr(self, domain), name)(**params)
+
     def __getattr__(self, attr):
         genericelement = GenericElement(attr, self)
         self.__setattr__(attr, genericelement)
         return genericelement
+
+
+class AsyncElement(object):
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+
+    def __getattr__(self, attr):
+        func_name = '{}.{}'.format(self.name, attr)
+
+        def generic_function(**args):
+            return self.parent.call(func_name, **args)
+
+        return generic_function
+
+
+class AsyncChromeInterface(object):
+    """An asyncio DevTools client with pipelined commands.
+
+    A single reader receives every message from the browser. Replies resolve
+    the future registered under their message id and events are queued, so
+    any number of commands can be in flight while events keep flowing in.
+    The event loop runs in a background thread. Coroutines can await
+    send(), while synchronous code uses submit() (returns a future) or the
+    ChromeInterface-compatible chrome.Domain.method(**params) calls, which
+    block only the caller, never the reader.
+
+    NOTE: websocket-client has no asyncio support, so the reader blocks in
+    ws.recv() on its own thread and hands replies over to the loop.
+    """
+
+    # Queued by the reader once the websocket is closed.
+    CLOSED = object()
+
+    def __init__(self, host='localhost', port=9222, timeout=TIMEOUT,
+                 recorder=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.recorder = recorder
+        self.ws = None
+        self.info = None
+        self.message_counter = 0
+        self.pending = dict()
+        self.events = queue.Queue()
+        self.lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = None
+        self.reader_thread = None
+        self.closed = False
+        self.loads = get_decoder()
+        # The events we handle, see subscribe().
+        self.subscriptions = None
+        self.events_dropped = 0
+        # Messages we couldn't decode.
+        self.malformed = 0
+        self.log = logging.getLogger("AsyncChromeInterface")
+
+    def subscribe(self, methods):
+        """Drops every event whose method isn't in @methods, before it is
+        decoded. None receives every event."""
+        self.subscriptions = frozenset(methods) if methods is not None \
+            else None
+
+    def attach_to_browser_target(self):
+        self.info = get_version(self.host, self.port)
+        self.ws = websocket.create_connection(self.info['webSocketDebuggerUrl'])
+        if self.recorder:
+            self.recorder.record_version(self.info)
+        self._start()
+        return dict(self.info)
+
+    def _start(self):
+        """Starts the loop and the reader on the connected self.ws."""
+        self.loop_thread = threading.Thread(target=self.loop.run_forever,
+                                            name="devtools-loop", daemon=True)
+        self.loop_thread.start()
+        self.reader_thread = threading.Thread(target=self._reader,
+                                              name="devtools-reader",
+                                              daemon=True)
+        self.reader_thread.start()
+
+    def _reader(self):
+        """Receives messages until the websocket is closed."""
+        try:
+            while True:
+                try:
+                    message = self.ws.recv()
+                except (websocket._exceptions.WebSocketException, OSError):
+                    break
+                if not message:
+                    continue
+
+                try:
+                    parsed_message = decode(message, self.loads,
+                                            self.subscriptions)
+                    if parsed_message is not None and \
+                            not isinstance(parsed_message, dict):
+                        raise ValueError("not an object")
+                except (ValueError, TypeError) as e:
+                    self.malformed += 1
+                    self.log.error("Skipping a malformed message: {}".format(e))
+                    continue
+                if parsed_message is None:
+                    self.events_dropped += 1
+                    continue
+                if 'id' in parsed_message:
+                    with self.lock:
+                        future = self.pending.pop(parsed_message['id'], None)
+                    if future:
+                        self.loop.call_soon_threadsafe(self._resolve, future,
+                                                       parsed_message)
+                else:
+                    self.events.put(parsed_message)
+        finally:
+            # Whatever stopped us, nobody may wait for a reply forever.
+            self.closed = True
+            self.events.put(self.CLOSED)
+            if self.loop.is_running():
+                self.loop.call_soon_threadsafe(self._fail_pending)
+
+    @staticmethod
+    def _resolve(future, result):
+        if not future.done():
+            future.set_result(result)
+
+    def _fail_pending(self):
+        with self.lock:
+            futures = list(self.pending.values())
+            self.pending.clear()
+        for future in futures:
+            self._resolve(future, "Timeout")
+
+    def _stop_when_idle(self):
+        """Stops the loop once the commands in flight have returned."""
+        all_tasks = getattr(asyncio, 'all_tasks', None) or \
+            asyncio.Task.all_tasks
+        if any(not task.done() for task in all_tasks(self.loop)):
+            self.loop.call_later(0.01, self._stop_when_idle)
+        else:
+            self.loop.stop()
+
+    async def send(self, method, sessionId=None, **params):
+        """Sends a command and returns its reply ("Timeout" if none)."""
+        if self.closed:
+            raise websocket._exceptions.WebSocketConnectionClosedException(
+                "Connection is already closed.")
+
+        future = self.loop.create_future()
+        call_obj = {'method': method, 'params': params}
+        if sessionId:
+            call_obj['sessionId'] = sessionId
+        with self.lock:
+            self.message_counter += 1
+            message_id = self.message_counter
+            call_obj['id'] = message_id
+            self.pending[message_id] = future
+        self.ws.send(json.dumps(call_obj))
+
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                self.pending.pop(message_id, None)
+            return "Timeout"
+
+    async def _timed_send(self, method, **params):
+        """Returns the reply to a command and when it arrived."""
+        result = await self.send(method, **params)
+        return (result, time.perf_counter())
+
+    def submit(self, method, **params):
+        """Sends a command from outside the loop, returns a future."""
+        if self.closed or not self.loop.is_running():
+            # The future would never be resolved.
+            raise websocket._exceptions.WebSocketConnectionClosedException(
+                "Connection is already closed.")
+        return asyncio.run_coroutine_threadsafe(self.send(method, **params),
+                                                self.loop)
+
+    def notify(self, method, **params):
+        """Sends a command whose reply we don't need, without waiting for
+        it. A recording gets a "Pending" reply in its place."""
+        future = self.submit(method, **params)
+        future.add_done_callback(lambda f: self._check_reply(method, f))
+        if self.recorder:
+            self.recorder.record_reply(method, "Pending", [])
+        return ("Pending", [])
+
+    def _check_reply(self, method, future):
+        result = future.result()
+        if not isinstance(result, dict) or 'error' in result:
+            self.log.error("{} failed: {}".format(method, result))
+
+    def call(self, method, **params):
+        """Blocking call, compatible with ChromeInterface's (result, msgs).
+
+        Events are never returned here, they stay queued for pop_messages().
+        """
+        result = self.submit(method, **params).result()
+        if self.recorder:
+            self.recorder.record_reply(method, result, [])
+        return (result, [])
+
+    def batch(self, calls, timings=None):
+        """Issues @calls, a list of (method, params), concurrently.
+
+        Returns (results, msgs), like ChromeInterface.batch.
+        """
+        futures = [asyncio.run_coroutine_threadsafe(
+                       self._timed_send(method, **params), self.loop)
+                   for method, params in calls]
+        results = list()
+        for future in futures:
+            result, received = future.result()
+            results.append(result)
+            if timings is not None:
+                timings.append(received if result != "Timeout" else None)
+        if self.recorder:
+            for (method, params), result in zip(calls, results):
+                self.recorder.record_reply(method, result, [])
+        return (results, [])
+
+    def pop_messages(self, timeout=POLL_TIMEOUT):
+        """Returns the queued events, waiting up to @timeout for the first."""
+        messages = []
+        try:
+            m = self.events.get(timeout=timeout)
+            while True:
+                if m is self.CLOSED:
+                    self.events.put(self.CLOSED)
+                    break
+                messages.append(m)
+                m = self.events.get_nowait()
+        except queue.Empty:
+            pass
+
+        if self.recorder:
+            self.recorder.record_events(messages)
+        if not messages and self.closed:
+            raise websocket._exceptions.WebSocketConnectionClosedException(
+                "Connection is already closed.")
+        return messages
+
+    def close(self):
+        self.closed = True
+        if self.ws:
+            # The reader fails the commands in flight.
+            self.ws.close()
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self._stop_when_idle)
+        if self.recorder:
+            self.recorder.close()
+
+    def __getattr__(self, attr):
+        element = AsyncElement(attr, self)
+        self.__setattr__(attr, element)
+        return element
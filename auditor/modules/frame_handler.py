@@ -2,11 +2,12 @@
 FrameHandler -- Maintains the state of frames during the auditing.
 """
 import copy
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from modules import common
 from modules import graph as g
 from modules import utils
 from modules import base
+from modules import script_handler
 import json, pprint
 
 class FrameHandlerError(Exception):
@@ -18,16 +19,32 @@ class FrameHandler(base.ObjectHandler):
 
     instance = None
 
-    def __init__(self, handler, debug=True):
-        """Initializes a FrameCache for a Handler class.."""
+    def __init__(self, handler, debug=True, max_frames=None):
+        """Initializes a FrameCache for a Handler class..
+
+        @max_frames -- The number of frames we cache, defaults to
+                       common.MAX_FRAMES.
+        """
 
         if self.instance:
             raise FrameHandleError("A Frame handler already exists.")
 
         id_ = 'frame-handler-{}'.format(handler.handler_id)
         super().__init__(id_, handler, debug)
-        self.entries = dict()
+        # frame_id -> Frame, ordered from least to most recently used.
+        self.entries = OrderedDict()
+        # frame_id -> the frame_ids of its attached children.
+        self.children = defaultdict(set)
+        self.max_frames = max_frames or common.MAX_FRAMES
+        self.high_water = 0
+        # Frames evicted because their target/frame went away, and because
+        # we exceeded max_frames.
+        self.evicted = 0
+        self.lru_evicted = 0
         FrameHandler.instance = self
+        # Logs the scripts of every frame, it handles the messages after us.
+        self.script_handler = script_handler.ScriptHandler(self)
+        self.register_subhandler(self.script_handler)
 
         #NOTE: We flush the framehandler every 1000 frames.
         self.flush_threshold = 100
@@ -59,10 +76,13 @@ class FrameHandler(base.ObjectHandler):
         frame = self.emplace(frame_id)
         # Get a reference to the frame's opener.                                
         if info['type'] == 'page' and info['url'] and 'openerId' in info:
-            assert(info['openerId'] in self.entries), m
             opener = self.get_frame(info['openerId'])
-            self.log.debug("Opener Frame {}".format(opener))
-            frame.opener = opener
+            # The opener may have been evicted already.
+            if opener:
+                self.log.debug("Opener Frame {}".format(opener))
+                frame.opener = opener
+            else:
+                self.log.warning("Opener isn't cached: {}".format(m))
         frame.observed_creation = True
 
         if info['url']:
@@ -93,20 +113,34 @@ class FrameHandler(base.ObjectHandler):
         # not be provided. In this case, we bootstrap the state of the frame
         # by quering the frame tree, which will provide us with the loaderID.
         # After that we also set the has_navigated and has_attached flags.
-        result, msgs = self.chrome.Page.getFrameTree(sessionId=p['sessionId'])
-        self.handler.messages.extend(msgs)
+        # Fetched when we attached to it, unless we weren't the ones.
+        trees = getattr(self.handler, 'frame_trees', None)
+        result = trees.pop(frame_id, None) if trees else None
+        if result is None:
+            result, msgs = self.chrome.Page.getFrameTree(
+                sessionId=p['sessionId'])
+            self.handler.messages.extend(msgs)
+        if not isinstance(result, dict) or 'result' not in result:
+            self.log.warning("No frame tree for {}: {}".format(frame_id,
+                                                               result))
+            return
         #XXX: We many need to recursively call this. 
         root = result['result']['frameTree']['frame']
         frame = g.Frame.from_m({'params' : {'frame' : root}})
         frame.has_navigated = True
         frame.has_attached = True
 
-        self.entries[frame.frame_id] = frame
+        self._insert(frame)
 
     def handle_frame_attached(self, m):
         p = m['params']
         parent = self.get_frame(p['parentFrameId'])
-        assert(parent), "Parent doesn't exist: {}".format(m)
+        if not parent:
+            # This used to be an assert, but since the cache is bounded the
+            # LRU pass of _insert may have evicted the parent of a perfectly
+            # valid event. Warn and start a new version of it instead.
+            self.log.warning("Parent isn't cached: {}".format(m))
+            parent = self.emplace(p['parentFrameId'])
         child = self.emplace(p['frameId'])
         assert(not child.parent
                or child.parent.frame_id == p['parentFrameId']), \
@@ -114,6 +148,19 @@ class FrameHandler(base.ObjectHandler):
         child.creator = utils.get_caller_from_stack(m)
         child.parent = parent
         child.has_attached = True
+        self.children[parent.frame_id].add(child.frame_id)
+
+    def handle_frame_detached(self, m):
+        p = m['params']
+        # A swapped frame lives on in another (out-of-process) target.
+        if p.get('reason') == 'swap':
+            return
+        self.evict(p['frameId'])
+
+    def handle_target_destroyed(self, target_id):
+        """The target is gone, so its frames won't receive any more events.
+        The main frame of a target has the same id as the target."""
+        self.evict(target_id)
 
     def handle_frame_navigated(self, m):
         p = m['params']
@@ -131,9 +178,12 @@ class FrameHandler(base.ObjectHandler):
             # high-priority network requests). Therefore, we just treat it as a
             # special case. Since it is just for iframes, it is not a major
             # issue. 
-            assert(frame.properties['url'] ==  'about:blank')
+            # Other urls used to be asserted against, but now the LRU pass of
+            # _insert may have evicted the frame, so we only warn.
+            if frame.properties['url'] != 'about:blank':
+                self.log.warning("Navigated frame isn't cached: {}".format(m))
             frame.has_navigated = True
-            self.entries[frame.frame_id] = frame
+            self._insert(frame)
         elif current == frame:
             # We don't need to log here.
             assert(current.loader_id == frame.loader_id)
@@ -159,6 +209,9 @@ class FrameHandler(base.ObjectHandler):
             frame.has_navigated = True
             self.entries[frame.frame_id] = frame
 
+        # Now that we know its loader id, log the scripts the frame parsed.
+        self.script_handler.flush(self.get_frame(f['id']))
+
     def _handle_redirect_request(self, m, frame):
         # If the frame's loader_id is 0, this indicates that an iframe
         # probably made the request, and *shouldn't* redirect
@@ -179,6 +232,9 @@ class FrameHandler(base.ObjectHandler):
 
     def handle_request_sent(self, m):
         p = m['params']
+        if not p.get('frameId'):
+            # E.g., a service worker's request.
+            return
         initiator = p['initiator']
         request = p['request']
         frame = self.get_frame(p['frameId'])
@@ -241,8 +297,6 @@ class FrameHandler(base.ObjectHandler):
         frame.properties['scripts_parsed'] += 1
         frame.exec_context = str(int(p['executionContextId']))
         frame.scripts.add(p['scriptId'])
-        # Add message to the frame's script message queue.
-        frame.script_messages.append(m)
 
     def emplace(self, frame_id, loader_id=0):
         """Get a frame and insert it if it's new."""
@@ -253,18 +307,96 @@ class FrameHandler(base.ObjectHandler):
 
     def get_frame(self, frame_id):
         """ Get frame if in frame cache."""
-        frame = self.entries[frame_id] if frame_id in self.entries else None
+        frame = self.entries.get(frame_id)
+        if frame is not None:
+            self.entries.move_to_end(frame_id)
         return frame
 
     def add_new_frame(self, frame_id, loader_id=0):
         """Add a new frame it it doesn't exist."""
         assert(frame_id not in self.entries)
         frame = g.Frame(frame_id, loader_id)
-        self.entries[frame_id] = frame
+        self._insert(frame)
+        return frame
+
+    def _insert(self, frame):
+        """Caches a new frame, evicting the least recently used frames (and
+        their descendants) if we are over budget.
+
+        NOTE: An evicted frame is logged, and frames are only written once per
+              session (see common.DEDUP_LABELS). If it shows up again with the
+              same loader id, e.g., a frameAttached under an evicted parent,
+              we cache a new Frame, but its row only counts as an occurrence;
+              its edges are still logged.
+        """
+        self.entries[frame.frame_id] = frame
+        # The main frames of the targets we are attached to are never evicted,
+        # since their children can't be attached without them.
+        pinned = getattr(self.handler, 'targets_attached', ())
+        skipped = 0
+        while len(self.entries) - skipped > self.max_frames:
+            frame_id = next(iter(self.entries))
+            if frame_id in pinned:
+                self.entries.move_to_end(frame_id)
+                skipped += 1
+                continue
+            self.log.debug("Frame cache is full, evicting {}".format(frame_id))
+            # Don't take the frame we are inserting down with its ancestor.
+            keep = set(pinned)
+            keep.add(frame.frame_id)
+            self.lru_evicted += self._evict_subtree(frame_id, keep)
+        if len(self.entries) > self.high_water:
+            self.high_water = len(self.entries)
+
+    def _evict_frame(self, frame_id):
+        """Logs the frame (if needed) and removes it from the cache."""
+        frame = self.entries.pop(frame_id)
+        self.children.pop(frame_id, None)
+        if not frame.is_logged:
+            frame.log(self)
+        if frame.parent:
+            siblings = self.children.get(frame.parent.frame_id)
+            if siblings:
+                siblings.discard(frame_id)
         return frame
 
-    def handle_shutdown(self):
+    def _evict_subtree(self, frame_id, keep=()):
+        """Logs and evicts a frame and all of its descendants, except for
+        the ones in @keep. Returns the number of frames evicted."""
+        evicted = 0
+        pending = [frame_id]
+        while pending:
+            frame_id = pending.pop()
+            pending.extend(child for child in self.children.pop(frame_id, ())
+                           if child not in keep)
+            if frame_id in self.entries:
+                self._evict_frame(frame_id)
+                evicted += 1
+        return evicted
+
+    def evict(self, frame_id):
+        """Logs and evicts a finished frame and all of its descendants."""
+        self.evicted += self._evict_subtree(frame_id)
+
+    def stats(self):
+        return {"live": len(self.entries), "high_water": self.high_water,
+                "evicted": self.evicted, "lru_evicted": self.lru_evicted}
+
+    def shutdown(self, m=None):
+        """Logs the frames we haven't logged yet, then shuts the
+        ScriptHandler down and flushes our logs."""
         for entry in self.entries.values():
             if not entry.is_logged:
                 entry.log(self)
-        self.flush_all(exiting=True)
+        base.ObjectHandler.shutdown(self, m)
+
+    handlers = {
+        "Target.targetCreated" : handle_target_created,
+        "Target.attachedToTarget" : handle_attached_to_target,
+        "Page.frameAttached" : handle_frame_attached,
+        "Page.frameNavigated" : handle_frame_navigated,
+        "Page.frameDetached" : handle_frame_detached,
+        "Network.requestWillBeSent" : handle_request_sent,
+        "Network.responseReceived" : handle_response_received,
+        "Debugger.scriptParsed" : handle_script_parsed,
+    }
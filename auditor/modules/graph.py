@@ -1,10 +1,12 @@
 import uuid
 import hashlib
 import base64
+import functools
+import sys
 from urllib.parse import urlparse
+from modules import common
 from modules import utils
 from modules import frame_handler
-from modules import script_handler
 
 
 NET_EDGE = "network-edges"
@@ -32,6 +34,9 @@ REDIRECT = "redirect"
 USER = "user"
 SESSION = "session"
 STARTED = "started"
+VERSION = "Version"
+TARGET = "targets"
+TARGET_EDGE = "target-edges"
 
 
 def add_properties(str_in, properties):
@@ -42,6 +47,42 @@ def add_properties(str_in, properties):
     return str_out
 
 
+def intern(value):
+    """Interns the strings repeated across many elements (frame ids, loader
+    ids, domains, ...), so the live elements share a single copy."""
+    return sys.intern(value) if type(value) is str else value
+
+
+@functools.lru_cache(maxsize=common.URL_CACHE_SIZE)
+def parse_url(url):
+    """Returns the (domain, path) of @url.
+
+    The same (CDN) URLs are requested over and over again, so we cache the
+    parsed URLs instead of calling urlparse for every request/response.
+    """
+    parsed = urlparse(url)
+    return intern(parsed.netloc), parsed.path
+
+
+@functools.lru_cache(maxsize=common.URL_CACHE_SIZE)
+def resource_id(path):
+    """Returns the id of the Resource at @path (domain + path)."""
+    return hashlib.sha256(str.encode(path)).hexdigest()
+
+
+def url_cache_info():
+    """Returns the hit rate of parse_url's and resource_id's caches."""
+    info = dict()
+    for func in [parse_url, resource_id]:
+        stats = func.cache_info()
+        lookups = stats.hits + stats.misses
+        info[func.__name__] = {
+            "hits": stats.hits, "misses": stats.misses,
+            "size": stats.currsize,
+            "hit_rate": stats.hits / lookups if lookups else 0.0}
+    return info
+
+
 class GraphError(Exception):
     pass
 
@@ -52,6 +93,19 @@ class ElementError(Exception):
 
 
 class Edge(object):
+    # Graph elements are created for every message, so they use __slots__
+    # instead of a __dict__. Everything that is logged lives in properties,
+    # which is still a per-instance dict: the keys vary per element (e.g.,
+    # the provenance columns and the optional properties), so there is no
+    # fixed per-label schema, and the loggers encode a row by looking up
+    # each of their columns in it.
+    __slots__ = ('start', 'end', 'label', 'type', 'id', 'debug', 'properties')
+
+    # The columns we expect, in order. They only seed the header of the log,
+    # so it doesn't need to be fixed up when a column shows up mid-stream;
+    # an element may have more (or fewer) properties.
+    columns = ('start', 'end', 'global_session_id')
+
     def __init__(self, start, end, label=None, id=None, type=None, debug=True):
         self.start = start
         self.debug = debug
@@ -60,12 +114,11 @@ class Edge(object):
         self.type = type
         self.id = "{}-{}:{}->{}".format(label, id, start, end)
         self.properties = dict()
-        self.p = self.properties
         self.properties['start'] = self.start
         self.properties['end'] = self.end
         self.properties['global_session_id'] = Session.Instance().get_session_id()
 
-        if self.debug:
+        if self.debug and common.PROVENANCE:
             self.properties['who_created'] = utils.which_handler()
 
     def to_row(self):
@@ -80,22 +133,29 @@ class Edge(object):
     def __hash__(self):
         return hash(self.start  + self.end)
 
+    @property
+    def p(self):
+        return self.properties
+
     def __getattr__(self, attr):
-        if attr in self.__dict__:
-            return self.__dict__[attr]
-        elif attr in self.properties:
+        # Only called for attributes that aren't slots, i.e., properties.
+        if attr == 'properties':
+            raise AttributeError(attr)
+        try:
             return self.properties[attr]
-        else:
-            raise AttributeError
+        except KeyError:
+            raise AttributeError(attr)
 
     def log(self, log_handle):
-        if self.debug:
+        if self.debug and common.PROVENANCE:
             self.properties['who_logged'] = utils.which_handler()
         log_handle.add(self.label, self)
 
 E = Edge
 
 class DownloadEdge(Edge):
+    __slots__ = ()
+    columns = Edge.columns + ('domain', 'path')
 
     def __init__(self, path, frame):
         super().__init__(frame.id, path, DOWNLOAD)
@@ -104,19 +164,20 @@ class DownloadEdge(Edge):
     def from_m(cls, m):
         p = m['params']
         frame_id = p['frameId']
-        url = urlparse(p['url'])
-        domain = url.netloc
         #XXX. This is the path on the remote server.
-        path = url.path
+        domain, path = parse_url(p['url'])
 
         frame = frame_handler.FrameHandler.GetFrame(frame_id)
         edge = DownloadEdge(path, frame)
         edge.properties['domain'] = domain
-        edge.properties['path'] = url.path
+        edge.properties['path'] = path
         return edge
 
 class ResponseEdge(Edge):
     """(host)<-[:LOCATION]-(resource)<-[:RESPONSE]-(script)"""
+    __slots__ = ('host',)
+    columns = Edge.columns + ('status', 'rip', 'encodedDataLength', 'duration',
+                              'errorText', 'canceled')
 
     def __init__(self, request):
         super().__init__(request.end, request.start, "Response",
@@ -144,10 +205,15 @@ class ResponseEdge(Edge):
 
 class RequestEdge(Edge):
     """(frame)-[:COMPILE]->(script)-[:request]->(resource)"""
+    __slots__ = ('script', 'resource')
+    columns = Edge.columns + ('requestId', 'method', 'timestamp', 'wallTime',
+                              'hasUserGesture', 'type')
 
     def __init__(self, script_id, resource, request_id, debug=True):
         super().__init__(script_id, resource, "Request", request_id)
-        if self.debug:
+        self.script = None
+        self.resource = None
+        if self.debug and common.PROVENANCE:
             self.properties['who_created'] = utils.which_handler()
 
     @classmethod
@@ -170,8 +236,8 @@ class RequestEdge(Edge):
             script = Parser(p['frameId'], p['loaderId'])
             script.properties['scriptId'] = script.id
         else:
+            # E.g., "other": there is no script, so it has no url.
             script = Script(i['type'], p['frameId'], p['loaderId'])
-            script.url = "None"
 
         # Resource
         resource = Resource.from_request_m(m)
@@ -201,6 +267,7 @@ class RequestEdge(Edge):
 
 class OpenedEdge(Edge):
     """(parent-frame)-[:OPENED]->(child-frame)"""
+    __slots__ = ()
 
     def __init__(self, parent, child):
         super().__init__(parent.id, child.id, OPENED)
@@ -208,12 +275,15 @@ class OpenedEdge(Edge):
 
 class ParentChildEdge(Edge):
     """ (parent)-[:PARENT]->(child) """
+    __slots__ = ()
 
     def __init__(self, parent, child):
         super().__init__(parent.id, child.id, PARENT)
 
 
 class FrameAttached(Edge):
+    __slots__ = ()
+    columns = Edge.columns + ('scriptId', 'url')
 
     def __init__(self, frame, parent):
         super().__init__(parent.id, frame.id, FRAME_ATTACHED)
@@ -235,21 +305,30 @@ class FrameAttached(Edge):
 
 
 class FrameNavigated(Edge):
+    __slots__ = ()
+    columns = Edge.columns + ('transitionType', 'reason', 'destination')
+
     def __init__(self, prev_version, frame):
         super().__init__(prev_version.id, frame.id, NAVIGATED)
         if frame.transition_type:
             self.properties['transitionType'] = frame.transition_type
 
 class CreatedFrame(Edge):
+    __slots__ = ()
+
     def __init__(self, frame, creator_id):
         super().__init__(frame.id, creator_id, CREATED)
 
 class SessionEdge(Edge):
+    __slots__ = ()
+
     def __init__(self, user_id, session_id):
         super().__init__(user_id, session_id, STARTED)
 
 
 class Record(object):
+    __slots__ = ('id', 'label', 'debug', 'properties')
+    columns = ('id', 'global_session_id')
 
     def __init__(self, record_id, label, debug=True):
         self.id = record_id
@@ -259,7 +338,7 @@ class Record(object):
         self.properties['id'] = self.id
         self.properties['global_session_id'] = Session.Instance().get_session_id()
 
-        if self.debug:
+        if self.debug and common.PROVENANCE:
             self.properties['who_created'] = utils.which_handler()
 
     def __eq__(self, other):
@@ -271,16 +350,23 @@ class Record(object):
     def __str__(self):
         return "{}: {}".format(self.id, self.properties)
 
+    @property
+    def p(self):
+        return self.properties
+
     def to_row(self):
         return zip(*[("id", self.id)] + list(self.properties.items()))
 
     def log(self, log_handle):
-        if self.debug:
+        if self.debug and common.PROVENANCE:
             self.properties['who_logged'] = utils.which_handler()
         log_handle.add(self.label, self)
 
 
 class RedirectRecord(Record):
+    __slots__ = ()
+    columns = Record.columns + ('scriptId', 'oldLoaderId', 'newLoaderId',
+                                'frameId')
 
     def __init__(self, record_id, debug=True):
         super().__init__(record_id, REDIRECT)
@@ -300,16 +386,18 @@ class RedirectRecord(Record):
         return record
 
 class Node(object):
+    __slots__ = ('id', 'debug', 'properties')
+    label = "Node"
+    columns = ('id', 'global_session_id')
+
     def __init__(self, node_id=None, debug=True):
-        self.label = "Node"
         self.debug = debug
         self.id = node_id
         self.properties = dict()
-        self.p = self.properties
         self.properties['id'] = self.id
         self.properties['global_session_id'] = Session.Instance().get_session_id()
 
-        if self.debug:
+        if self.debug and common.PROVENANCE:
             self.properties['who_created'] = utils.which_handler()
 
 
@@ -322,30 +410,39 @@ class Node(object):
     def __str__(self):
         return "{}: {}".format(self.id, self.properties)
 
+    @property
+    def p(self):
+        return self.properties
+
     def __getattr__(self, attr):
-        if attr in self.__dict__:
-            return self.__dict__[attr]
-        elif attr in self.properties:
+        # Only called for attributes that aren't slots, i.e., properties.
+        if attr == 'properties':
+            raise AttributeError(attr)
+        try:
             return self.properties[attr]
-        else:
-            raise AttributeError
+        except KeyError:
+            raise AttributeError(attr)
 
     def to_row(self):
         return zip(*[("id", self.id)] + list(self.properties.items()))
 
     def log(self, log_handle):
-        if self.debug:
+        if self.debug and common.PROVENANCE:
             self.properties['who_logged'] = utils.which_handler()
         log_handle.add(self.label, self)
 
 
 class Script(Node):
+    __slots__ = ()
+    label = SCRIPT
+    columns = Node.columns + ('frameId', 'loaderId', 'scriptId', 'exec_context',
+                              'url', 'hash')
+
     #XXX: Remove loader_id
     def __init__(self, script_id, frame_id, loader_id=None):
         super().__init__("{}-{}-{}".format(script_id, frame_id, loader_id))
-        self.label = SCRIPT
-        self.properties['frameId'] = frame_id
-        self.properties['loaderId'] = loader_id
+        self.properties['frameId'] = intern(frame_id)
+        self.properties['loaderId'] = intern(loader_id)
         self.properties['scriptId'] = script_id
 
     @classmethod
@@ -357,6 +454,15 @@ class Script(Node):
         script.p['hash']= p['hash']
         return script
 
+    @classmethod
+    def from_record(cls, record, frame_id, loader_id):
+        """Creates a script from a script_handler.ScriptRecord."""
+        script = Script(record.script_id, frame_id, loader_id)
+        script.p['exec_context'] = record.exec_context
+        script.p['url'] = record.url
+        script.p['hash'] = record.hash
+        return script
+
     @classmethod
     def get_id(cls, frame_uuid, script_id):
         return "{}-{}".format(frame_uuid, script_id)
@@ -374,17 +480,52 @@ class Script(Node):
 
 
 class Parser(Node):
+    __slots__ = ()
+    label = PARSER
+    columns = Node.columns + ('frameId', 'loaderId', 'scriptId')
+
     def __init__(self, frame_id, loader_id):
         super().__init__("parser-{}-{}".format(frame_id, loader_id))
-        self.label = PARSER
-        self.properties['frameId'] = frame_id
-        self.properties['loaderId'] = loader_id
+        self.properties['frameId'] = intern(frame_id)
+        self.properties['loaderId'] = intern(loader_id)
+
+class TargetEdge(Edge):
+    """(opener-tab)-[:TARGET_EDGE]->(tab), see manager.ChromeManager."""
+    __slots__ = ()
+
+    def __init__(self, opener_id, target_id):
+        super().__init__(opener_id, target_id, TARGET_EDGE)
+
+
+def new_browsing_session(session_id, user_agent, user_id, log_handle):
+    """Creates and logs the Session, its User and the edge between them."""
+    session = Session(session_id, user_agent)
+    session.log(log_handle)
+    user = User(user_id)
+    user.log(log_handle)
+    SessionEdge(user_id, session_id).log(log_handle)
+    return session
+
 
 class VersionEdge(Edge):
+    __slots__ = ()
+
     def __init__(self, prev_version, frame):
-        super().__init__(prev_version.id, frame.id, "Version")
+        super().__init__(prev_version.id, frame.id, VERSION)
 
 class Frame(Node):
+    __slots__ = ('parent', 'scripts', 'observed_creation', 'prev_version',
+                 'who_created', 'has_navigated', 'has_parsed', 'has_attached',
+                 'network_set_loader', 'navigated_from', 'network_inserted',
+                 'transition_type', 'destination_url', 'exec_context',
+                 'opener', 'creator', 'is_logged', '_loader_id',
+                 'pending_scripts')
+    label = FRAME
+    columns = Node.columns + ('frame_id', 'loader_id', 'requests', 'responses',
+                              'scripts_parsed', 'type', 'url', 'title',
+                              'securityOrigin', 'mimeType', 'name',
+                              'exec_context')
+
     def __init__(self, frame_id, loader_id, debug=True):
         super().__init__("{}-{}".format(frame_id, loader_id))
         #The Frame class has became a lot more complex and 
@@ -393,7 +534,6 @@ class Frame(Node):
         # TODO: Determine the fields that are still necessary.
         # TODO: Organize/Comment the fields
         # TODO: Clean up the Frame object.
-        self.label = FRAME
         self.parent = None
         self.scripts = set()
         self.observed_creation = False
@@ -411,19 +551,17 @@ class Frame(Node):
         self.opener = False
         self.creator = None
         self.is_logged = False
-        self._loader_id = loader_id
-        self.properties['frame_id'] = frame_id
+        self._loader_id = intern(loader_id)
+        self.properties['frame_id'] = intern(frame_id)
         self.properties['loader_id'] = self._loader_id
         self.properties['requests'] = 0
         self.properties['responses'] = 0
         self.properties['scripts_parsed'] = 0
-        # Message queues: In some cases, we don't know enough information
-        # about the Frame yet to handle some messages. For example, in some
-        # cases we may learn that a script was parsed by this frame prior to 
-        # learning the loaderId. Due to this, we can properly attribute the
-        # script to a specific Frame. To address this, we rely on stashing 
-        # the messages and then parsing them at a later time.
-        self.script_messages = list()
+        # In some cases, we may learn that a script was parsed by this frame
+        # prior to learning the loaderId. Due to this, we can't attribute the
+        # script to a specific Frame yet. To address this, the ScriptHandler
+        # stashes a script_handler.ScriptRecord here and logs it later.
+        self.pending_scripts = list()
 
 
     @classmethod
@@ -445,22 +583,17 @@ class Frame(Node):
     def loader_id(self, value):
         # The loader id may change from time-to-time. So we need to update the
         # node's ID when this occurs.
-        self._loader_id = value
-        self.properties['loader_id'] = value
+        self._loader_id = intern(value)
+        self.properties['loader_id'] = self._loader_id
         # Update ID if loader id changes.
         self.id = "{}-{}".format(self.frame_id, self.loader_id)
         self.properties['id'] = self.id
 
 
     def log_script_msgs(self):
-        """Handle all the script messages place in queue."""
-
-        if not self.script_messages:
-            return
-        handler = script_handler.ScriptHandler(self.handler, self)
-        for m in self.script_messages:
-            handler.run_cycle(m)
-        handler.shutdown()
+        """Log the scripts we stashed before we knew the loader id."""
+        if self.pending_scripts:
+            frame_handler.FrameHandler.Instance().script_handler.flush(self)
 
     def log(self, log_handle):
         """We log the frame as is, and bump the version."""
@@ -487,13 +620,24 @@ class Frame(Node):
             OpenedEdge(self.opener, self).log(log_handle)
         self.is_logged = True
 
+        # Everything below was only needed to log the frame. Dropping it
+        # unlinks the frame from its older versions, so they can be freed.
+        self.pending_scripts = list()
+        self.scripts = set()
+        self.prev_version = None
+        self.navigated_from = None
+        self.opener = False
+
 
 class Host(Node):
+    __slots__ = ()
+    label = HOST
+    columns = Node.columns + ('rip', 'domain', 'server')
+
     def __init__(self, remote_ip, domain=None):
-        super().__init__(remote_ip)
-        self.label = HOST
-        self.p['rip'] = remote_ip
-        self.p['domain'] = domain
+        super().__init__(intern(remote_ip))
+        self.p['rip'] = self.id
+        self.p['domain'] = intern(domain)
 
     @classmethod
     def from_response_m(self, m):
@@ -502,7 +646,7 @@ class Host(Node):
         h = r['headers']
         if 'remoteIPAddress' in r and r['remoteIPAddress']:
             rip = r['remoteIPAddress']
-            domain = urlparse(r['url']).netloc
+            domain, _ = parse_url(r['url'])
             host = Host(rip, domain)
         else:
             host =  None
@@ -518,11 +662,16 @@ class Host(Node):
         return host
 
 class User(Node):
+    __slots__ = ()
+    label = USER
+
     def __init__(self, user_id):
         super().__init__(user_id)
-        self.label = USER
 
 class Session(Node):
+    __slots__ = ()
+    label = SESSION
+    columns = Node.columns + ('user-agent',)
 
     instance = None
 
@@ -533,8 +682,7 @@ class Session(Node):
         else:
             raise GraphError("Only one Session should be created.")
             self.id = session_id
-        super().__init__(session_id)
-        self.label = SESSION
+        super().__init__(intern(session_id))
         self.p['user-agent'] = user_agent.replace(';', ':')
 
     @classmethod
@@ -551,19 +699,21 @@ class Session(Node):
 
 
 class Resource(Node):
+    __slots__ = ()
+    label = RESOURCE
+    columns = Node.columns + ('path', 'type', 'domain')
+
     # We can collect forensic evidences related to the actor's infastructure.
     def __init__(self, path, resource_type):
-        hashed_path = hashlib.sha256(str.encode(path)).hexdigest()
-        super().__init__(hashed_path)
-        self.label = RESOURCE
+        super().__init__(resource_id(path))
         self.p['path'] = path
-        self.p['type'] = resource_type
+        self.p['type'] = intern(resource_type)
 
     @classmethod
     def from_request_m(self, m):
         p = m['params']
         r = p['request']
-        url = urlparse(r['url'])
-        resource = Resource(url.netloc + url.path, p['type'])
-        resource.p['domain'] = url.netloc
+        domain, path = parse_url(r['url'])
+        resource = Resource(domain + path, p['type'])
+        resource.p['domain'] = domain
         return resource
@@ -0,0 +1,218 @@
+"""
+Journal -- A write-ahead log of the rows of an ObjectManager's segment.
+
+Rows only reach the disk when a segment is finalized (see
+writer.BackgroundWriter), so a crash, the OOM killer or a SIGKILL used to lose
+everything since the last rotation. Now every row that is added to a segment
+is also appended to that segment's journal, in
+common.JOURNAL_DIR/<pid>.<timestamp>.<random>.wal:
+
+    {"dirname": ..., "output_format": ..., "pid": ...}
+    ["f", label, path]              A log file of the segment.
+    ["r", label, id, properties]    A row of the last file of label.
+
+Appending a row only buffers it; handing every row to the OS on its own cost
+a write(2) per event. The writer thread writes and fsyncs every journal at
+once (group commit), every common.JOURNAL_SYNC_INTERVAL seconds or as soon as
+a journal has common.JOURNAL_BATCH rows that aren't synced yet. A SIGKILL,
+the OOM killer or the machine going down lose at most the rows of the last
+interval (or batch). Once the segment is finalized, and its files are
+fsync'ed, the journal is removed. Any journal that is left behind belongs to
+a segment that never made it to the disk; recover() rebuilds its files.
+"""
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from modules import common
+from modules import segment
+from modules import utils
+
+
+# json.dumps builds a new encoder whenever it is given options.
+_encode = json.JSONEncoder(separators=(',', ':'), default=str).encode
+
+
+class JournalError(Exception):
+    pass
+
+
+class Journal(object):
+
+    def __init__(self, dirname, output_format, journal_dir=None):
+        """
+        @dirname -- The directory the segment's files are written to.
+        @output_format -- The segment's output format, "csv" or "segment".
+        @journal_dir -- Defaults to common.JOURNAL_DIR.
+        """
+        journal_dir = journal_dir or common.JOURNAL_DIR
+        os.makedirs(journal_dir, exist_ok=True)
+        self.pid = os.getpid()
+        self.path = os.path.join(journal_dir, "{}.{}.{}.wal".format(
+            self.pid, datetime.timestamp(datetime.now()),
+            utils.random_string_digits(8)))
+        self.file = open(self.path, 'w')
+        self.file.write(json.dumps({"dirname": os.path.abspath(dirname),
+                                    "output_format": output_format,
+                                    "pid": self.pid}) + "\n")
+        self.file.flush()
+        # Rows that haven't been fsync'ed yet.
+        self.unsynced = 0
+        self.batch = common.JOURNAL_BATCH
+        self.lock = threading.Lock()
+        self.closed = False
+        self.on_batch = None
+
+    def __len__(self):
+        return self.unsynced
+
+    def _append(self, record):
+        line = _encode(record) + "\n"
+        with self.lock:
+            # Buffered until the next sync() (or until the buffer fills up).
+            self.file.write(line)
+            self.unsynced += 1
+            full = self.unsynced == self.batch
+        if full and self.on_batch:
+            self.on_batch()
+
+    def add_file(self, label, path):
+        self._append(["f", label, os.path.abspath(path)])
+
+    def add(self, label, obj):
+        self._append(["r", label, obj.id, obj.properties])
+
+    def flush(self):
+        """Hands the buffered rows to the OS, without waiting for the disk."""
+        with self.lock:
+            if not self.closed:
+                self.file.flush()
+
+    def sync(self):
+        """Writes and fsyncs the rows added so far, returns how many were
+        unsynced."""
+        if self.pid != os.getpid():
+            # A forked child's copy of its parent's journal.
+            return 0
+        with self.lock:
+            if self.closed or not self.unsynced:
+                return 0
+            rows, self.unsynced = self.unsynced, 0
+            self.file.flush()
+            # The row writes don't wait for the disk.
+            fd = os.dup(self.file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return rows
+
+    def discard(self):
+        """Removes the journal, once its segment is safely on disk."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.file.close()
+            os.remove(self.path)
+
+
+class JournalRow(object):
+    """A row read back from a journal, logged like any graph element."""
+
+    __slots__ = ('id', 'properties')
+
+    def __init__(self, obj_id, properties):
+        self.id = obj_id
+        self.properties = properties
+
+
+def read(path):
+    """Returns the header and records of the journal at @path. A torn last
+    record (we crashed while writing it) is skipped."""
+    with open(path) as infile:
+        lines = infile.read().split("\n")
+    try:
+        header = json.loads(lines[0])
+    except ValueError:
+        raise JournalError("{} has no header".format(path))
+
+    records = list()
+    for i, line in enumerate(lines[1:], 1):
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            if i < len(lines) - 1:
+                raise JournalError("{}:{} is corrupt".format(path, i + 1))
+            logging.getLogger("Journal").warning(
+                "Skipping the torn last record of {}".format(path))
+    return header, records
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def journals_of(pid, journal_dir=None):
+    """Returns the paths of the journals process @pid left behind."""
+    journal_dir = journal_dir or common.JOURNAL_DIR
+    if not os.path.isdir(journal_dir):
+        return []
+    prefix = "{}.".format(pid)
+    return sorted(os.path.join(journal_dir, filename)
+                  for filename in os.listdir(journal_dir)
+                  if filename.startswith(prefix) and filename.endswith(".wal"))
+
+
+def recover(path, remove=True, force=False):
+    """Rebuilds the files of the segment journaled at @path, returns
+    {path: rows}. Partially written files are replaced.
+
+    Unless @force, we refuse to touch the journal of a running auditor.
+    """
+    header, records = read(path)
+    pid = header.get("pid")
+    if not force and pid and pid != os.getpid() and is_running(pid):
+        raise JournalError("{} belongs to process {}, which is still "
+                           "running".format(path, header["pid"]))
+
+    loggers = dict()
+    files = dict()
+    for record in records:
+        if record[0] == "f":
+            _, label, out_path = record
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            if out_path.endswith("." + segment.EXTENSION):
+                logger = segment.SegmentLogger(out_path, debug=False)
+            else:
+                logger = utils.CSVLogger(out_path, debug=False)
+            loggers[label] = logger
+            files[out_path] = logger
+        elif record[0] == "r":
+            _, label, obj_id, properties = record
+            if label not in loggers:
+                raise JournalError("{} has a {} row before its file".format(
+                    path, label))
+            loggers[label].add(JournalRow(obj_id, properties))
+
+    recovered = dict()
+    for out_path, logger in files.items():
+        logger.flush()
+        logger.close()
+        if logger.file is None and os.path.exists(out_path):
+            # Nothing was logged to it, drop what the crash left behind.
+            os.remove(out_path)
+        recovered[out_path] = logger.rows
+    if remove:
+        os.remove(path)
+    return recovered
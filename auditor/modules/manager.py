@@ -1,3 +1,37 @@
+"""
+ChromeManager -- Audits every tab in its own process.
+
+The manager owns the browser-level connection: it discovers the page
+targets, logs them (and which tab opened which) and starts a Target process
+per tab. Each Target runs its own handler (e.g., auditor.ChromeHandler),
+with its own DevTools connection, frame cache and ObjectManager writing to
+CSV_DIR/<targetId>/. All processes share the manager's session id, and once
+a tab's process exits its logs are merged into CSV_DIR as
+<label>.<targetId>.<timestamp>.<ext>. If the process was killed before it
+flushed its logs, they are recovered from its journals first (see
+journal.py).
+
+The manager doesn't handle any messages itself, so it forwards the signals
+that toggle profiling (SIGUSR2) and snapshot the heap (SIGUSR1) to the tabs'
+processes.
+"""
+import gc
+import logging
+import os
+import signal
+import sys
+from collections import deque
+from multiprocessing import Process
+
+import websocket
+
+from modules import common
+from modules import dev_tools
+from modules import graph as g
+from modules import journal
+from modules import utils
+
+
 def target_handler(signum, frame):
     """If signal is received, shutdown target."""
     for obj in gc.get_objects():
@@ -7,13 +41,43 @@ def target_handler(signum, frame):
             print("Error: Control should not have reached here.!")
 
 
+def merge_target_logs(dirname, target_id):
+    """Moves the logs of a target's process from @dirname/@target_id into
+    @dirname, returns the number of merged logs."""
+    target_dir = os.path.join(dirname, target_id)
+    if not os.path.isdir(target_dir):
+        return 0
+    merged = 0
+    for filename in sorted(os.listdir(target_dir)):
+        if filename.startswith('.'):
+            # A CSVLogger header fix-up the process didn't finish.
+            os.remove(os.path.join(target_dir, filename))
+            continue
+        label, rest = filename.split('.', 1)
+        os.replace(os.path.join(target_dir, filename),
+                   os.path.join(dirname, "{}.{}.{}".format(label, target_id,
+                                                           rest)))
+        merged += 1
+    os.rmdir(target_dir)
+    return merged
+
+
 class Target(object):
     """Responsible for managing a single target (tab)."""
-    def __init__(self, target, manager=None, handler_type=ChromeHandler):
+    def __init__(self, target, manager=None, handler_type=None):
         # adds targetId, type, title, url, attached, browserContextId members
         #XXX: This is hacky ><.
         for k,v in target.items():
             self.__dict__[k] = v
+        self.info = dict(target)
+        # What we log about the target.
+        self.id = self.targetId
+        self.properties = {k: target.get(k) for k in
+                           ['targetId', 'type', 'title', 'url', 'openerId',
+                            'browserContextId']}
+        self.properties['id'] = self.id
+        self.properties['global_session_id'] = \
+            g.Session.Instance().get_session_id()
         # Create log file for this target.
         log_file = common.LOG_FILE_TEMPLATE.format(self.targetId)
         # A reference to global chrome manager.
@@ -25,19 +89,27 @@ class Target(object):
         # State flags
         self.is_handler_running = False
         self.is_shutdown = False
+        self.is_merged = False
         self.log = logging.getLogger("Target-{}".format(self.targetId))
 
     def run(self):
         # Set signal handler
         signal.signal(signal.SIGTERM, target_handler)
-        self.chrome = dev_tools.ChromeInterface(auto_connect=False)
-        self.chrome.connect_targetID(self.targetId)
+        # We handle the signals the manager forwards to us.
+        for signum, handler in self.manager.forwarded.items():
+            signal.signal(signum, handler)
+        # Every process writes to its own directory, see merge_target_logs.
+        common.CSV_DIR = os.path.join(common.CSV_DIR, self.targetId)
+        # We use our own connection, never the manager's.
+        self.manager = None
         # Attach the handler to the target.
-        self.handler = self.handler_type(self)
+        self.handler = self.handler_type(
+            target=self.info, session_id=g.Session.Instance().get_session_id())
         self.is_handler_running = True
         try:
             self.log.info("Starting handler's message loop.")
             self.handler.msg_loop()
+            self.is_handler_running = False
         except KeyboardInterrupt:
             self.log.warning("Received interrupt, beginning shutdown.")
             self.shutdown()
@@ -52,17 +124,18 @@ class Target(object):
             self.log.error("Attempting to reshutdown target!")
 
         if self.is_handler_running:
+            self.is_handler_running = False
             self.handler.shutdown("shutdown")
-            self.is_handler_runing = False
 
         self.is_shutdown = True
         self.log.info("Target is shutdown")
         sys.exit()
 
     def __str__(self):
-        base = g.DELIM.join([self.targetId, self.type, self.title, self.url])
+        base = common.DELIM.join([self.targetId, self.type, self.title,
+                                  self.url])
         if hasattr(self, "browserContextId"):
-            base += g.DELIM + self.browserContextId
+            base += common.DELIM + self.browserContextId
         return base
 
     def __eq__(self, other):
@@ -80,77 +153,145 @@ class ChromeManager(object):
     information to reconstruct the parent-child relationships between parents.
     """
 
-    def __init__(self):
+    # See profiling.py and memory.py.
+    FORWARDED_SIGNALS = (signal.SIGUSR1, signal.SIGUSR2)
+
+    def __init__(self, handler_type, chrome=None):
+        """
+        handler_type -- The handler each Target runs. It is created as
+                        handler_type(target=<targetInfo>, session_id=<id>).
+        """
         # A list of handler objects, each responsible for its own tab.
         self.log = logging.getLogger("Manager")
-        self.targets = list()
-        self.main_handler = dev_tools.ChromeInterface()
-        self.main_handler.attach_to_browser_target()
-        sesson_id_m, msgs = self.main_handler.Target.attachToBrowserTarget()
-        #self.browser_session_id = session_id
-        sys.exit()
+        self.handler_type = handler_type
+        self.targets = dict()
+        # signum -> the handler the tabs' processes restore.
+        self.pid = os.getpid()
+        self.forwarded = dict()
+        for signum in self.FORWARDED_SIGNALS:
+            self.forwarded[signum] = signal.signal(signum, self.forward_signal)
+        self.messages = deque()
+        self.main_handler = chrome or dev_tools.ChromeInterface()
+        version = self.main_handler.attach_to_browser_target()
 
-        #NOTE: These two objects should be in the Target class.
-        self.file_cache = utils.FileCache(common.SCRIPT_CACHE)
-        self.logger = utils.ObjectManager(common.CSV_DIR)
-        # Listen for target creation events.
-        #self.main_handler.Target.setDiscoverTargets(discover=True)
         #TODO: The ObjectManager should be responsible for directory creation.
         try:
             os.mkdir(common.LOG_DIR)
         except FileExistsError:
             pass
+        self.logger = utils.ObjectManager(common.CSV_DIR)
+
+        # The session is shared by the processes of every tab.
+        session_id = utils.random_string_digits(32)
+        print("Current session: " + session_id)
+        with utils.handler_context('handle_new_browsing_session'):
+            g.new_browsing_session(session_id, version['User-Agent'],
+                                   utils.get_user_id(), self.logger)
+
+        # Listen for target creation events.
+        _, msgs = self.main_handler.Target.setDiscoverTargets(discover=True)
+        self.messages.extend(msgs)
         # Boot strap the initial targets. These are tabs that were already
         # created before the auditor started running.
-        #targets = self.main_handler.Target.getTargets()[1][0]['result']
-        #for target in targets['targetInfos']:
-        #    self._create_target(target)
-        self.main_msg_loop()
+        targets, msgs = self.main_handler.Target.getTargets()
+        self.messages.extend(msgs)
+        for info in targets['result']['targetInfos']:
+            self._create_target(info)
 
     def main_msg_loop(self):
         """ The main msg loop, which is responsible for listening for new
         target creation."""
-        #FIXME: The man_msg_loop needs a message list similar Target.
         while True:
             try:
-                for m in self.main_handler.pop_messages():
+                # Blocks for a while when no target changes, the loop
+                # would spin otherwise.
+                self.messages.extend(self.main_handler.pop_messages(
+                    timeout=dev_tools.POLL_TIMEOUT))
+                while self.messages:
+                    m = self.messages.popleft()
                     if 'method' not in m:
                         self.log.warning("No method {}".format(m))
                     elif m['method'] in self.handlers:
-                        # print(m)
-                        m_str = self.handlers[m['method']](self, m)
+                        if self.handlers[m['method']](self, m):
+                            return self.shutdown(m)
+                self.merge_finished()
             except KeyboardInterrupt:
-                self.shutdown(m)
+                return self.shutdown("shutdown")
+            except websocket._exceptions.WebSocketConnectionClosedException:
+                return self.shutdown("shutdown")
+
+    def forward_signal(self, signum, frame):
+        """Sends @signum to the processes of the tabs."""
+        if os.getpid() != self.pid:
+            # A tab's process that hasn't restored its handler yet.
+            return
+        for t in list(self.targets.values()):
+            if t.p.pid and t.p.exitcode is None:
+                try:
+                    os.kill(t.p.pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def merge_finished(self):
+        """Merges the logs of the targets whose process has exited."""
+        for t in self.targets.values():
+            if not t.is_merged and t.p.exitcode is not None:
+                t.p.join()
+                self.recover_target(t)
+                merged = merge_target_logs(self.logger.dirname, t.targetId)
+                t.is_merged = True
+                self.log.info("Merged {} logs of {}".format(merged,
+                                                            t.targetId))
+
+    def recover_target(self, target):
+        """Rebuilds the logs @target's (exited) process didn't flush, in
+        CSV_DIR/<targetId>/, so they are merged instead of its partial
+        logs."""
+        for path in journal.journals_of(target.p.pid):
+            try:
+                recovered = journal.recover(path)
+            except journal.JournalError as e:
+                self.log.error("Recovering {} failed: {}".format(path, e))
+                continue
+            self.log.warning("Recovered {} logs of {} (exit code {})".format(
+                len(recovered), target.targetId, target.p.exitcode))
 
     def shutdown(self, m):
-        #FIXME: Ideally, the manager should also signal any children to enter 
-        # their shutdown routines.
+        # The tabs received the interrupt as well, give them time to flush.
+        for t in self.targets.values():
+            t.p.join(common.TARGET_SHUTDOWN_TIMEOUT)
+            if t.p.is_alive():
+                self.log.warning("Terminating {}".format(t.targetId))
+                t.p.terminate()
+                t.p.join()
+        self.merge_finished()
         self.main_handler.close()
         self.logger.flush_all(exiting=True)
-        sys.exit()
+        return True
 
     def handle_target_created(self, m):
-        pass
-        t_info = m['params']['targetInfo']
-        #print(m)
-        if t_info['type'] == 'page':
-            self._create_target(t_info)
+        self._create_target(m['params']['targetInfo'])
 
     def _create_target(self, info):
-        if (info['type'] == 'page' and info['url'] == 'chrome://newtab/'):
-            t = Target(info, self)
-            #self.log_target_info(t)
-            t.p.start()
-            self.targets.append(t)
+        if info['type'] != 'page' or info['targetId'] in self.targets:
+            return
+        t = Target(info, self, self.handler_type)
+        self.log_target_info(t)
+        t.p.start()
+        self.targets[t.targetId] = t
 
     def log_target_info(self, target):
         """Log information to track how each tab was opened."""
-        self.logger.add("targets", target)
-        opener = target.openerId if hasattr(target, "openerId") else "NewTab"
-        self.logger.add("target-edges", g.Edge(opener, target.targetId, "lbl"))
+        with utils.handler_context('handle_target_created'):
+            self.logger.add(g.TARGET, target)
+            opener = target.openerId if hasattr(target, "openerId") \
+                else "NewTab"
+            g.TargetEdge(opener, target.targetId).log(self.logger)
+
+    def handle_inspector_detached(self, m):
+        return True
 
     handlers = {
         "Target.targetCreated" : handle_target_created,
-        "Inspector.detached" : shutdown
+        "Inspector.detached" : handle_inspector_detached
     }
-
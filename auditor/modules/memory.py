@@ -0,0 +1,200 @@
+"""
+Memory -- Accounts for the memory of the auditor's long-lived structures.
+
+The auditor's RSS grows over a long session, and the structures that can grow
+with it (the frame cache, the requests in flight, the seen index, the
+loggers' id sets, ...) are registered with MemoryReporter.track(). Every
+common.MEMORY_INTERVAL seconds a background thread logs their sizes, next to
+the RSS, and appends them to common.MEMORY_DIR/<pid>.sizes.jsonl, since the
+logs may go to /dev/null (see common.RTP_EVALUATION). They are also exported
+as auditor_memory_<name> gauges (see metrics.py).
+
+The sizes tell us which structure grows, tracemalloc tells us which lines
+allocate. Sending SIGUSR1 to the auditor (kill -USR1 <pid>) starts tracing;
+each SIGUSR1 after that writes a snapshot to
+common.MEMORY_DIR/<pid>.<timestamp>.txt: the common.MEMORY_TOP lines holding
+the most memory, and the lines that grew the most since the last snapshot.
+Since tracing slows every allocation down, it only runs from the start with
+--trace-memory.
+"""
+import json
+import logging
+import os
+import resource
+import signal
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from modules import common
+
+
+def rss():
+    """Returns our resident set size in bytes."""
+    try:
+        with open("/proc/self/statm") as infile:
+            pages = int(infile.read().split()[1])
+        return pages * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        # The peak (in KiB on Linux), better than nothing.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryReporter(object):
+
+    instance = None
+
+    def __init__(self, interval=None, out_dir=None, top=None):
+        """
+        @interval -- Seconds between reports, defaults to
+                     common.MEMORY_INTERVAL.
+        @out_dir -- Defaults to common.MEMORY_DIR.
+        @top -- The lines a snapshot lists, defaults to common.MEMORY_TOP.
+        """
+        self.interval = interval or common.MEMORY_INTERVAL
+        self.out_dir = out_dir or common.MEMORY_DIR
+        self.top = top or common.MEMORY_TOP
+        self.log = logging.getLogger("MemoryReporter")
+        # name -> (help, function returning the structure's size).
+        self.structures = dict()
+        # The snapshot the next one is compared to.
+        self.last_snapshot = None
+        self.lock = threading.Lock()
+        self.pid = None
+        self.thread = None
+        self.stopping = threading.Event()
+        # Set by the signal handler, handled by the reporter thread.
+        self.snapshot_requested = threading.Event()
+
+    @classmethod
+    def Instance(cls):
+        """Returns the memory reporter of this process."""
+        if MemoryReporter.instance is None:
+            MemoryReporter.instance = cls()
+        return MemoryReporter.instance
+
+    def track(self, name, help, func):
+        """Reports func(), the size of the structure @name."""
+        self.structures[name] = (help, func)
+
+    def export(self, metrics):
+        """Registers the tracked sizes and the RSS as gauges of @metrics."""
+        metrics.gauge("auditor_memory_rss_bytes", "Our resident set size.",
+                      rss)
+        for name, (help, func) in self.structures.items():
+            metrics.gauge("auditor_memory_{}".format(name), help, func)
+
+    def sizes(self):
+        """Returns the current size of every tracked structure."""
+        sizes = {"rss_bytes": rss()}
+        if tracemalloc.is_tracing():
+            sizes["traced_bytes"] = tracemalloc.get_traced_memory()[0]
+        for name, (help, func) in self.structures.items():
+            try:
+                sizes[name] = func()
+            except Exception as e:
+                # E.g., the structure changed size while we iterated it.
+                sizes[name] = None
+                self.log.debug("Sizing {} failed: {}".format(name, e))
+        return sizes
+
+    def report(self):
+        """Logs the sizes and appends them to our sizes file."""
+        sizes = self.sizes()
+        self.log.info("Memory: {}".format(sizes))
+        sizes["time"] = time.time()
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            with open(self.sizes_path(), 'a') as outfile:
+                outfile.write(json.dumps(sizes, sort_keys=True) + "\n")
+        except OSError as e:
+            self.log.error("Writing the sizes failed: {}".format(e))
+
+    def sizes_path(self):
+        return os.path.join(self.out_dir, "{}.sizes.jsonl".format(os.getpid()))
+
+    def install_signal_handler(self, signum=signal.SIGUSR1):
+        """Takes a snapshot whenever we receive @signum."""
+        signal.signal(signum, self.handle_signal)
+
+    def handle_signal(self, signum, frame):
+        self.snapshot_requested.set()
+
+    def start(self):
+        """Starts reporting, again if we are a forked child (see
+        manager.Target), since threads don't survive a fork."""
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._report_loop,
+                                           name="memory-reporter",
+                                           daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stops reporting, after reporting one last time."""
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.pid = None
+            self.stopping.set()
+            self.snapshot_requested.set()
+            self.thread.join()
+        self.report()
+
+    def _report_loop(self):
+        next_report = time.monotonic() + self.interval
+        while True:
+            requested = self.snapshot_requested.wait(
+                max(0, next_report - time.monotonic()))
+            if self.stopping.is_set():
+                return
+            if requested:
+                self.snapshot_requested.clear()
+                try:
+                    self.snapshot()
+                except OSError as e:
+                    self.log.error("Writing the snapshot failed: {}"
+                                   .format(e))
+                continue
+            self.report()
+            next_report = time.monotonic() + self.interval
+
+    def snapshot(self):
+        """Writes a tracemalloc snapshot, returns its path. If we aren't
+        tracing yet, we start tracing and return None."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(common.MEMORY_FRAMES)
+            self.log.info("Tracing allocations, the next signal writes a "
+                          "snapshot.")
+            return None
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ])
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, "{}.{}.txt".format(
+            os.getpid(), datetime.timestamp(datetime.now())))
+        with open(path, 'w') as outfile:
+            outfile.write("== Sizes\n")
+            for name, size in sorted(self.sizes().items()):
+                outfile.write("{} {}\n".format(name, size))
+
+            outfile.write("\n== Top {} lines\n".format(self.top))
+            for stat in snapshot.statistics("lineno")[:self.top]:
+                outfile.write("{}\n".format(stat))
+
+            if self.last_snapshot is not None:
+                outfile.write("\n== Top {} lines since the last snapshot\n"
+                              .format(self.top))
+                diff = snapshot.compare_to(self.last_snapshot, "lineno")
+                for stat in diff[:self.top]:
+                    outfile.write("{}\n".format(stat))
+        self.last_snapshot = snapshot
+        self.log.info("Memory snapshot written to {}".format(path))
+        return path
@@ -0,0 +1,266 @@
+"""
+Metrics -- Handler latencies and event lag, in the Prometheus text format.
+
+base.Handler.run_cycle records, for every CDP method and handler
+(ChromeHandler, FrameHandler, ScriptHandler), how long the handler function
+took. For every event, it also records the event lag: how far behind the
+browser we are, i.e., our clock minus the event's wallTime. Most events only
+have a timestamp, from Chrome's monotonic clock, which needn't be ours (it is
+on Linux, not necessarily on macOS or Windows). So we calibrate its offset
+from the wall clock with the first event that carries both (e.g.,
+Network.requestWillBeSent), and skip timestamp-only events until then.
+A lag that keeps growing means the auditor doesn't keep up.
+
+The histograms have fixed buckets, so observing a value only increments a
+counter in a preallocated array. The metrics are served on
+http://127.0.0.1:<port>/metrics (--metrics-port) and/or periodically written
+to a file (--metrics-file), e.g., for node_exporter's textfile collector.
+"""
+import array
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from modules import common
+
+
+# Upper bounds (seconds) of the buckets, the last bucket is +Inf.
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0,
+               300.0, 900.0)
+
+
+class Histogram(object):
+    """A histogram with fixed buckets."""
+
+    __slots__ = ('bounds', 'counts', 'total')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = array.array('Q', bytes(8 * (len(bounds) + 1)))
+        self.total = array.array('d', [0.0])
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total[0] += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def render(self, name, labels):
+        """Yields the Prometheus samples of the histogram."""
+        cumulative = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            cumulative += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound,
+                                                      cumulative)
+        yield '{}_sum{{{}}} {}'.format(name, labels, self.total[0])
+        yield '{}_count{{{}}} {}'.format(name, labels, cumulative)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer, which Python 3.6 doesn't have."""
+    daemon_threads = True
+
+
+def _labels(**labels):
+    return ",".join('{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                                     .replace('"', '\\"'))
+                    for k, v in labels.items())
+
+
+class Metrics(object):
+    """The metrics of this process."""
+
+    instance = None
+
+    def __init__(self):
+        # handler -> method -> Histogram of the handler function's latency.
+        self.latency = defaultdict(dict)
+        # (method, clock) -> Histogram of the event lag.
+        self.lag = dict()
+        # Chrome's wallTime minus its monotonic timestamp, see observe_lag.
+        self.clock_offset = None
+        # name -> (help, function returning the current value, label).
+        self.gauges = dict()
+        # The base.Handler's whose dispatch counts we export.
+        self.dispatchers = list()
+        self.started = time.time()
+
+    @classmethod
+    def Instance(cls):
+        """Returns the metrics of this process."""
+        if Metrics.instance is None:
+            Metrics.instance = cls()
+        return Metrics.instance
+
+    def observe_latency(self, handler, method, seconds):
+        histograms = self.latency[handler]
+        histogram = histograms.get(method)
+        if histogram is None:
+            histogram = histograms[method] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+
+    def observe_lag(self, m):
+        """Records how far behind the browser we are for event @m."""
+        p = m.get('params')
+        if not p:
+            return
+        if 'wallTime' in p:
+            clock = "wall"
+            lag = time.time() - p['wallTime']
+            if self.clock_offset is None and 'timestamp' in p:
+                self.clock_offset = p['wallTime'] - p['timestamp']
+        elif 'timestamp' in p and self.clock_offset is not None:
+            clock = "timestamp"
+            lag = time.time() - (p['timestamp'] + self.clock_offset)
+        else:
+            return
+        key = (m['method'], clock)
+        histogram = self.lag.get(key)
+        if histogram is None:
+            histogram = self.lag[key] = Histogram(LAG_BUCKETS)
+        # A clock skew between Chrome and us shouldn't look like lag.
+        histogram.observe(lag if lag > 0 else 0.0)
+
+    def dispatcher(self, handler):
+        """Exports the handled/dropped counts of @handler (a base.Handler)."""
+        self.dispatchers.append(handler)
+
+    def gauge(self, name, help, func, label=None):
+        """Registers gauge @name, whose value is func(). With a @label,
+        func() returns a dict, and each of its items is a sample whose
+        @label is the key, e.g., the stats() of a structure."""
+        self.gauges[name] = (help, func, label)
+
+    def render(self):
+        """Returns the metrics in the Prometheus text format."""
+        lines = ["# HELP auditor_handler_seconds Time spent in each handler "
+                 "function.",
+                 "# TYPE auditor_handler_seconds histogram"]
+        for handler, histograms in sorted(self.latency.items()):
+            for method, histogram in sorted(histograms.items()):
+                lines.extend(histogram.render(
+                    "auditor_handler_seconds",
+                    _labels(handler=handler, method=method)))
+
+        lines += ["# HELP auditor_event_lag_seconds Our clock minus the "
+                  "event's wallTime, or its timestamp calibrated to the "
+                  "wall clock.",
+                  "# TYPE auditor_event_lag_seconds histogram"]
+        for (method, clock), histogram in sorted(self.lag.items()):
+            lines.extend(histogram.render(
+                "auditor_event_lag_seconds",
+                _labels(method=method, clock=clock)))
+
+        lines += ["# HELP auditor_messages_total Messages each handler "
+                  "handled, or dropped since none of its handlers handles "
+                  "them.",
+                  "# TYPE auditor_messages_total counter"]
+        for handler in self.dispatchers:
+            for outcome, counts in [("handled", handler.handled),
+                                    ("dropped", handler.dropped)]:
+                for method, count in sorted(counts.items(),
+                                            key=lambda c: str(c[0])):
+                    lines.append("auditor_messages_total{{{}}} {}".format(
+                        _labels(handler=handler.metrics_name, method=method,
+                                outcome=outcome), count))
+
+        gauges = dict(self.gauges, auditor_uptime_seconds=(
+            "Seconds since the auditor started.",
+            lambda: time.time() - self.started, None))
+        for name, (help, func, label) in sorted(gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines += ["# HELP {} {}".format(name, help),
+                      "# TYPE {} gauge".format(name)]
+            if label is None:
+                lines.append("{} {}".format(name, value))
+                continue
+            for key, sample in sorted(value.items(), key=lambda s: str(s[0])):
+                # E.g., a stat that isn't known yet.
+                if isinstance(sample, (int, float)):
+                    lines.append("{}{{{}}} {}".format(
+                        name, _labels(**{label: key}), sample))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Writes the metrics to @path."""
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, 'w') as outfile:
+            outfile.write(self.render())
+        os.replace(tmp_path, path)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = Metrics.Instance().render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class MetricsExporter(object):
+    """Serves the metrics on 127.0.0.1:@port and/or writes them to @path
+    every @interval seconds, in background threads."""
+
+    def __init__(self, port=None, path=None, interval=None):
+        self.path = path
+        self.interval = interval or common.METRICS_INTERVAL
+        self.log = logging.getLogger("MetricsExporter")
+        self.stopping = threading.Event()
+        self.server = None
+        self.threads = list()
+
+        if port is not None:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port),
+                                              MetricsRequestHandler)
+            self.server.daemon_threads = True
+            self.log.info("Serving metrics on {}".format(
+                self.server.server_address))
+            self._start(self.server.serve_forever, "metrics-server")
+        if path:
+            self._start(self._dump_loop, "metrics-dump")
+
+    def _start(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _dump_loop(self):
+        while not self.stopping.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        try:
+            Metrics.Instance().dump(self.path)
+        except OSError as e:
+            self.log.error("Writing {} failed: {}".format(self.path, e))
+
+    def close(self):
+        """Stops serving, the dump file is written one last time."""
+        self.stopping.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.path:
+            self.dump()
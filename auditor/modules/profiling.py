@@ -0,0 +1,161 @@
+"""
+Profiler -- Profiles the auditor per CDP method, on demand.
+
+While profiling, every message is dispatched under a cProfile.Profile of its
+method (e.g., Network.requestWillBeSent vs Page.frameNavigated), and a
+sampler thread records the main thread's stack every common.PROFILE_INTERVAL
+seconds, with the method being dispatched as its root frame. Once profiling
+stops, we write to common.PROFILE_DIR/<pid>.<timestamp>/:
+
+    <method>.prof     The cProfile stats of each method (see pstats).
+    summary.txt       The most expensive functions of each method.
+    stacks.collapsed  The samples in the collapsed-stack format, e.g., for
+                      flamegraph.pl or speedscope.
+
+Profiling is started with --profile, or toggled by sending SIGUSR2 to the
+auditor (kill -USR2 <pid>). A toggle takes effect at the next message.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import signal
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+
+from modules import common
+
+
+class Profiler(object):
+
+    instance = None
+
+    def __init__(self, out_dir=None, interval=None):
+        """
+        @out_dir -- Defaults to common.PROFILE_DIR.
+        @interval -- Seconds between samples, defaults to
+                     common.PROFILE_INTERVAL.
+        """
+        self.out_dir = out_dir or common.PROFILE_DIR
+        self.interval = interval or common.PROFILE_INTERVAL
+        self.log = logging.getLogger("Profiler")
+        self.enabled = False
+        # Set by the signal handler, handled at the next message.
+        self.toggle = False
+        # method -> cProfile.Profile
+        self.profiles = dict()
+        # collapsed stack -> samples
+        self.stacks = Counter()
+        # The method being dispatched, the root of the sampled stacks.
+        self.method = None
+        self.thread_id = None
+        self.sampler = None
+        self.stopping = threading.Event()
+
+    @classmethod
+    def Instance(cls):
+        """Returns the profiler of this process."""
+        if Profiler.instance is None:
+            Profiler.instance = cls()
+        return Profiler.instance
+
+    def install_signal_handler(self, signum=signal.SIGUSR2):
+        """Toggles profiling whenever we receive @signum."""
+        signal.signal(signum, self.handle_signal)
+
+    def handle_signal(self, signum, frame):
+        self.toggle = True
+
+    def start(self):
+        if self.enabled:
+            return
+        self.log.info("Profiling started.")
+        self.enabled = True
+        self.profiles = dict()
+        self.stacks = Counter()
+        self.thread_id = threading.get_ident()
+        self.stopping.clear()
+        self.sampler = threading.Thread(target=self._sample_loop,
+                                        name="profile-sampler", daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        """Stops profiling, returns the directory the profile was written
+        to."""
+        if not self.enabled:
+            return None
+        self.enabled = False
+        self.stopping.set()
+        self.sampler.join()
+        path = self.dump()
+        self.log.info("Profiling stopped, see {}".format(path))
+        return path
+
+    def run(self, dispatch, m, callbacks):
+        """Dispatches @m with dispatch(@m, @callbacks), under the profile of
+        @m's method."""
+        if self.toggle:
+            self.toggle = False
+            if self.enabled:
+                self.stop()
+            else:
+                self.start()
+        if not self.enabled:
+            return dispatch(m, callbacks)
+
+        method = m['method']
+
+        profile = self.profiles.get(method)
+        if profile is None:
+            profile = self.profiles[method] = cProfile.Profile()
+        self.method = method
+        profile.enable()
+        try:
+            return dispatch(m, callbacks)
+        finally:
+            profile.disable()
+            self.method = None
+
+    def _sample_loop(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = list()
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}".format(
+                    os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            stack.append(self.method or "(idle)")
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+
+    def dump(self):
+        """Writes the profiles and samples, returns their directory."""
+        path = os.path.join(self.out_dir, "{}.{}".format(
+            os.getpid(), datetime.timestamp(datetime.now())))
+        os.makedirs(path, exist_ok=True)
+
+        summary = io.StringIO()
+        totals = sorted(((pstats.Stats(p).total_tt, method, p)
+                         for method, p in self.profiles.items()
+                         if p.getstats()),
+                        key=lambda t: t[0], reverse=True)
+        for total, method, profile in totals:
+            filename = re.sub(r'[^\w.-]', '_', method)
+            profile.dump_stats(os.path.join(path, filename + ".prof"))
+            summary.write("== {} ({:.3f}s)\n".format(method, total))
+            stats = pstats.Stats(profile, stream=summary)
+            stats.sort_stats("cumulative").print_stats(common.PROFILE_TOP)
+
+        with open(os.path.join(path, "summary.txt"), 'w') as outfile:
+            outfile.write(summary.getvalue())
+        with open(os.path.join(path, "stacks.collapsed"), 'w') as outfile:
+            for stack, samples in sorted(self.stacks.items()):
+                outfile.write("{} {}\n".format(stack, samples))
+        return path
@@ -0,0 +1,229 @@
+"""
+Replay -- Records the raw DevTools stream and plays it back without Chrome.
+
+A recording is an append-only JSON-lines file (gzip'd if the filename ends in
+.gz). Each line is one of:
+
+    {"k": "v", "m": <browser version info>}
+    {"k": "e", "m": <event>}
+    {"k": "r", "method": <Domain.method>, "m": <reply>, "msgs": [<events>]}
+
+Replies keep the events that were returned alongside them, so a replayed
+handler sees messages in the same order it saw them live.
+
+Like the DevTools clients, ReplayInterface decodes the recorded lines
+itself, and drops the events we aren't subscribed to before decoding them.
+"""
+import collections
+import gzip
+import json
+import time
+
+import websocket
+
+from modules import dev_tools
+
+
+# Upper bound on the number of events we read ahead when searching for a
+# command reply. If a reply can't be found within this window, the command
+# times out just like it would against a live browser.
+LOOKAHEAD = 100000
+BATCH_SIZE = 1000
+# Recorded events start with their method, see dev_tools.event_method().
+EVENT_PREFIX = '{"k":"e","m":'
+
+
+def _open(filename, mode):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, mode + "t")
+    return open(filename, mode)
+
+
+def read_lines(filename):
+    """Yields the (undecoded) records stored in a recording."""
+    with _open(filename, "r") as infile:
+        for line in infile:
+            if line.strip():
+                yield line
+
+
+def read_records(filename):
+    """Yields the records stored in a recording."""
+    for line in read_lines(filename):
+        yield json.loads(line)
+
+
+class MessageRecorder(object):
+    """Writes every message received from DevTools to @filename."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = _open(filename, "w")
+        self.count = 0
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')))
+        self.file.write("\n")
+        self.count += 1
+
+    def record_version(self, info):
+        self.write({"k": "v", "m": info})
+
+    def record_events(self, msgs):
+        for m in msgs:
+            self.write({"k": "e", "m": m})
+
+    def record_reply(self, method, result, msgs):
+        self.write({"k": "r", "method": method, "m": result, "msgs": msgs})
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class ReplayElement(object):
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+
+    def __getattr__(self, attr):
+        func_name = '{}.{}'.format(self.name, attr)
+
+        def generic_function(**args):
+            return self.parent.reply(func_name)
+
+        return generic_function
+
+
+class ReplayInterface(object):
+    """Stands in for dev_tools.ChromeInterface, serving a recording.
+
+    @source is either the filename of a recording or an iterable of records,
+    decoded or not (i.e., lines of a recording). Events are handed out by
+    pop_messages() as fast as they are consumed. Once the recording is
+    exhausted we raise the same exception a closed websocket would, which
+    makes ChromeHandler shut down normally.
+    """
+
+    def __init__(self, source, batch_size=BATCH_SIZE):
+        if isinstance(source, str):
+            source = read_lines(source)
+        self.records = iter(source)
+        self.loads = dev_tools.get_decoder()
+        # The events we handle, see subscribe().
+        self.subscriptions = None
+        self.events_dropped = 0
+        self.batch_size = batch_size
+        self.events = collections.deque()
+        self.replies = collections.defaultdict(collections.deque)
+        self.info = None
+        self.events_served = 0
+        self.replies_served = 0
+        self.replies_missed = 0
+        self.exhausted = False
+
+    def _read(self):
+        """Reads the next record, returns False if the recording is done."""
+        if self.exhausted:
+            return False
+        try:
+            record = next(self.records)
+        except StopIteration:
+            self.exhausted = True
+            return False
+
+        if isinstance(record, str):
+            if self.subscriptions is not None and \
+                    record.startswith(EVENT_PREFIX):
+                method = dev_tools.event_method(record, len(EVENT_PREFIX))
+                if method is not None and method not in self.subscriptions:
+                    self.events_dropped += 1
+                    return 'e'
+            record = self.loads(record)
+
+        kind = record['k']
+        if kind == 'e':
+            if self._subscribed(record['m']):
+                self.events.append(record['m'])
+        elif kind == 'r':
+            self.replies[record['method']].append(
+                (record['m'], [m for m in record.get('msgs', [])
+                               if self._subscribed(m)]))
+        elif kind == 'v':
+            self.info = record['m']
+        return kind
+
+    def subscribe(self, methods):
+        """Drops every event whose method isn't in @methods, see
+        dev_tools.ChromeInterface.subscribe."""
+        self.subscriptions = frozenset(methods) if methods is not None \
+            else None
+
+    def _subscribed(self, m):
+        if self.subscriptions is None or 'method' not in m or \
+                m['method'] in self.subscriptions:
+            return True
+        self.events_dropped += 1
+        return False
+
+    def attach_to_browser_target(self):
+        while self.info is None and self._read():
+            pass
+        if self.info is None:
+            raise Exception('ERROR: Recording has no browser version info')
+        return self.info
+
+    def reply(self, method):
+        """Returns the recorded (result, msgs) for a command."""
+        pending = self.replies[method]
+        while not pending and len(self.events) < LOOKAHEAD and self._read():
+            pass
+
+        if not pending:
+            self.replies_missed += 1
+            return ("Timeout", [])
+        self.replies_served += 1
+        return pending.popleft()
+
+    def notify(self, method, **params):
+        """Returns the recorded reply, so the events that were recorded with
+        it are served."""
+        return self.reply(method)
+
+    def batch(self, calls, timings=None):
+        """Returns the recorded replies to @calls, see ChromeInterface.batch."""
+        results = []
+        messages = []
+        for method, params in calls:
+            result, msgs = self.reply(method)
+            results.append(result)
+            messages.extend(msgs)
+            if timings is not None:
+                timings.append(time.perf_counter()
+                               if result != "Timeout" else None)
+        return (results, messages)
+
+    def pop_messages(self, timeout=None):
+        """Returns the events up to the next recorded reply. A recording
+        never makes us wait, so @timeout is ignored."""
+        while len(self.events) < self.batch_size:
+            kind = self._read()
+            if not kind or kind == 'r':
+                break
+
+        if not self.events and self.exhausted:
+            raise websocket._exceptions.WebSocketConnectionClosedException(
+                "Replay is finished.")
+
+        messages = list(self.events)
+        self.events.clear()
+        self.events_served += len(messages)
+        return messages
+
+    def close(self):
+        return
+
+    def __getattr__(self, attr):
+        element = ReplayElement(attr, self)
+        self.__setattr__(attr, element)
+        return element
@@ -0,0 +1,146 @@
+"""
+RequestTracker -- Follows each network request from requestWillBeSent to
+loadingFinished/loadingFailed.
+
+A request is tracked while it is in flight. Its response edge is held back
+until the request completes, so we can add the encoded size and duration,
+and the request is released as soon as it finished. Requests that never
+finish (e.g., the target went away) are expired after @ttl seconds of
+browser time, checked whenever a request starts or finishes, or once more
+than @max_requests are in flight.
+"""
+import logging
+from collections import OrderedDict
+
+from modules import common
+from modules import graph as g
+
+
+class InFlight(object):
+    """A request that hasn't finished yet."""
+
+    __slots__ = ('request', 'timestamp', 'response')
+
+    def __init__(self, request, timestamp):
+        self.request = request
+        self.timestamp = timestamp
+        self.response = None
+
+
+class RequestTracker(object):
+
+    def __init__(self, log_handle, ttl=None, max_requests=None):
+        """
+        @log_handle -- The ObjectManager completed responses are logged to.
+        @ttl -- Seconds before an unfinished request is dropped, defaults to
+                common.REQUEST_TTL.
+        @max_requests -- Requests in flight, defaults to common.MAX_REQUESTS.
+        """
+        self.log_handle = log_handle
+        self.ttl = ttl or common.REQUEST_TTL
+        self.max_requests = max_requests or common.MAX_REQUESTS
+        # requestId -> InFlight, oldest first.
+        self.requests = OrderedDict()
+        self.log = logging.getLogger("RequestTracker")
+
+        self.high_water = 0
+        self.completed = 0
+        self.failed = 0
+        self.redirects = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __contains__(self, request_id):
+        return request_id in self.requests
+
+    def request_sent(self, m, request):
+        """Tracks @request, the RequestEdge of a Network.requestWillBeSent."""
+        p = m['params']
+        request_id = p['requestId']
+        timestamp = p.get('timestamp', 0)
+
+        # A redirect reuses the requestId, the previous hop is done.
+        if 'redirectResponse' in p:
+            entry = self.requests.pop(request_id, None)
+            if entry:
+                entry.response = g.ResponseEdge.from_m(
+                    {'params': {'response': p['redirectResponse']}},
+                    entry.request)
+                self._complete(entry, timestamp)
+                self.redirects += 1
+
+        self.requests[request_id] = InFlight(request, timestamp)
+        self._expire(timestamp)
+        if len(self.requests) > self.high_water:
+            self.high_water = len(self.requests)
+
+    def response_received(self, m):
+        p = m['params']
+        entry = self.requests.get(p['requestId'])
+        if entry:
+            entry.response = g.ResponseEdge.from_m(m, entry.request)
+
+    def loading_finished(self, m):
+        p = m['params']
+        timestamp = p.get('timestamp')
+        entry = self.requests.pop(p['requestId'], None)
+        if entry:
+            if entry.response:
+                entry.response.p['encodedDataLength'] = str(
+                    int(p.get('encodedDataLength', 0)))
+            self._complete(entry, timestamp)
+            self.completed += 1
+        if timestamp:
+            self._expire(timestamp)
+
+    def loading_failed(self, m):
+        p = m['params']
+        timestamp = p.get('timestamp')
+        entry = self.requests.pop(p['requestId'], None)
+        if entry:
+            if not entry.response:
+                entry.response = g.ResponseEdge(entry.request)
+            entry.response.p['errorText'] = p.get('errorText')
+            entry.response.p['canceled'] = str(p.get('canceled', False))
+            self._complete(entry, timestamp)
+            self.failed += 1
+        if timestamp:
+            self._expire(timestamp)
+
+    def _complete(self, entry, timestamp):
+        """Logs the response edge of a finished request."""
+        response = entry.response
+        if not response:
+            return
+        if timestamp is not None and entry.timestamp:
+            response.p['duration'] = str(timestamp - entry.timestamp)
+        response.log(self.log_handle)
+
+    def _expire(self, now):
+        """Drops the requests older than the ttl, or over the size bound."""
+        while self.requests:
+            request_id, entry = next(iter(self.requests.items()))
+            if len(self.requests) > self.max_requests:
+                self.evicted += 1
+            elif entry.timestamp and now - entry.timestamp > self.ttl:
+                self.expired += 1
+            else:
+                break
+            del self.requests[request_id]
+            self.log.debug("Dropping unfinished request {}".format(request_id))
+            self._complete(entry, None)
+
+    def flush(self):
+        """Logs the responses of the requests that are still in flight."""
+        for entry in self.requests.values():
+            self._complete(entry, None)
+        self.requests.clear()
+
+    def stats(self):
+        return {"in_flight": len(self.requests), "high_water": self.high_water,
+                "completed": self.completed, "failed": self.failed,
+                "redirects": self.redirects, "expired": self.expired,
+                "evicted": self.evicted}
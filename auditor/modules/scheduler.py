@@ -0,0 +1,137 @@
+"""
+EventScheduler -- Orders the messages waiting in ChromeHandler's queue.
+
+Structural events (Target.*, Page.frameAttached and Page.frameNavigated) are
+processed ahead of the bulk Network.* and Debugger.* traffic, so the frame
+cache is up to date by the time the requests referencing a frame are handled.
+A structural event may only jump over the @window oldest bulk events, and it
+never jumps over events of the frames it refers to. Otherwise, we would e.g.
+attribute the scripts of a frame's previous document to its new document.
+Teardown events (TEARDOWN) are processed in arrival order, since they evict
+frames that earlier events may still refer to, and a frame's attach never
+jumps over the teardown of a previous frame with the same id.
+"""
+from collections import deque
+
+
+# How many bulk events a structural event may overtake.
+REORDER_WINDOW = 1000
+
+TEARDOWN = frozenset(["Target.targetDestroyed", "Target.detachedFromTarget",
+                      "Page.frameDetached"])
+
+
+def _structural_refs(m):
+    """Returns the frames a structural event depends on, None if it is not
+    a structural event."""
+    method = m.get('method')
+    if not method or method in TEARDOWN:
+        return None
+    p = m.get('params', {})
+    if method == 'Page.frameAttached':
+        # The child's own (racing) network events may be overtaken.
+        return (p.get('parentFrameId'),)
+    elif method == 'Page.frameNavigated':
+        f = p.get('frame', {})
+        return (f.get('id'), f.get('parentId'))
+    elif method.startswith('Target.'):
+        info = p.get('targetInfo', {})
+        return (info.get('targetId', p.get('targetId')),)
+    return None
+
+
+def _frame_id(m):
+    """Returns the frame a bulk event belongs to."""
+    p = m.get('params')
+    if not p:
+        return None
+    frame_id = p.get('frameId')
+    if not frame_id and 'executionContextAuxData' in p:
+        frame_id = p['executionContextAuxData'].get('frameId')
+    return frame_id
+
+
+class EventScheduler(object):
+    """A message queue with O(1) operations, see the module docstring."""
+
+    def __init__(self, window=REORDER_WINDOW):
+        self.window = window
+        # (seq, msg) of the structural events we will process first.
+        self.priority = deque()
+        # (seq, frames, msg) of every other event, in arrival order.
+        self.bulk = deque()
+        # The number of queued bulk events for each frame.
+        self.pending = dict()
+        # The number of queued teardown events for each frame.
+        self.detaching = dict()
+        self.seq = 0
+        self.high_water = 0
+        self.promoted = 0
+
+    def __len__(self):
+        return len(self.priority) + len(self.bulk)
+
+    def append(self, m):
+        self.seq += 1
+        refs = _structural_refs(m)
+        if refs is not None and not any(r in self.pending for r in refs) \
+                and not self._detaching(m):
+            self.priority.append((self.seq, m))
+        else:
+            if refs is None:
+                frames = (_frame_id(m),)
+            elif m['method'] == 'Page.frameAttached':
+                # Later events of the child must not overtake its attach.
+                frames = refs + (m['params'].get('frameId'),)
+            else:
+                frames = refs
+            frames = tuple(f for f in frames if f)
+            for f in frames:
+                self.pending[f] = self.pending.get(f, 0) + 1
+            if m.get('method') in TEARDOWN:
+                for f in frames:
+                    self.detaching[f] = self.detaching.get(f, 0) + 1
+            self.bulk.append((self.seq, frames, m))
+
+        depth = len(self)
+        if depth > self.high_water:
+            self.high_water = depth
+
+    def _detaching(self, m):
+        """Whether @m attaches a frame whose teardown is still queued."""
+        if not self.detaching or m['method'] != 'Page.frameAttached':
+            return False
+        return m['params'].get('frameId') in self.detaching
+
+    def extend(self, msgs):
+        for m in msgs:
+            self.append(m)
+
+    def pop(self):
+        """Removes and returns the next message to process."""
+        if self.priority and (not self.bulk or
+                              self.priority[0][0] - self.bulk[0][0]
+                              <= self.window):
+            seq, m = self.priority.popleft()
+            if self.bulk and self.bulk[0][0] < seq:
+                self.promoted += 1
+            return m
+
+        seq, frames, m = self.bulk.popleft()
+        self._release(self.pending, frames)
+        if m.get('method') in TEARDOWN:
+            self._release(self.detaching, frames)
+        return m
+
+    @staticmethod
+    def _release(counts, frames):
+        for f in frames:
+            count = counts[f] - 1
+            if count:
+                counts[f] = count
+            else:
+                del counts[f]
+
+    def stats(self):
+        return {"depth": len(self), "high_water": self.high_water,
+                "promoted": self.promoted, "received": self.seq}
@@ -0,0 +1,154 @@
+"""
+ScriptCapture -- Fetches the source of parsed scripts in the background.
+
+Debugger.scriptParsed only tells us a script's hash, so we have to ask for
+its source with Debugger.getScriptSource. Doing that in the message loop was
+too slow, so the message loop only queues the scripts whose hash isn't in
+the script cache yet. A few worker threads fetch the sources through the
+async DevTools client, gzip them and write them to the cache.
+
+Each hash is queued once (coalesced) while it is queued or being fetched.
+The queue is bounded: when the workers can't keep up, new scripts are
+skipped (and counted as overflowed) instead of blocking the message loop or
+growing without bound. A skipped hash isn't remembered, so it is queued
+again the next time a frame parses the same script. The scripts still queued
+when the shutdown's drain timeout expires are dropped.
+"""
+import gzip
+import logging
+import queue
+import threading
+import time
+
+import websocket
+
+from modules import common
+
+
+class ScriptCapture(object):
+
+    def __init__(self, chrome, file_cache, workers=None, max_pending=None):
+        """
+        @chrome -- A dev_tools.AsyncChromeInterface (needs submit()).
+        @file_cache -- The utils.FileCache the sources are written to.
+        @workers -- Concurrent fetches, defaults to common.CAPTURE_WORKERS.
+        @max_pending -- Queued scripts, defaults to common.CAPTURE_QUEUE.
+        """
+        self.chrome = chrome
+        self.file_cache = file_cache
+        self.queue = queue.Queue(max_pending or common.CAPTURE_QUEUE)
+        # Hashes that are queued or being fetched.
+        self.pending = set()
+        # Guards pending and the counters, which the workers update too.
+        self.lock = threading.Lock()
+        # Set at shutdown, the workers exit once the queue is empty.
+        self.stopping = threading.Event()
+        self.aborted = False
+        self.log = logging.getLogger("ScriptCapture")
+
+        self.submitted = 0
+        self.cached = 0
+        self.overflowed = 0
+        self.dropped = 0
+        self.captured = 0
+        self.failed = 0
+        self.bytes_written = 0
+
+        self.workers = [threading.Thread(target=self._worker,
+                                         name="script-capture-{}".format(i),
+                                         daemon=True)
+                        for i in range(workers or common.CAPTURE_WORKERS)]
+        for worker in self.workers:
+            worker.start()
+
+    @staticmethod
+    def filename(s_hash):
+        return "{}.gz".format(s_hash)
+
+    def submit(self, m):
+        """Queues the script of a Debugger.scriptParsed message @m."""
+        p = m['params']
+        s_hash = p.get('hash')
+        if not s_hash:
+            return
+        with self.lock:
+            if s_hash in self.pending:
+                return
+            # The old, uncompressed cache named the sources by their hash.
+            if self.file_cache.contains(self.filename(s_hash), s_hash):
+                self.cached += 1
+                return
+            self.pending.add(s_hash)
+
+        try:
+            self.queue.put_nowait((p['scriptId'], s_hash, m.get('sessionId')))
+        except queue.Full:
+            with self.lock:
+                self.pending.discard(s_hash)
+                self.overflowed += 1
+            return
+        with self.lock:
+            self.submitted += 1
+
+    def _count(self, counter, n=1):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def _worker(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.stopping.is_set():
+                    return
+                continue
+            script_id, s_hash, session_id = item
+            try:
+                if self.aborted:
+                    self._count("dropped")
+                else:
+                    self._capture(script_id, s_hash, session_id)
+            except websocket._exceptions.WebSocketConnectionClosedException:
+                # The browser is gone, we can't fetch anything anymore.
+                self._count("failed")
+            except Exception as e:
+                self.log.error("Capturing {} failed: {}".format(s_hash, e))
+                self._count("failed")
+            finally:
+                with self.lock:
+                    self.pending.discard(s_hash)
+
+    def _capture(self, script_id, s_hash, session_id):
+        result = self.chrome.submit("Debugger.getScriptSource",
+                                    sessionId=session_id,
+                                    scriptId=script_id).result()
+        if not isinstance(result, dict) or 'result' not in result:
+            # Timed out, or the target (and its scripts) is gone.
+            self._count("failed")
+            return
+
+        src = result['result']['scriptSource']
+        content = gzip.compress(src.encode('utf-8', 'surrogatepass'))
+        self.file_cache.cache_file(content, self.filename(s_hash))
+        with self.lock:
+            self.captured += 1
+            self.bytes_written += len(content)
+
+    def close(self, timeout=None):
+        """Waits up to @timeout seconds for the queued scripts, then stops
+        the workers. Must be called before the DevTools socket is closed."""
+        self.stopping.set()
+        timeout = common.CAPTURE_DRAIN_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.join(max(0, deadline - time.monotonic()))
+        # Skip whatever is left.
+        self.aborted = True
+
+    def stats(self):
+        with self.lock:
+            return {"submitted": self.submitted, "cached": self.cached,
+                    "overflowed": self.overflowed, "dropped": self.dropped,
+                    "captured": self.captured, "failed": self.failed,
+                    "bytes_written": self.bytes_written,
+                    "queued": self.queue.qsize()}
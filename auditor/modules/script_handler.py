@@ -1,26 +1,59 @@
+from collections import namedtuple
+
 from modules import base
+from modules import frame_handler
 from modules import graph as g
 
 
+# What we keep of a Debugger.scriptParsed message until we can log it.
+ScriptRecord = namedtuple("ScriptRecord",
+                          ["script_id", "exec_context", "url", "hash"])
+
+
 class ScriptHandler(base.ObjectHandler):
+    """Logs the scripts parsed by every frame.
 
-    def __init__(self, handler=None, frame=None, debug=False):
-        """Initializes a ScriptHandler, for a frame."""
+    A script belongs to the document its frame has loaded, so we log it as
+    soon as the frame has navigated and we know its loader id. Until then,
+    a compact ScriptRecord is buffered on the frame (frame.pending_scripts)
+    and logged by flush() once the frame navigates or is logged.
+    """
 
-        id_ = 'script-handler-{}'.format(frame.id)
-        super().__init__(id_, handler, debug)
-        self.entries = dict()
-        self.frame = frame
-        self.handler = handler
+    def __init__(self, handler=None, debug=False):
+        super().__init__('script-handler', handler, debug)
+
+    @staticmethod
+    def record(m):
+        p = m['params']
+        return ScriptRecord(str(p['scriptId']), str(p['executionContextId']),
+                            p['url'] if 'url' in p else "None", p['hash'])
 
     def handle_script_parsed(self, m):
-        #XXX: We assume the frame object that is responsible for managing the
-        # ScriptHandler has already finalized the frame_id and loader_id.
-        #assert(self.frame.loader_id), "No loader id {}.".format(self.frame)
-        assert(self.frame.exec_context), "No exec context {}".format(self.frame)
-        script = g.Script.from_m(m, self.frame.frame_id, self.frame.loader_id)
-        script.log(self)
+        p = m['params']
+        try:
+            frame_id = p['executionContextAuxData']['frameId']
+        except KeyError:
+            return
+
+        frame = frame_handler.FrameHandler.GetFrame(frame_id)
+        if not frame:
+            return
+        record = self.record(m)
+        if frame.has_navigated and frame.loader_id:
+            self.log_script(frame, record)
+        else:
+            frame.pending_scripts.append(record)
+
+    def log_script(self, frame, record):
+        g.Script.from_record(record, frame.frame_id, frame.loader_id).log(self)
 
+    def flush(self, frame):
+        """Logs the scripts buffered on @frame with its current loader id."""
+        if not frame or not frame.pending_scripts:
+            return
+        for record in frame.pending_scripts:
+            self.log_script(frame, record)
+        frame.pending_scripts = list()
 
     handlers = {
         "Debugger.scriptParsed" : handle_script_parsed
@@ -0,0 +1,276 @@
+"""
+Segment -- A compact, columnar alternative to the neo4j CSV output.
+
+A segment file holds the same rows as the CSV that utils.CSVLogger would
+have written, stored as blocks of dictionary-encoded columns:
+
+    MAGIC
+    (uint32 length, zlib(block))*
+
+    block = varint #new columns, (varint len, utf-8 name)*
+            varint #new strings, (varint len, utf-8 string)*
+            varint #rows
+            uint32[#rows] for every column seen so far
+            varint #replacements, (varint row in block, varint row)*
+
+Each value is stored as an index into the segment's string dictionary (0 is
+an empty value). The dictionary is shared by every block of a file and each
+block only carries the strings that are new, so the session ids, frame ids,
+domains and resource hashes that repeat on every row are stored once.
+
+An object that is logged again replaces its earlier row, like it does in the
+CSV. Its new row is appended to the current block as a replacement of the
+earlier one (counting the rows that aren't replacements), and iter_rows()
+puts it in the earlier row's place.
+"""
+import array
+import csv
+import logging
+import os
+import struct
+import sys
+import zlib
+
+from modules import common
+from modules import utils
+
+
+MAGIC = b"MNSEG2\n"
+EXTENSION = "seg"
+BLOCK_ROWS = 4096
+_LENGTH = struct.Struct("<I")
+
+
+class SegmentError(Exception):
+    pass
+
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_strings(out, strings):
+    _write_varint(out, len(strings))
+    for s in strings:
+        encoded = s.encode('utf-8', 'surrogatepass')
+        _write_varint(out, len(encoded))
+        out += encoded
+
+
+def _read_strings(data, pos):
+    count, pos = _read_varint(data, pos)
+    strings = list()
+    for _ in range(count):
+        length, pos = _read_varint(data, pos)
+        strings.append(data[pos:pos + length].decode('utf-8', 'surrogatepass'))
+        pos += length
+    return strings, pos
+
+
+class SegmentLogger(object):
+    """Drop-in replacement for utils.CSVLogger that writes a segment file."""
+
+    def __init__(self, filename, debug=True, block_rows=BLOCK_ROWS):
+        self.filename = filename
+        self.block_rows = block_rows
+        self.columns = list()
+        self.index = dict()
+        self.strings = {None: 0, '': 0}
+        # id -> the number of its row.
+        self.ids = dict()
+        self.file = None
+        self.rows = 0
+        self.bytes_written = 0
+        self.flushed = False
+        self.debug = debug
+        self.log = logging.getLogger("SegmentLogger-{}".format(filename))
+        self._new_block()
+
+    def _new_block(self):
+        self.block = [array.array('I') for _ in self.columns]
+        self.block_size = 0
+        # (row in the block, the row it replaces).
+        self.replacements = list()
+        self.new_columns = list()
+        self.new_strings = list()
+
+    def _encode(self, value):
+        if value is not None and not isinstance(value, str):
+            value = str(value)
+        index = self.strings.get(value)
+        if index is None:
+            index = len(self.strings) - 1
+            self.strings[value] = index
+            self.new_strings.append(value)
+        return index
+
+    def add(self, obj):
+        if self.debug and common.PROVENANCE:
+            obj.properties['handler'] = utils.which_handler()
+        properties = obj.properties
+        if not self.columns:
+            # Start with the columns the class declares, see CSVLogger.
+            for key in getattr(obj, 'columns', ()):
+                self.index[key] = len(self.columns)
+                self.columns.append(key)
+                self.new_columns.append(key)
+                self.block.append(array.array('I'))
+        for key in properties:
+            if key not in self.index:
+                self.index[key] = len(self.columns)
+                self.columns.append(key)
+                self.new_columns.append(key)
+                self.block.append(array.array('I', bytes(4 * self.block_size)))
+
+        for column, values in zip(self.columns, self.block):
+            values.append(self._encode(properties.get(column)))
+        row = self.ids.get(obj.id)
+        if row is None:
+            self.ids[obj.id] = self.rows
+            self.rows += 1
+        else:
+            self.replacements.append((self.block_size, row))
+        self.block_size += 1
+
+        if self.block_size >= self.block_rows:
+            self._write_block()
+
+    def _write_block(self):
+        if not self.block_size:
+            return
+        if self.file is None:
+            self.file = open(self.filename, 'wb')
+            self.file.write(MAGIC)
+            self.bytes_written += len(MAGIC)
+
+        payload = bytearray()
+        _write_strings(payload, self.new_columns)
+        _write_strings(payload, self.new_strings)
+        _write_varint(payload, self.block_size)
+        for values in self.block:
+            if sys.byteorder == 'big':
+                values.byteswap()
+            payload += values.tobytes()
+        _write_varint(payload, len(self.replacements))
+        for position, row in self.replacements:
+            _write_varint(payload, position)
+            _write_varint(payload, row)
+
+        compressed = zlib.compress(bytes(payload), 6)
+        self.file.write(_LENGTH.pack(len(compressed)))
+        self.file.write(compressed)
+        self.bytes_written += _LENGTH.size + len(compressed)
+        self._new_block()
+
+    def flush(self):
+        if self.flushed:
+            self.log.warning("Segment is already flushed!")
+            return
+        self._write_block()
+        if self.file:
+            self.file.close()
+        self.flushed = True
+
+    def close(self):
+        return
+
+
+def iter_blocks(filename):
+    """Yields (columns, rows, replacements) for every block of a segment
+    file.
+
+    @columns grows as new columns appear, rows are lists of strings that
+    are aligned with @columns ('' for empty values). @replacements maps the
+    position of a replacement row in @rows to the row it replaces.
+    """
+    columns = list()
+    strings = ['']
+    with open(filename, 'rb') as infile:
+        if infile.read(len(MAGIC)) != MAGIC:
+            raise SegmentError("{} is not a segment file".format(filename))
+        while True:
+            header = infile.read(_LENGTH.size)
+            if len(header) < _LENGTH.size:
+                return
+            length, = _LENGTH.unpack(header)
+            data = zlib.decompress(infile.read(length))
+
+            new_columns, pos = _read_strings(data, 0)
+            new_strings, pos = _read_strings(data, pos)
+            num_rows, pos = _read_varint(data, pos)
+            columns.extend(new_columns)
+            strings.extend(new_strings)
+
+            values = list()
+            for _ in columns:
+                column = array.array('I')
+                column.frombytes(data[pos:pos + 4 * num_rows])
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                pos += 4 * num_rows
+                values.append([strings[i] for i in column])
+            replacements = dict()
+            count, pos = _read_varint(data, pos)
+            for _ in range(count):
+                position, pos = _read_varint(data, pos)
+                replacements[position], pos = _read_varint(data, pos)
+            yield (list(columns), [list(row) for row in zip(*values)],
+                   replacements)
+
+
+def _read_replacements(filename):
+    """Returns every column of a segment file, and the replaced rows (the
+    last replacement of each)."""
+    columns = list()
+    replaced = dict()
+    for columns, rows, replacements in iter_blocks(filename):
+        for position, row in replacements.items():
+            replaced[row] = rows[position]
+    return columns, replaced
+
+
+def read_columns(filename):
+    """Returns every column of a segment file."""
+    return _read_replacements(filename)[0]
+
+
+def iter_rows(filename):
+    """Yields the header and then every row, padded to the final columns."""
+    columns, replaced = _read_replacements(filename)
+    yield columns
+    width = len(columns)
+    i = 0
+    for block_columns, rows, replacements in iter_blocks(filename):
+        for position, row in enumerate(rows):
+            if position in replacements:
+                continue
+            row = replaced.get(i, row)
+            yield row + [''] * (width - len(row))
+            i += 1
+
+
+def to_csv(filename, out_path=None):
+    """Converts a segment file to the neo4j CSV layout, returns its path."""
+    if out_path is None:
+        out_path = os.path.splitext(filename)[0] + ".csv"
+    with open(out_path, 'w', newline='') as outfile:
+        writer = csv.writer(outfile, delimiter=common.DELIM,
+                            lineterminator='\n')
+        for row in iter_rows(filename):
+            writer.writerow(row)
+    return out_path
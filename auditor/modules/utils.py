@@ -1,17 +1,21 @@
 import os
-import traceback
-import glob
+import contextvars
+import csv
+import hashlib
 import random
 import string
+import threading
 from weakref import WeakSet
-from collections import defaultdict
+from collections import Counter, defaultdict
 from datetime import datetime
 
 #from modules import graph as g
+from modules import common
+from modules import segment
+from modules import journal
+from modules import writer
 from modules.common import *
 
-import pandas as pd
-
 #TODO(Andrew): Update session-id code to access the session id using
 # g.Session.Instance().get_session_id() method instead of using global
 # variable.
@@ -60,14 +64,34 @@ def get_script_id_from_stack(m):
     return caller['scriptId']
 
 
+# Name of the handle_* function processing the current message. It is set
+# for each handler function by base.Handler._dispatch, unless an outer
+# context (e.g., handle_shutdown) is set already.
+current_handler = contextvars.ContextVar("current_handler", default=None)
+
 def which_handler():
     """Utility function to determine which handler called this function. Only
     useful for debugging."""
+    return current_handler.get()
+
+class handler_context(object):
+    """Attributes everything created in this block to handler @name, unless
+    an outer handler is already set."""
+
+    __slots__ = ('name', 'token')
+
+    def __init__(self, name):
+        self.name = name
+        self.token = None
+
+    def __enter__(self):
+        if current_handler.get() is None:
+            self.token = current_handler.set(self.name)
 
-    ss = traceback.extract_stack()
-    for frame in ss:
-        if frame.name.startswith('handle_'):
-            return frame.name
+    def __exit__(self, *exc):
+        if self.token is not None:
+            current_handler.reset(self.token)
+            self.token = None
 
 def random_string_digits(stringLength):
         """Generate a random string of letters and digits """
@@ -75,26 +99,101 @@ def random_string_digits(stringLength):
         return ''.join(random.choice(lettersAndDigits) for i in range(stringLength))
 
 class FileCache(object):
+    """A content-addressed file cache.
 
-    def __init__(self, dirname, is_bytes=False):
-        self.dirname = dirname
+    Files are sharded by the first characters of their name (e.g., the
+    script hash) into @levels levels of two-character directories:
+
+        script-cache/3a/d4/3ad48bc2....gz
+
+    The names of the cached files are appended to an index file, which is
+    loaded at startup. This way lookups are set lookups, not stat calls. If
+    the index is missing, it is rebuilt by scanning the cache, which also
+    moves files of the old, flat layout into their shards.
+    """
+
+    INDEX = "index"
 
+    def __init__(self, dirname, is_bytes=False, levels=2):
+        self.dirname = dirname
+        self.levels = levels
         self.mode = "wb" if is_bytes else "w"
+        self.lock = threading.Lock()
 
         try:
             os.mkdir(dirname)
         except FileExistsError:
             pass
 
+        index_path = os.path.join(dirname, self.INDEX)
+        if os.path.exists(index_path):
+            self.files = self._load_index(index_path)
+        else:
+            self.files = self._rebuild_index(index_path)
+        self.index = open(index_path, 'a')
+
+    def _load_index(self, index_path):
+        with open(index_path) as infile:
+            return set(line.rstrip('\n') for line in infile if line.strip())
+
+    def _rebuild_index(self, index_path):
+        files = set()
+        for root, dirs, filenames in os.walk(self.dirname):
+            for filename in filenames:
+                if root == self.dirname and filename == self.INDEX:
+                    continue
+                path = os.path.join(root, filename)
+                if filename.endswith(".tmp"):
+                    os.remove(path)
+                    continue
+                shard_path = self.path(filename)
+                if path != shard_path:
+                    os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+                    os.replace(path, shard_path)
+                files.add(filename)
+        with open(index_path, 'w') as outfile:
+            for filename in files:
+                outfile.write("{}\n".format(filename))
+        return files
+
+    def path(self, filename):
+        """The path @filename is (or would be) cached at."""
+        shards = [filename[2*i:2*i + 2] for i in range(self.levels)]
+        return os.path.join(self.dirname, *shards, filename)
+
+    def __len__(self):
+        return len(self.files)
+
+    def contains(self, *filenames):
+        """Whether any of @filenames is cached, e.g., a file under its
+        current or its legacy name."""
+        for filename in filenames:
+            if filename in self.files:
+                return True
+        return False
+
     def cache_file(self, content, filename):
         """Create a new file in the File cache."""
-        out_path = os.path.join(self.dirname, filename)
-
-        if os.path.exists(out_path):
+        if filename in self.files:
             return
 
-        with open(out_path, self.mode) as outfile:
+        out_path = self.path(filename)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        # Write to a temporary file first, so a crash never leaves a partial
+        # file behind under the final name.
+        tmp_path = "{}.{}.tmp".format(out_path, threading.get_ident())
+        with open(tmp_path, self.mode) as outfile:
             outfile.write(content)
+        os.replace(tmp_path, out_path)
+
+        with self.lock:
+            if filename not in self.files:
+                self.files.add(filename)
+                self.index.write("{}\n".format(filename))
+                self.index.flush()
+
+    def close(self):
+        self.index.close()
 
 
 class FileLogger(object):
@@ -114,36 +213,92 @@ class FileLogger(object):
         self.file.close()
 
 class CSVLogger(object):
-    """ Maintains a set of objects, which eventually will be stored in a
-        csv file named @filename.
+    """ Streams a set of objects to a csv file named @filename.
 
         In order for this class to support logging objects to a CSV, the class
         of the objects needs to have a (unique) id field and a dictionary of
-        properties. The keys in properties become the rows and the values will
-        become the values in the csv.
+        properties. The keys in properties become the columns and the values
+        will become the values in the csv. If an object with the same id is
+        logged again, its last row wins (like the pandas logger's dict did):
+        it replaces the first row when the file is flushed.
 
         This class may seem like overkill, but it is useful when you are not
         sure what objects will be created in the future, and little effort is
         needed to setup logging for the new class.
 
-        NOTE: Currently, we have no flushing mechanism, since we are relying
-              on pandas to create the actual CSV files. We are using pandas,
-              since it allows us to easily create a CSV without defining the
-              columns or shape of the csv, which is unknown by this class.
+        NOTE: Rows are written as soon as they are added. Since we don't know
+              the columns up front, a property key that shows up mid-stream
+              is appended as a new column, and the header (and the shorter
+              rows before it) is fixed up once, when the file is flushed.
+              A row is encoded when it is added, so a property that changes
+              afterwards is only logged if the object is added again.
         """
 
     def __init__(self, filename, debug=True):
         self.filename = filename
-        self.entries = defaultdict(dict)
+        self.columns = list()
+        self.index = dict()
+        # id -> the number of its row.
+        self.ids = dict()
+        # Row number -> the row of an object that was added again.
+        self.replaced = dict()
+        self.file = None
+        self.writer = None
+        self.header_width = 0
+        self.rows = 0
         self.flushed = False
         self.debug = debug
         self.log = logging.getLogger("CSVLogger-{}".format(self.filename))
 
     def add(self, obj):
-        if self.debug:
+        if self.debug and common.PROVENANCE:
             handler = which_handler()
             obj.properties['handler'] = handler
-        self.entries[obj.id] = obj.properties
+        properties = obj.properties
+        if not self.columns:
+            # Start with the columns the class declares, so columns that
+            # only show up later don't require fixing up the header.
+            for key in getattr(obj, 'columns', ()):
+                self.index[key] = len(self.columns)
+                self.columns.append(key)
+        for key in properties:
+            if key not in self.index:
+                self.index[key] = len(self.columns)
+                self.columns.append(key)
+
+        row = self.ids.get(obj.id)
+        if row is not None:
+            self.replaced[row] = [properties.get(c) for c in self.columns]
+            return
+        self.ids[obj.id] = self.rows
+
+        if self.file is None:
+            self.file = open(self.filename, 'w', newline='')
+            self.writer = csv.writer(self.file, delimiter=DELIM,
+                                     lineterminator='\n')
+            self.writer.writerow(self.columns)
+            self.header_width = len(self.columns)
+
+        self.writer.writerow([properties.get(c) for c in self.columns])
+        self.rows += 1
+
+    def _rewrite(self):
+        """Rewrites the file with the final set of columns and the rows of
+        the objects that were added again."""
+        width = len(self.columns)
+        # Hidden, so ObjectManager's and the exporters' globs never see it.
+        dirname, basename = os.path.split(self.filename)
+        tmp_path = os.path.join(dirname, ".{}.tmp".format(basename))
+        with open(self.filename, newline='') as infile, \
+                open(tmp_path, 'w', newline='') as outfile:
+            reader = csv.reader(infile, delimiter=DELIM)
+            writer = csv.writer(outfile, delimiter=DELIM, lineterminator='\n')
+            next(reader)
+            writer.writerow(self.columns)
+            for i, row in enumerate(reader):
+                row = self.replaced.get(i, row)
+                writer.writerow(row + [''] * (width - len(row)))
+        os.replace(tmp_path, self.filename)
 
     def flush(self):
         #XXX. IF we reach here after we are flushed, it means something
@@ -151,16 +306,60 @@ class CSVLogger(object):
         if self.flushed:
             self.log.warning("CSV file is already flushed!")
         else:
-            df = pd.DataFrame.from_dict(self.entries, orient='index')
-            # If no entries, then dont' actually create the logs.
-            if len(df.index):
-                df.to_csv(self.filename, index=False, sep=DELIM)
+            # If no entries, then the log was never created.
+            if self.file:
+                self.file.close()
+                if len(self.columns) > self.header_width or self.replaced:
+                    self._rewrite()
+                self.replaced = dict()
             self.flushed = True
 
     def close(self):
         return
 
 
+class SeenIndex(object):
+    """The nodes that have been written during this session.
+
+    We only keep a 64-bit blake2b fingerprint of (label, id), which is a lot
+    smaller than the ids themselves (resource ids alone are 64 hex digits).
+    The fingerprints are exact, unlike a Bloom filter, so a false positive
+    needs a 64-bit collision before we would drop a node.
+    """
+
+    def __init__(self):
+        self.fingerprints = set()
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    @staticmethod
+    def fingerprint(label, obj_id):
+        key = "{}\0{}".format(label, obj_id).encode('utf-8', 'surrogatepass')
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(),
+                              'little')
+
+    def add(self, label, obj_id):
+        """Returns True if this is the first time we see the node."""
+        fingerprint = self.fingerprint(label, obj_id)
+        if fingerprint in self.fingerprints:
+            return False
+        self.fingerprints.add(fingerprint)
+        return True
+
+
+class Occurrence(object):
+    """A row of the occurrences log: how often node @node of @label was seen
+    again, after it was written, during one log rotation."""
+
+    __slots__ = ('id', 'properties')
+
+    def __init__(self, label, node, count):
+        self.id = "{}:{}".format(label, node)
+        self.properties = {'id': self.id, 'label': label, 'node': node,
+                           'count': count}
+
+
 # We need to create a dict for each object that logs its id and properties.
 class ObjectLogger(FileLogger):
 
@@ -185,60 +384,124 @@ class ObjectLogger(FileLogger):
 
 
 class ObjectManager(object):
-    """Manages a set of CSVLogger's.
+    """Manages a set of CSVLogger's (or segment.SegmentLogger's).
+
+    With common.JOURNAL, every row of the current segment is also appended
+    to a journal.Journal, so a crash doesn't lose the rows that haven't been
+    flushed yet (see recover.py).
+
+    Nodes of common.DEDUP_LABELS are written once per session. The seen index
+    is shared by every ObjectManager, so it survives log rotation and the
+    ChromeHandler and FrameHandler don't write each other's nodes twice.
 
     NOTE: Originally, it managed a set of ObjectLogger.
     """
 
-    def __init__(self, dirname="neo4j-csvs", flush_threshold=50000):
+    seen = SeenIndex()
+
+    def __init__(self, dirname=None, flush_threshold=50000,
+                 output_format=None):
         """
+        @dirname -- Defaults to common.CSV_DIR.
         @flush_threshold -- Flush to files after @flush_threshold entries.
+        @output_format -- "csv" or "segment", defaults to common.OUTPUT_FORMAT.
         """
 
-        if not os.path.exists(dirname):
-            os.mkdir(dirname)
+        dirname = dirname or common.CSV_DIR
+        os.makedirs(dirname, exist_ok=True)
 
         self.dirname = dirname
         self.flush_threshold = flush_threshold
         self.entries_cnt = 0
         self.loggers = dict()
+        self.output_format = output_format or common.OUTPUT_FORMAT
+        # (label, id) -> sightings of already written nodes since the last
+        # rotation.
+        self.occurrences = Counter()
+        # The journal of the current segment, created on its first row.
+        self.journal = None
+
+    def _journal(self):
+        if self.journal is None:
+            self.journal = journal.Journal(self.dirname, self.output_format)
+            writer.BackgroundWriter.Instance().register(self.journal)
+        return self.journal
 
     def register_loggers(self, resource_names):
         for r in resource_names:
             self.register_logger(r)
 
-    def register_logger(self, resource_name):
-        out_path = self._create_logfile(resource_name)
-        self.loggers[resource_name] = CSVLogger(out_path)
+    def register_logger(self, resource_name, debug=True):
+        if self.output_format == "segment":
+            out_path = self._create_logfile(resource_name, segment.EXTENSION)
+            self.loggers[resource_name] = segment.SegmentLogger(out_path,
+                                                                debug)
+        else:
+            out_path = self._create_logfile(resource_name)
+            self.loggers[resource_name] = CSVLogger(out_path, debug)
+        if common.JOURNAL:
+            self._journal().add_file(resource_name, out_path)
+
+    def _log(self, key, value):
+        self.loggers[key].add(value)
+        if self.journal is not None:
+            self.journal.add(key, value)
 
     def add(self, key, value):
         """ Create a new object logger if it doesn't exist, then add
         value to associated ObjectLogger."""
+        if key in common.DEDUP_LABELS and not self.seen.add(key, value.id):
+            self.occurrences[(key, value.id)] += 1
+            return
+
         # Register key if this is first time we have seen it.
         if key not in self.loggers:
             self.register_logger(key)
-        self.loggers[key].add(value)
+        self._log(key, value)
 
         # Rotate logs if necessary.
         if self.entries_cnt > self.flush_threshold:
             self.entries_cnt = 0
-            #NOTE: We want to force file to close, so exiting = True.
-            self.flush_all(exiting=True)
-            self.loggers = dict()
+            self.rotate()
         else:
             self.entries_cnt += 1
 
+    def rotate(self):
+        """Hands the current segment to the background writer and starts a
+        new one, which accepts writes right away."""
+        self.flush_occurrences()
+        loggers, self.loggers = list(self.loggers.values()), dict()
+        segment_journal, self.journal = self.journal, None
+        if common.BACKGROUND_FLUSH:
+            writer.BackgroundWriter.Instance().submit(loggers, segment_journal)
+        else:
+            writer.BackgroundWriter.Instance().finalize(loggers,
+                                                        segment_journal)
+
+    def flush_occurrences(self):
+        """Logs the occurrence counts of the current rotation."""
+        if not self.occurrences:
+            return
+        if common.OCCURRENCES not in self.loggers:
+            self.register_logger(common.OCCURRENCES, debug=False)
+        for (label, node), count in self.occurrences.items():
+            self._log(common.OCCURRENCES, Occurrence(label, node, count))
+        self.occurrences = Counter()
+
     def flush_all(self, exiting=False):
-        for logger in self.loggers.values():
-            logger.flush()
-            if exiting:
-                logger.close()
-
-    def _create_logfile(self, resource_name):
-        exp = os.path.join(self.dirname, resource_name)
-        file_cnt = [int(f.split('.')[-2]) for f in glob.glob(exp + "*")]
-        max_val = max(file_cnt) + 1 if file_cnt else 0
+        self.flush_occurrences()
+        if exiting:
+            segment_journal, self.journal = self.journal, None
+            writer.BackgroundWriter.Instance().finalize(self.loggers.values(),
+                                                        segment_journal)
+        else:
+            for logger in self.loggers.values():
+                logger.flush()
+        # Wait for the segments we rotated earlier.
+        writer.BackgroundWriter.Instance().drain()
+
+    def _create_logfile(self, resource_name, extension="csv"):
         timestamp = datetime.timestamp(datetime.now())
-        out_file = "{}.{}.csv".format(resource_name, timestamp)
+        out_file = "{}.{}.{}".format(resource_name, timestamp, extension)
         out_path = os.path.join(self.dirname, out_file)
         return out_path
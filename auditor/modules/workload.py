@@ -0,0 +1,295 @@
+"""
+Workload -- Generates synthetic DevTools traffic for benchmarking.
+
+The generated stream uses the replay.ReplayInterface record format, so it can
+be fed through ChromeHandler exactly like a recording of a real browser. Each
+tab loads a number of pages; every page attaches iframes and issues an
+ad-heavy fan-out of network requests against a pool of domains, where a few
+popular (CDN) domains and paths receive most of the traffic.
+"""
+import hashlib
+import random
+
+
+# Preset workloads used by the benchmark suite.
+SCENARIOS = {
+    # A quick sanity check.
+    "small": dict(tabs=2, pages=2, iframes=2, requests=50, scripts=10,
+                  domains=20),
+    # Ad-heavy news sites: lots of iframes and thousands of requests per page.
+    "news": dict(tabs=4, pages=3, iframes=12, requests=1500, scripts=60,
+                 domains=300),
+    # Many tabs opened at once, each with a light page.
+    "tabs": dict(tabs=40, pages=1, iframes=2, requests=100, scripts=15,
+                 domains=100),
+}
+
+RESOURCE_TYPES = ["Script", "Image", "XHR", "Stylesheet", "Font", "Fetch"]
+SERVERS = ["nginx", "cloudflare", "AmazonS3", "Apache", "ECS (dcb/7F83)"]
+USER_AGENT = ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/78.0.3904.97 Safari/537.36")
+
+
+class Workload(object):
+    """Builds the records of a synthetic browsing session."""
+
+    def __init__(self, tabs=2, pages=2, iframes=2, requests=50, scripts=10,
+                 domains=20, seed=0):
+        self.tabs = tabs
+        self.pages = pages
+        self.iframes = iframes
+        self.requests = requests
+        self.scripts = scripts
+        self.rng = random.Random(seed)
+        self.timestamp = 1000.0
+        self.wall_time = 1571234567.0
+        self.counter = 0
+        self.domains = ["{}.{}".format(self._word(), tld) for tld in
+                        self.rng.choices(["com", "net", "io", "org"],
+                                         k=domains)]
+        self.paths = {d: ["/{}/{}.js".format(self._word(), self._word())
+                          for _ in range(self.rng.randint(1, 20))]
+                      for d in self.domains}
+
+    def _word(self):
+        return "".join(self.rng.choices("abcdefghijklmnopqrstuvwxyz",
+                                        k=self.rng.randint(3, 10)))
+
+    def _id(self):
+        return "%032X" % self.rng.getrandbits(128)
+
+    def _next_id(self):
+        self.counter += 1
+        return str(self.counter)
+
+    def _tick(self):
+        step = self.rng.random() / 1000
+        self.timestamp += step
+        self.wall_time += step
+
+    def _url(self):
+        # Pareto makes a handful of domains (and their paths) very popular.
+        index = int(self.rng.paretovariate(1.1)) - 1
+        domain = self.domains[index % len(self.domains)]
+        return "https://{}{}".format(domain, self.rng.choice(self.paths[domain]))
+
+    @staticmethod
+    def _event(method, params, session_id=None):
+        m = {"method": method, "params": params}
+        if session_id:
+            m["sessionId"] = session_id
+        return {"k": "e", "m": m}
+
+    @staticmethod
+    def _reply(method, result, msgs=None):
+        return {"k": "r", "method": method,
+                "m": {"id": 0, "result": result}, "msgs": msgs or []}
+
+    def _target_info(self, target_id, attached):
+        return {"targetId": target_id, "type": "page", "title": "",
+                "url": "", "attached": attached,
+                "browserContextId": "CONTEXT"}
+
+    def bootstrap(self):
+        """Records consumed by ChromeHandler._init_connections."""
+        browser_info = {"targetId": self._id(), "type": "browser",
+                        "title": "", "url": "", "attached": True}
+        attached = self._event("Target.attachedToTarget", {
+            "sessionId": "BROWSER", "targetInfo": browser_info,
+            "waitingForDebugger": False})
+        return [
+            {"k": "v", "m": {"Browser": "Chrome/78.0.3904.97",
+                             "User-Agent": USER_AGENT}},
+            self._reply("Target.attachToBrowserTarget",
+                        {"sessionId": "BROWSER"}, [attached["m"]]),
+            self._reply("Target.getTargets", {"targetInfos": []}),
+        ]
+
+    def _attach(self, target_id, session_id):
+        records = [
+            self._event("Target.targetCreated",
+                        {"targetInfo": self._target_info(target_id, False)}),
+            self._reply("Target.attachToTarget", {"sessionId": session_id}),
+        ]
+        for method in ["Target.setDiscoverTargets", "Target.setAutoAttach",
+                       "Page.enable", "Network.enable", "Debugger.enable",
+                       "Page.setLifecycleEventsEnabled"]:
+            records.append(self._reply(method, {}))
+        records.append(self._event("Target.attachedToTarget", {
+            "sessionId": session_id,
+            "targetInfo": self._target_info(target_id, True),
+            "waitingForDebugger": False}, session_id))
+        return records
+
+    def _document(self, session_id, frame_id, url):
+        """Yields the events of a frame loading a new document."""
+        loader_id = self._id()
+        self._tick()
+        yield self._event("Network.requestWillBeSent", {
+            "requestId": loader_id, "loaderId": loader_id,
+            "documentURL": url, "frameId": frame_id, "type": "Document",
+            "request": {"url": url, "method": "GET", "headers": {}},
+            "initiator": {"type": "other"}, "timestamp": self.timestamp,
+            "wallTime": self.wall_time, "hasUserGesture": False},
+            session_id)
+        yield from self._response(session_id, frame_id, loader_id, loader_id,
+                                  url, "Document")
+        origin = url.split("/", 3)
+        yield self._event("Page.frameNavigated", {"frame": {
+            "id": frame_id, "loaderId": loader_id, "url": url,
+            "securityOrigin": "/".join(origin[:3]),
+            "mimeType": "text/html"}}, session_id)
+
+    def _response(self, session_id, frame_id, loader_id, request_id, url,
+                  resource_type):
+        self._tick()
+        domain = url.split("/")[2]
+        rip = "10.{}.{}.{}".format(*hashlib.md5(domain.encode()).digest()[:3])
+        yield self._event("Network.responseReceived", {
+            "requestId": request_id, "loaderId": loader_id,
+            "frameId": frame_id, "type": resource_type,
+            "timestamp": self.timestamp,
+            "response": {"url": url, "status": 200,
+                         "headers": {"server": self.rng.choice(SERVERS)},
+                         "remoteIPAddress": rip}}, session_id)
+        # Traffic that we receive, but (currently) don't handle.
+        yield self._event("Network.dataReceived", {
+            "requestId": request_id, "timestamp": self.timestamp,
+            "dataLength": 4096, "encodedDataLength": 1024}, session_id)
+        self._tick()
+        if self.rng.random() < 0.02:
+            yield self._event("Network.loadingFailed", {
+                "requestId": request_id, "timestamp": self.timestamp,
+                "type": resource_type, "errorText": "net::ERR_ABORTED",
+                "canceled": True}, session_id)
+        else:
+            yield self._event("Network.loadingFinished", {
+                "requestId": request_id, "timestamp": self.timestamp,
+                "encodedDataLength": 1024}, session_id)
+
+    def _scripts(self, session_id, frame_id, context_id, count, script_ids):
+        """Yields scriptParsed events, adding (scriptId, url) to @script_ids."""
+        for _ in range(count):
+            script_id = self._next_id()
+            url = self._url()
+            script_ids.append((script_id, url))
+            yield self._event("Debugger.scriptParsed", {
+                "scriptId": script_id, "url": url,
+                "executionContextId": context_id,
+                "hash": hashlib.sha1(url.encode()).hexdigest(),
+                "executionContextAuxData": {"frameId": frame_id,
+                                            "isDefault": True}},
+                session_id)
+
+    def _requests(self, session_id, frames):
+        """Yields the ad-heavy request fan-out spread across @frames."""
+        pending = []
+        for _ in range(self.requests):
+            frame_id, loader_id, scripts = self.rng.choice(frames)
+            request_id = "{}.{}".format(self.rng.randint(1000, 9999),
+                                        self._next_id())
+            url = self._url()
+            resource_type = self.rng.choice(RESOURCE_TYPES)
+            kind = self.rng.random()
+            if kind < 0.6 and scripts:
+                script_id, script_url = self.rng.choice(scripts)
+                initiator = {"type": "script", "stack": {"callFrames": [{
+                    "functionName": "", "scriptId": script_id,
+                    "url": script_url, "lineNumber": 0, "columnNumber": 0}]}}
+            elif kind < 0.9:
+                initiator = {"type": "parser", "url": url}
+            else:
+                initiator = {"type": "other"}
+            self._tick()
+            params = {
+                "requestId": request_id, "loaderId": loader_id,
+                "documentURL": url, "frameId": frame_id,
+                "type": resource_type,
+                "request": {"url": url, "method": "GET", "headers": {}},
+                "initiator": initiator, "timestamp": self.timestamp,
+                "wallTime": self.wall_time, "hasUserGesture": False}
+            yield self._event("Network.requestWillBeSent", params, session_id)
+            # Some requests are redirected, which reuses the requestId.
+            if self.rng.random() < 0.05:
+                redirect = self._url()
+                self._tick()
+                yield self._event("Network.requestWillBeSent", dict(
+                    params, documentURL=redirect, timestamp=self.timestamp,
+                    wallTime=self.wall_time,
+                    request={"url": redirect, "method": "GET", "headers": {}},
+                    redirectResponse={"url": url, "status": 302,
+                                      "headers": {"location": redirect}}),
+                    session_id)
+                url = redirect
+            pending.append((frame_id, loader_id, request_id, url,
+                            resource_type))
+            # Responses arrive out of order, a few requests later.
+            if len(pending) > 8:
+                r = pending.pop(self.rng.randrange(len(pending)))
+                yield from self._response(session_id, *r)
+        for r in pending:
+            yield from self._response(session_id, *r)
+
+    def tab(self):
+        """Yields the records of a single tab (one chunk per record)."""
+        target_id = self._id()
+        session_id = self._id()
+        yield self._attach(target_id, session_id)
+
+        context_id = 1
+        for _ in range(self.pages):
+            url = "https://www.{}/".format(self.rng.choice(self.domains))
+            for record in self._document(session_id, target_id, url):
+                yield [record]
+            loader_id = record["m"]["params"]["frame"]["loaderId"]
+            context_id += 1
+            main_scripts = []
+            for record in self._scripts(session_id, target_id, context_id,
+                                        self.scripts, main_scripts):
+                yield [record]
+            frames = [(target_id, loader_id, main_scripts)]
+
+            for _ in range(self.iframes):
+                frame_id = self._id()
+                creator_id, creator_url = self.rng.choice(main_scripts)
+                yield [self._event("Page.frameAttached", {
+                    "frameId": frame_id, "parentFrameId": target_id,
+                    "stack": {"callFrames": [{
+                        "functionName": "", "scriptId": creator_id,
+                        "url": creator_url, "lineNumber": 0,
+                        "columnNumber": 0}]}}, session_id)]
+                frame_url = self._url().rsplit(".", 1)[0] + ".html"
+                for record in self._document(session_id, frame_id, frame_url):
+                    yield [record]
+                frame_loader = record["m"]["params"]["frame"]["loaderId"]
+                context_id += 1
+                frame_scripts = []
+                for record in self._scripts(session_id, frame_id, context_id,
+                                            max(1, self.scripts // 10),
+                                            frame_scripts):
+                    yield [record]
+                frames.append((frame_id, frame_loader, frame_scripts))
+
+            for record in self._requests(session_id, frames):
+                yield [record]
+
+            # The iframes go away when the page navigates (or closes).
+            for frame_id, _, _ in frames[1:]:
+                yield [self._event("Page.frameDetached", {
+                    "frameId": frame_id, "reason": "remove"}, session_id)]
+
+        yield [self._event("Target.detachedFromTarget", {
+                   "sessionId": session_id, "targetId": target_id}),
+               self._event("Target.targetDestroyed", {"targetId": target_id})]
+
+    def records(self):
+        """Yields every record of the session, interleaving the tabs."""
+        yield from self.bootstrap()
+        tabs = [self.tab() for _ in range(self.tabs)]
+        while tabs:
+            for tab in list(tabs):
+                chunk = next(tab, None)
+                if chunk is None:
+                    tabs.remove(tab)
+                else:
+                    yield from chunk
@@ -0,0 +1,208 @@
+"""
+BackgroundWriter -- Finalizes rotated log segments off the message loop.
+
+When an ObjectManager rotates its logs, finalizing them (closing the files,
+fixing up CSV headers that grew columns, compressing the last block of a
+segment) used to run inside the message loop, and Chrome's events queued up
+in the websocket meanwhile. Now the rotated loggers are handed to a single
+writer thread, shared by every ObjectManager of the process, and the
+ObjectManager starts its next segment right away.
+
+The queue of rotations is bounded: once common.WRITER_QUEUE rotations are
+waiting, the next rotation blocks until the writer catches up.
+
+The writer also group-commits the journals of the segments (see
+modules/journal.py): a second thread writes and fsyncs the rows buffered by
+every journal of the process at once, and a segment's journal is removed
+once the segment is finalized.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from weakref import WeakSet
+
+from modules import common
+
+
+def fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class BackgroundWriter(object):
+
+    instance = None
+
+    def __init__(self, max_pending=None):
+        """
+        @max_pending -- Queued rotations, defaults to common.WRITER_QUEUE.
+        """
+        self.max_pending = max_pending or common.WRITER_QUEUE
+        self.log = logging.getLogger("BackgroundWriter")
+        self.lock = threading.Lock()
+        self.pid = None
+        self.thread = None
+        self.queue = None
+        self.journals = WeakSet()
+        self.sync_requested = threading.Event()
+
+        # finalize() runs on the writer thread and, at exit, on the message
+        # loop's, and sync() on the syncer's. They update the stats under
+        # this lock.
+        self.stats_lock = threading.Lock()
+        self.rotations = 0
+        self.loggers_flushed = 0
+        self.errors = 0
+        self.bytes_written = 0
+        self.high_water = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.last_flush_seconds = 0.0
+        self.syncs = 0
+        self.records_synced = 0
+        self.sync_seconds = 0.0
+        self.max_sync_seconds = 0.0
+
+    @classmethod
+    def Instance(cls):
+        """Returns the writer shared by every ObjectManager."""
+        if BackgroundWriter.instance is None:
+            BackgroundWriter.instance = cls()
+        return BackgroundWriter.instance
+
+    def _start(self):
+        """Starts the writer thread, again if we are a forked child (see
+        manager.Target), since threads don't survive a fork."""
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.queue = queue.Queue(self.max_pending)
+            self.journals = WeakSet()
+            self.thread = threading.Thread(target=self._worker,
+                                           name="background-writer",
+                                           daemon=True)
+            self.thread.start()
+            self.syncer = threading.Thread(target=self._syncer,
+                                           name="journal-syncer",
+                                           daemon=True)
+            self.syncer.start()
+
+    def register(self, journal):
+        """Group-commits @journal until it is discarded."""
+        self._start()
+        journal.on_batch = self.sync_requested.set
+        self.journals.add(journal)
+
+    def submit(self, loggers, journal=None):
+        """Queues @loggers, a finished segment, to be flushed and closed.
+        The segment's @journal is discarded once that is done."""
+        if not loggers:
+            if journal is not None:
+                journal.discard()
+            return
+        self._start()
+        self.queue.put((list(loggers), journal))
+        self.rotations += 1
+        depth = self.queue.qsize()
+        if depth > self.high_water:
+            self.high_water = depth
+
+    def _worker(self):
+        while True:
+            loggers, journal = self.queue.get()
+            try:
+                self.finalize(loggers, journal)
+            finally:
+                self.queue.task_done()
+
+    def finalize(self, loggers, journal=None):
+        """Flushes and closes @loggers, in the calling thread. If the
+        segment has a @journal, its files are fsync'ed and the journal is
+        discarded."""
+        start = time.perf_counter()
+        flushed = errors = bytes_written = 0
+        for logger in loggers:
+            try:
+                logger.flush()
+                logger.close()
+                if logger.file is not None:
+                    if journal is not None:
+                        fsync(logger.filename)
+                    bytes_written += os.path.getsize(logger.filename)
+            except Exception as e:
+                self.log.error("Flushing {} failed: {}".format(
+                    logger.filename, e))
+                errors += 1
+                continue
+            flushed += 1
+        if journal is not None:
+            if errors:
+                self.log.error("Keeping {} for recovery".format(journal.path))
+            else:
+                journal.discard()
+        elapsed = time.perf_counter() - start
+        with self.stats_lock:
+            self.loggers_flushed += flushed
+            self.errors += errors
+            self.bytes_written += bytes_written
+            self.flush_seconds += elapsed
+            self.last_flush_seconds = elapsed
+            if elapsed > self.max_flush_seconds:
+                self.max_flush_seconds = elapsed
+
+    def _syncer(self):
+        while True:
+            self.sync_requested.wait(common.JOURNAL_SYNC_INTERVAL)
+            self.sync_requested.clear()
+            self.sync()
+
+    def sync(self):
+        """Writes and fsyncs the rows buffered by every journal."""
+        start = time.perf_counter()
+        records = errors = 0
+        for journal in list(self.journals):
+            try:
+                records += journal.sync()
+            except Exception as e:
+                self.log.error("Syncing {} failed: {}".format(journal.path, e))
+                errors += 1
+        elapsed = time.perf_counter() - start
+        with self.stats_lock:
+            self.errors += errors
+            if not records:
+                return
+            self.syncs += 1
+            self.records_synced += records
+            self.sync_seconds += elapsed
+            if elapsed > self.max_sync_seconds:
+                self.max_sync_seconds = elapsed
+
+    def drain(self):
+        """Waits until every queued segment is written."""
+        if self.pid == os.getpid():
+            self.queue.join()
+
+    def __len__(self):
+        return self.queue.qsize() if self.pid == os.getpid() else 0
+
+    def stats(self):
+        with self.stats_lock:
+            return self._stats()
+
+    def _stats(self):
+        return {"rotations": self.rotations, "queued": len(self),
+                "high_water": self.high_water,
+                "loggers_flushed": self.loggers_flushed,
+                "errors": self.errors, "bytes_written": self.bytes_written,
+                "flush_seconds": self.flush_seconds,
+                "max_flush_seconds": self.max_flush_seconds,
+                "last_flush_seconds": self.last_flush_seconds,
+                "syncs": self.syncs, "records_synced": self.records_synced,
+                "sync_seconds": self.sync_seconds,
+                "max_sync_seconds": self.max_sync_seconds}
@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+"""
+Rebuilds the log segments the auditor didn't get to flush before it crashed
+(or was killed), from the journals it left behind in the journal directory
+(see modules/journal.py). Partially written logs are replaced.
+"""
+import argparse
+import glob
+import os
+
+from modules import common
+from modules import journal
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("journal_dir", nargs="?", default=common.JOURNAL_DIR)
+    parser.add_argument("--keep", action="store_true",
+                        help="Keep each journal once it is recovered.")
+    parser.add_argument("--force", action="store_true",
+                        help="Recover journals even if the process that "
+                             "wrote them is still running.")
+    args = parser.parse_args()
+
+    pattern = os.path.join(args.journal_dir, "*.wal")
+    for path in sorted(glob.glob(pattern)):
+        try:
+            recovered = journal.recover(path, remove=not args.keep,
+                                        force=args.force)
+        except journal.JournalError as e:
+            print("Skipping {}: {}".format(path, e))
+            continue
+        for out_path, rows in sorted(recovered.items()):
+            print("{} -> {} ({} rows)".format(path, out_path, rows))
+
+
+if __name__ == '__main__':
+    main()
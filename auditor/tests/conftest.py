@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# The auditor imports its modules as `from modules import ...`.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import frame_handler
+from modules import graph
+from modules import utils
+
+
+class Row(object):
+    """A graph element, as far as the loggers are concerned."""
+
+    def __init__(self, obj_id, **properties):
+        self.id = obj_id
+        self.properties = properties
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """The auditor writes its logs relative to the working directory."""
+    monkeypatch.chdir(tmp_path)
+    # The nodes written by earlier tests aren't written by this one.
+    monkeypatch.setattr(utils.ObjectManager, "seen", utils.SeenIndex())
+    # Every test starts its own session and frame cache.
+    monkeypatch.setattr(frame_handler.FrameHandler, "instance", None)
+    monkeypatch.setattr(graph.Session, "instance", None)
+    return tmp_path
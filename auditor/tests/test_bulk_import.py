@@ -0,0 +1,64 @@
+import csv
+import gzip
+import os
+
+from conftest import Row
+from modules import bulk_import
+from modules import common
+from modules import segment
+from modules import utils
+from test_csv_logger import read_csv
+
+
+def write_log(path, rows):
+    if path.endswith("." + segment.EXTENSION):
+        logger = segment.SegmentLogger(path, debug=False)
+    else:
+        logger = utils.CSVLogger(path, debug=False)
+    for row in rows:
+        logger.add(row)
+    logger.flush()
+
+
+def read_part(path):
+    with gzip.open(path, 'rt', newline='') as infile:
+        return list(csv.reader(infile, delimiter=common.DELIM))
+
+
+def test_export_writes_a_typed_bundle(workdir):
+    os.makedirs("logs")
+    # Two rotations of the hosts, the later one grew a column.
+    write_log("logs/hosts.1.csv", [Row("a", id="a", rip="1.1.1.1")])
+    write_log("logs/hosts.2." + segment.EXTENSION,
+              [Row("b", id="b", server="nginx", rip="2.2.2.2")])
+    write_log("logs/response-edges.1.csv",
+              [Row("e", start="r", end="a", status="200", duration="0.5")])
+    write_log("logs/occurrences.1.csv", [Row("a", id="a", count=2)])
+
+    script = bulk_import.export("logs", "bundle")
+
+    assert sorted(os.listdir("bundle")) == [
+        "hosts.header.csv", "hosts.part0000.csv.gz", "hosts.part0001.csv.gz",
+        "import.sh", "response-edges.header.csv",
+        "response-edges.part0000.csv.gz"]
+    assert read_csv("bundle/hosts.header.csv") == [
+        ["id:ID", "rip", "server", ":LABEL"]]
+    assert read_part("bundle/hosts.part0000.csv.gz") == [
+        ["a", "1.1.1.1", "", "Host"]]
+    # Reordered to the header's columns.
+    assert read_part("bundle/hosts.part0001.csv.gz") == [
+        ["b", "2.2.2.2", "nginx", "Host"]]
+    assert read_csv("bundle/response-edges.header.csv") == [
+        [":START_ID", ":END_ID", "status:int", "duration:float", ":TYPE"]]
+    assert read_part("bundle/response-edges.part0000.csv.gz") == [
+        ["r", "a", "200", "0.5", "RESPONSE"]]
+
+    with open(script) as infile:
+        lines = [line.strip(" \\\n") for line in infile]
+    assert os.access(script, os.X_OK)
+    assert "--skip-duplicate-nodes=true" in lines
+    assert ("--nodes=Host=hosts.header.csv,hosts.part0000.csv.gz,"
+            "hosts.part0001.csv.gz") in lines
+    assert ("--relationships=RESPONSE=response-edges.header.csv,"
+            "response-edges.part0000.csv.gz") in lines
+    assert not [line for line in lines if "occurrences" in line]
@@ -0,0 +1,68 @@
+import csv
+import os
+
+from conftest import Row
+from modules import common
+from modules import utils
+
+
+def read_csv(path):
+    with open(path, newline='') as infile:
+        return list(csv.reader(infile, delimiter=common.DELIM))
+
+
+def test_rows_are_streamed_with_the_final_header(workdir):
+    logger = utils.CSVLogger(str(workdir / "hosts.1.csv"), debug=False)
+    logger.add(Row("a", id="a", rip="1.1.1.1"))
+    logger.add(Row("b", id="b", rip="2.2.2.2", domain="b.com"))
+    logger.add(Row("a", id="a", rip="3.3.3.3"))
+    logger.flush()
+
+    # The last row of an id wins, in the place of its first row.
+    assert read_csv(str(workdir / "hosts.1.csv")) == [
+        ["id", "rip", "domain"],
+        ["a", "3.3.3.3", ""],
+        ["b", "2.2.2.2", "b.com"],
+    ]
+    assert logger.rows == 2
+
+
+def test_properties_are_encoded_when_added(workdir):
+    row = Row("a", id="a", rip="1.1.1.1")
+    logger = utils.CSVLogger(str(workdir / "hosts.1.csv"), debug=False)
+    logger.add(row)
+    row.properties["rip"] = "2.2.2.2"
+    logger.flush()
+
+    assert read_csv(str(workdir / "hosts.1.csv"))[1] == ["a", "1.1.1.1"]
+
+
+def test_declared_columns_come_first(workdir):
+    row = Row("a", rip="1.1.1.1")
+    row.columns = ("id", "rip", "domain")
+    logger = utils.CSVLogger(str(workdir / "hosts.1.csv"), debug=False)
+    logger.add(row)
+    logger.flush()
+
+    assert read_csv(str(workdir / "hosts.1.csv")) == [
+        ["id", "rip", "domain"], ["", "1.1.1.1", ""]]
+
+
+def test_rotations_ignore_fix_up_temp_files(workdir):
+    manager = utils.ObjectManager("logs", flush_threshold=1)
+    # A temp file a crashed fix-up left behind.
+    open(os.path.join("logs", ".hosts.0.csv.tmp"), 'w').close()
+    # Every other row adds a column, so the writer thread fixes up the header
+    # of each rotated log while we open the next one.
+    for i in range(12):
+        properties = {"id": i}
+        if i % 2:
+            properties["domain"] = "d{}.com".format(i)
+        manager.add("requests", Row(i, **properties))
+    manager.flush_all(exiting=True)
+
+    logs = sorted(f for f in os.listdir("logs") if not f.startswith('.'))
+    assert len(logs) > 1
+    rows = [row for log in logs for row in read_csv(os.path.join("logs", log))
+            if row[0] != "id"]
+    assert sorted(int(row[0]) for row in rows) == list(range(12))
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from modules import dev_tools
+
+
+SUBSCRIPTIONS = frozenset(["Network.requestWillBeSent"])
+
+REPLIES = [
+    '{"id":1,"result":{}}',
+    '{"id":2,"result":{"method":"GET"},"sessionId":"S"}',
+    '{"sessionId":"S","id":3,"result":{"scriptSource":"var a;"}}',
+    '{"id":4,"error":{"code":-32000,"message":"No frame"}}',
+    '{ "id": 5, "result": {} }',
+]
+
+
+def decoders():
+    names = ["json"]
+    for name in ("orjson", "ujson"):
+        try:
+            __import__(name)
+            names.append(name)
+        except ImportError:
+            pass
+    return [dev_tools.get_decoder(name) for name in names]
+
+
+@pytest.mark.parametrize("loads", decoders())
+@pytest.mark.parametrize("subscriptions", [None, SUBSCRIPTIONS,
+                                           frozenset()])
+@pytest.mark.parametrize("reply", REPLIES)
+def test_replies_are_never_dropped(loads, subscriptions, reply):
+    assert dev_tools.decode(reply, loads, subscriptions) == json.loads(reply)
+
+
+@pytest.mark.parametrize("loads", decoders())
+def test_events_are_filtered_by_method(loads):
+    subscribed = '{"method":"Network.requestWillBeSent","params":{}}'
+    other = '{"method":"Debugger.paused","params":{}}'
+
+    assert dev_tools.decode(subscribed, loads, SUBSCRIPTIONS) == \
+        json.loads(subscribed)
+    assert dev_tools.decode(other, loads, SUBSCRIPTIONS) is None
+    assert dev_tools.decode(other, loads) == json.loads(other)
+
+
+@pytest.mark.parametrize("loads", decoders())
+def test_events_we_cannot_prefix_parse_are_decoded_first(loads):
+    # Not serialized with its method first, so decode() can't peek at it.
+    subscribed = '{"params":{},"method":"Network.requestWillBeSent"}'
+    other = '{ "method": "Debugger.paused", "params": {} }'
+
+    assert dev_tools.event_method(subscribed) is None
+    assert dev_tools.event_method(other) is None
+    assert dev_tools.decode(subscribed, loads, SUBSCRIPTIONS) == \
+        json.loads(subscribed)
+    assert dev_tools.decode(other, loads, SUBSCRIPTIONS) is None
@@ -0,0 +1,158 @@
+import json
+import queue
+import time
+from collections import deque
+
+import pytest
+import websocket
+
+from modules import dev_tools
+
+
+class FakeSocket(object):
+    """A websocket that serves @messages, then times out (or would block,
+    if it is non-blocking)."""
+
+    def __init__(self, messages=()):
+        self.messages = deque(messages)
+        self.timeout = None
+        self.waited = list()
+        self.sent = list()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv(self):
+        if self.messages:
+            return self.messages.popleft()
+        if self.timeout == 0:
+            raise BlockingIOError()
+        self.waited.append(self.timeout)
+        raise websocket._exceptions.WebSocketTimeoutException()
+
+    def send(self, message):
+        self.sent.append(json.loads(message))
+
+    def close(self):
+        pass
+
+
+def sync_chrome(messages=()):
+    chrome = dev_tools.ChromeInterface()
+    chrome.ws = FakeSocket(json.dumps(m) for m in messages)
+    return chrome
+
+
+def test_pop_messages_waits_for_the_first_event():
+    chrome = sync_chrome()
+
+    assert chrome.pop_messages(timeout=0.5) == []
+    assert chrome.ws.waited == [0.5]
+    assert chrome.ws.timeout == chrome.timeout
+
+
+def test_pop_messages_returns_every_pending_event():
+    events = [{"method": "Target.targetCreated", "params": {}},
+              {"method": "Target.targetDestroyed", "params": {}}]
+    chrome = sync_chrome(events)
+
+    assert chrome.pop_messages() == events
+    assert chrome.ws.waited == []
+    assert chrome.pop_messages(timeout=0) == []
+    assert chrome.ws.waited == []
+
+
+class FakeBrowser(object):
+    """A websocket served by a reader thread: answers every command with
+    reply(command) (None doesn't answer), and serves pushed messages."""
+
+    def __init__(self, reply=lambda command: {"result": {}}):
+        self.reply = reply
+        self.inbox = queue.Queue()
+        self.sent = list()
+
+    def push(self, message):
+        self.inbox.put(message if isinstance(message, str)
+                       else json.dumps(message))
+
+    def recv(self):
+        message = self.inbox.get()
+        if message is None:
+            raise websocket._exceptions.WebSocketConnectionClosedException()
+        return message
+
+    def send(self, message):
+        command = json.loads(message)
+        self.sent.append(command)
+        result = self.reply(command)
+        if result is not None:
+            self.push(dict(result, id=command['id']))
+
+    def close(self):
+        self.inbox.put(None)
+
+
+def wait_until_sent(browser):
+    deadline = time.monotonic() + 5
+    while not browser.sent and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def async_chrome(browser, timeout=2):
+    chrome = dev_tools.AsyncChromeInterface(timeout=timeout)
+    chrome.ws = browser
+    chrome._start()
+    return chrome
+
+
+def test_replies_resolve_their_calls_while_events_are_queued():
+    browser = FakeBrowser(lambda command: {"result": {"n": command['id']}})
+    chrome = async_chrome(browser)
+    browser.push({"method": "Page.frameAttached", "params": {}})
+
+    result, msgs = chrome.Page.getFrameTree(sessionId="S")
+    assert result == {"id": 1, "result": {"n": 1}}
+    assert msgs == []
+    assert browser.sent[0]['sessionId'] == "S"
+    assert chrome.pop_messages(timeout=1) == [
+        {"method": "Page.frameAttached", "params": {}}]
+    chrome.close()
+
+
+def test_malformed_messages_are_skipped():
+    browser = FakeBrowser()
+    chrome = async_chrome(browser)
+    browser.push('{"method": "Page.frame')
+    browser.push('[1, 2]')
+
+    assert chrome.call("Page.enable")[0] == {"id": 1, "result": {}}
+    assert chrome.malformed == 2
+    chrome.close()
+
+
+def test_closing_fails_the_calls_in_flight():
+    browser = FakeBrowser(lambda command: None)
+    chrome = async_chrome(browser, timeout=30)
+    future = chrome.submit("Page.getFrameTree")
+    wait_until_sent(browser)
+    browser.close()
+
+    assert future.result(timeout=5) == "Timeout"
+    with pytest.raises(
+            websocket._exceptions.WebSocketConnectionClosedException):
+        chrome.pop_messages(timeout=1)
+    with pytest.raises(
+            websocket._exceptions.WebSocketConnectionClosedException):
+        chrome.call("Page.enable")
+    chrome.close()
+
+
+def test_notify_doesnt_wait_for_the_reply():
+    browser = FakeBrowser(lambda command: None)
+    chrome = async_chrome(browser, timeout=30)
+
+    assert chrome.notify("Runtime.runIfWaitingForDebugger",
+                         sessionId="S") == ("Pending", [])
+    wait_until_sent(browser)
+    assert browser.sent[0]['method'] == "Runtime.runIfWaitingForDebugger"
+    chrome.close()
@@ -0,0 +1,86 @@
+from modules import base
+
+
+class Recording(base.Handler):
+    """Records the handlers a message was passed to in @calls."""
+
+    def __init__(self, id, calls, stop=()):
+        self.calls = calls
+        # The methods after which we ask to be shut down.
+        self.stop = stop
+        self.shut_down = 0
+        base.Handler.__init__(self, id)
+
+    def handle(self, m):
+        self.calls.append(self.id)
+        return m['method'] in self.stop
+
+    def shutdown(self, m):
+        self.calls.append("shutdown " + self.id)
+        self.shut_down += 1
+
+    handlers = {"A": handle, "B": handle}
+
+
+class OnlyB(Recording):
+    handlers = {"B": Recording.handle}
+
+
+def tree(calls, **stop):
+    parent = Recording("parent", calls, stop.get("parent", ()))
+    first = Recording("first", calls, stop.get("first", ()))
+    second = OnlyB("second", calls, stop.get("second", ()))
+    parent.register_subhandler(first)
+    parent.register_subhandler(second)
+    return parent, first, second
+
+
+def test_handlers_run_before_subhandlers_in_registration_order():
+    calls = list()
+    parent, first, second = tree(calls)
+
+    assert parent.run_cycle({"method": "A"}) is False
+    assert parent.run_cycle({"method": "B"}) is False
+    assert calls == ["parent", "first", "parent", "first", "second"]
+    assert [h for h, f in parent.dispatch["B"]] == [parent, first, second]
+    assert parent.subscriptions() == {"A", "B"}
+
+
+def test_registering_a_subhandler_recompiles_its_parents():
+    calls = list()
+    parent, first, second = tree(calls)
+    grandchild = OnlyB("grandchild", calls)
+    first.register_subhandler(grandchild)
+
+    parent.run_cycle({"method": "B"})
+    assert calls == ["parent", "first", "grandchild", "second"]
+
+
+def test_unhandled_messages_are_counted_as_dropped():
+    calls = list()
+    parent, first, second = tree(calls)
+
+    assert parent.run_cycle({"method": "C"}) is False
+    parent.run_cycle({"method": "A"})
+    parent.run_cycle({"method": "A"})
+    assert calls == ["parent", "first", "parent", "first"]
+    assert parent.dispatch_stats() == {"handled": {"A": 2},
+                                       "dropped": {"C": 1}}
+
+
+def test_only_our_own_handler_shuts_us_down():
+    calls = list()
+    parent, first, second = tree(calls, first=("A",))
+
+    assert parent.run_cycle({"method": "A"}) is False
+    assert calls == ["parent", "first", "shutdown first"]
+    assert parent.shut_down == 0
+
+
+def test_handlers_are_shut_down_subhandlers_first():
+    calls = list()
+    parent, first, second = tree(calls, parent=("B",), second=("B",))
+
+    assert parent.run_cycle({"method": "B"}) is True
+    assert calls == ["parent", "first", "second", "shutdown second",
+                     "shutdown parent"]
@@ -0,0 +1,120 @@
+import pytest
+
+from modules import frame_handler
+from modules import graph
+
+
+class FakeHandler(object):
+    """The parts of a ChromeHandler the frame cache looks at."""
+
+    handler_id = "test"
+
+    def __init__(self, targets_attached=()):
+        self.targets_attached = set(targets_attached)
+        self.messages = list()
+
+
+@pytest.fixture(autouse=True)
+def session(workdir):
+    return graph.Session("S", "test")
+
+
+def attached(frames, frame_id, parent_id):
+    frames.handle_frame_attached({"params": {"frameId": frame_id,
+                                             "parentFrameId": parent_id}})
+
+
+def test_frames_are_evicted_past_the_limit():
+    frames = frame_handler.FrameHandler(FakeHandler(), max_frames=3)
+    for frame_id in ["A", "B", "C", "D", "E"]:
+        frames.emplace(frame_id)
+    # Looking a frame up makes it the most recently used.
+    frames.get_frame("C")
+    frames.emplace("F")
+
+    assert list(frames.entries) == ["E", "C", "F"]
+    assert frames.stats()["lru_evicted"] == 3
+    assert frames.stats()["high_water"] == 3
+
+
+def test_pinned_targets_are_never_evicted():
+    frames = frame_handler.FrameHandler(FakeHandler(["T"]), max_frames=2)
+    frames.emplace("T")
+    for frame_id in ["A", "B", "C"]:
+        frames.emplace(frame_id)
+
+    assert list(frames.entries) == ["T", "C"]
+    assert frames.stats()["lru_evicted"] == 2
+
+
+def test_a_cache_full_of_pinned_targets_grows():
+    frames = frame_handler.FrameHandler(FakeHandler(["T", "U"]), max_frames=1)
+    frames.emplace("T")
+    frames.emplace("U")
+
+    assert set(frames.entries) == {"T", "U"}
+    assert frames.stats()["lru_evicted"] == 0
+
+
+def test_evicting_past_the_limit_takes_the_children_along():
+    frames = frame_handler.FrameHandler(FakeHandler(), max_frames=3)
+    frames.emplace("A")
+    attached(frames, "A1", "A")
+    frames.emplace("B")
+    frames.get_frame("A1")
+    frames.emplace("C")
+
+    # A was the least recently used, its child goes with it.
+    assert list(frames.entries) == ["B", "C"]
+    assert not frames.children.get("A")
+
+
+def test_frame_detached_removes_the_subtree():
+    frames = frame_handler.FrameHandler(FakeHandler())
+    frames.emplace("T")
+    attached(frames, "A", "T")
+    attached(frames, "A1", "A")
+    attached(frames, "B", "T")
+
+    frames.handle_frame_detached({"params": {"frameId": "A"}})
+
+    assert list(frames.entries) == ["T", "B"]
+    assert frames.children["T"] == {"B"}
+    assert "A" not in frames.children
+    assert frames.stats()["evicted"] == 2
+
+
+def test_swapped_frames_stay_cached():
+    frames = frame_handler.FrameHandler(FakeHandler())
+    frames.emplace("T")
+    attached(frames, "A", "T")
+
+    frames.handle_frame_detached({"params": {"frameId": "A",
+                                             "reason": "swap"}})
+
+    assert "A" in frames.entries
+
+
+def test_target_destroyed_removes_its_frames():
+    frames = frame_handler.FrameHandler(FakeHandler())
+    frames.emplace("T")
+    attached(frames, "A", "T")
+    frames.emplace("U")
+
+    frames.handle_target_destroyed("T")
+
+    assert list(frames.entries) == ["U"]
+    assert frames.stats()["evicted"] == 2
+
+
+def test_events_for_evicted_frames_are_tolerated():
+    frames = frame_handler.FrameHandler(FakeHandler(), max_frames=2)
+    frames.emplace("P")
+    frames.emplace("X")
+    frames.emplace("Y")
+    assert "P" not in frames.entries
+
+    # Asserted before the cache was bounded, P was evicted instead.
+    attached(frames, "C", "P")
+
+    assert frames.get_frame("C").parent is frames.get_frame("P")
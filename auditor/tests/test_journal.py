@@ -0,0 +1,100 @@
+import json
+import os
+
+import pytest
+
+from conftest import Row
+from modules import journal
+from test_csv_logger import read_csv
+
+
+def journaled_segment(workdir):
+    """Journals a segment of two logs, as if we were killed before it was
+    finalized, and returns the journal."""
+    wal = journal.Journal("logs", "csv", journal_dir=str(workdir / "journal"))
+    wal.add_file("hosts", "logs/hosts.1.csv")
+    wal.add("hosts", Row("a", id="a", rip="1.1.1.1"))
+    wal.add_file("requests", "logs/requests.1.csv")
+    wal.add("hosts", Row("b", id="b", rip="2.2.2.2", domain="b.com"))
+    wal.add("requests", Row("r", id="r", url="http://a/"))
+    wal.flush()
+    return wal
+
+
+def test_rows_are_buffered_until_synced(workdir):
+    wal = journal.Journal("logs", "csv", journal_dir=str(workdir / "journal"))
+    wal.add_file("hosts", "logs/hosts.1.csv")
+    wal.add("hosts", Row("a", id="a"))
+    header = os.path.getsize(wal.path)
+
+    assert len(wal) == 2
+    assert wal.sync() == 2
+    assert len(wal) == 0
+    assert os.path.getsize(wal.path) > header
+    _, records = journal.read(wal.path)
+    assert records == [["f", "hosts", str(workdir / "logs" / "hosts.1.csv")],
+                       ["r", "hosts", "a", {"id": "a"}]]
+    assert wal.sync() == 0
+
+
+def test_recover_rebuilds_partial_and_missing_logs(workdir):
+    wal = journaled_segment(workdir)
+    os.makedirs("logs")
+    # The hosts log was cut short, the requests log was never created.
+    with open("logs/hosts.1.csv", 'w') as outfile:
+        outfile.write("id\trip\na\t1.1")
+
+    recovered = journal.recover(wal.path)
+
+    hosts = str(workdir / "logs" / "hosts.1.csv")
+    requests = str(workdir / "logs" / "requests.1.csv")
+    assert recovered == {hosts: 2, requests: 1}
+    assert read_csv(hosts) == [["id", "rip", "domain"],
+                               ["a", "1.1.1.1", ""],
+                               ["b", "2.2.2.2", "b.com"]]
+    assert read_csv(requests) == [["id", "url"], ["r", "http://a/"]]
+    assert not os.path.exists(wal.path)
+
+
+def test_recover_skips_a_torn_last_row(workdir):
+    wal = journaled_segment(workdir)
+    # We were killed while writing the last row.
+    wal.file.write('["r","hosts","c",{"id":')
+    wal.file.flush()
+
+    recovered = journal.recover(wal.path, remove=False)
+
+    assert recovered[str(workdir / "logs" / "hosts.1.csv")] == 2
+    assert os.path.exists(wal.path)
+
+
+def test_recover_refuses_a_corrupt_journal(workdir):
+    wal = journaled_segment(workdir)
+    wal.file.write('["r","hosts",\n["r","hosts","c",{}]\n')
+    wal.file.flush()
+
+    with pytest.raises(journal.JournalError):
+        journal.recover(wal.path)
+
+
+def test_recover_leaves_running_auditors_alone(workdir):
+    wal = journaled_segment(workdir)
+    lines = open(wal.path).read().split("\n")
+    header = json.loads(lines[0])
+    header["pid"] = os.getppid()
+    with open(wal.path, 'w') as outfile:
+        outfile.write("\n".join([json.dumps(header)] + lines[1:]))
+
+    with pytest.raises(journal.JournalError):
+        journal.recover(wal.path)
+    assert journal.recover(wal.path, force=True)
+
+
+def test_discarded_journals_are_not_recovered(workdir):
+    wal = journaled_segment(workdir)
+    pid_journals = journal.journals_of(os.getpid(),
+                                       str(workdir / "journal"))
+    assert pid_journals == [wal.path]
+
+    wal.discard()
+    assert journal.journals_of(os.getpid(), str(workdir / "journal")) == []
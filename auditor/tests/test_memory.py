@@ -0,0 +1,40 @@
+import json
+import os
+
+from modules import memory
+from modules import metrics
+
+
+def test_reports_are_appended_to_the_sizes_file(workdir):
+    reporter = memory.MemoryReporter(out_dir=str(workdir / "memory"))
+    queue = [1, 2, 3]
+    reporter.track("queue", "Things in the queue.", lambda: len(queue))
+    reporter.report()
+    queue.pop()
+    reporter.report()
+
+    with open(reporter.sizes_path()) as infile:
+        reports = [json.loads(line) for line in infile]
+    assert os.path.basename(reporter.sizes_path()) == \
+        "{}.sizes.jsonl".format(os.getpid())
+    assert [r["queue"] for r in reports] == [3, 2]
+    assert all(r["rss_bytes"] > 0 and "time" in r for r in reports)
+
+
+def test_sizes_and_stats_are_exported_as_gauges():
+    reporter = memory.MemoryReporter()
+    reporter.track("queue", "Things in the queue.", lambda: 3)
+    registry = metrics.Metrics()
+    reporter.export(registry)
+    registry.gauge("auditor_requests", "The stats of the requests.",
+                   lambda: {"in_flight": 2, "expired": 1, "name": "x"},
+                   label="stat")
+
+    lines = registry.render().split("\n")
+
+    assert "auditor_memory_queue 3" in lines
+    assert "# TYPE auditor_requests gauge" in lines
+    assert 'auditor_requests{stat="expired"} 1' in lines
+    assert 'auditor_requests{stat="in_flight"} 2' in lines
+    # Only numbers are samples.
+    assert not [line for line in lines if 'stat="name"' in line]
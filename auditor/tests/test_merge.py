@@ -0,0 +1,46 @@
+import os
+
+from conftest import Row
+from modules import journal
+from modules import manager
+from test_csv_logger import read_csv
+
+
+def write(path, content=""):
+    with open(path, 'w') as outfile:
+        outfile.write(content)
+
+
+def test_target_logs_are_renamed_into_the_log_directory(workdir):
+    os.makedirs("logs/T1")
+    write("logs/T1/hosts.1600000000.1.csv", "id\na\n")
+    write("logs/T1/requests.1600000000.2.seg")
+    # A header fix-up the tab's process didn't finish.
+    write("logs/T1/.hosts.1600000000.1.csv.tmp")
+
+    assert manager.merge_target_logs("logs", "T1") == 2
+    assert sorted(os.listdir("logs")) == ["hosts.T1.1600000000.1.csv",
+                                          "requests.T1.1600000000.2.seg"]
+    assert read_csv("logs/hosts.T1.1600000000.1.csv") == [["id"], ["a"]]
+
+
+def test_targets_without_logs_are_skipped(workdir):
+    os.makedirs("logs")
+    assert manager.merge_target_logs("logs", "T1") == 0
+
+
+def test_recovered_logs_of_killed_targets_are_merged(workdir):
+    wal = journal.Journal("logs/T1", "csv",
+                          journal_dir=str(workdir / "journal"))
+    wal.add_file("hosts", "logs/T1/hosts.1.csv")
+    wal.add("hosts", Row("a", id="a", rip="1.1.1.1"))
+    wal.flush()
+    # The tab's process was killed before it wrote its log.
+    os.makedirs("logs/T1")
+
+    for path in journal.journals_of(os.getpid(), str(workdir / "journal")):
+        journal.recover(path)
+
+    assert manager.merge_target_logs("logs", "T1") == 1
+    assert read_csv("logs/hosts.T1.1.csv") == [["id", "rip"],
+                                               ["a", "1.1.1.1"]]
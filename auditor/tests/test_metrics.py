@@ -0,0 +1,103 @@
+import pytest
+
+from modules import metrics
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock(1000.0)
+    monkeypatch.setattr(metrics, "time", clock)
+    return clock
+
+
+def event(method, **params):
+    return {"method": method, "params": params}
+
+
+def samples(text, name):
+    return [line for line in text.split("\n") if line.startswith(name)]
+
+
+def test_timestamps_are_calibrated_with_the_first_walltime(clock):
+    registry = metrics.Metrics()
+    # Skipped, we can't tell the monotonic clock's offset yet.
+    registry.observe_lag(event("Network.loadingFinished", timestamp=5.0))
+    assert registry.lag == {}
+
+    registry.observe_lag(event("Network.requestWillBeSent",
+                               timestamp=10.0, wallTime=999.0))
+    assert registry.clock_offset == 989.0
+    clock.now = 1002.0
+    # 990.5 on the wall clock.
+    registry.observe_lag(event("Network.loadingFinished", timestamp=1.5))
+    # Ahead of us, a clock skew rather than lag.
+    registry.observe_lag(event("Page.frameNavigated", wallTime=1003.0))
+
+    assert registry.lag[("Network.requestWillBeSent", "wall")].total[0] == 1.0
+    assert registry.lag[("Network.loadingFinished",
+                         "timestamp")].total[0] == 11.5
+    assert registry.lag[("Page.frameNavigated", "wall")].total[0] == 0.0
+    # The offset is only calibrated once.
+    registry.observe_lag(event("Network.requestWillBeSent",
+                               timestamp=20.0, wallTime=1001.0))
+    assert registry.clock_offset == 989.0
+
+
+def test_render_writes_cumulative_buckets(clock):
+    registry = metrics.Metrics()
+    for seconds in [0.00002, 0.0003, 0.0003, 2.0]:
+        registry.observe_latency("FrameHandler", "Page.frameAttached",
+                                 seconds)
+    registry.gauge("auditor_queue_depth", "Messages waiting.", lambda: 7)
+    registry.gauge("auditor_broken", "Fails to size.", lambda: 1 / 0)
+    clock.now = 1060.0
+
+    text = registry.render()
+
+    labels = 'handler="FrameHandler",method="Page.frameAttached"'
+    buckets = samples(text, "auditor_handler_seconds_bucket")
+    assert 'auditor_handler_seconds_bucket{{{},le="1e-05"}} 0'.format(
+        labels) in buckets
+    assert 'auditor_handler_seconds_bucket{{{},le="2.5e-05"}} 1'.format(
+        labels) in buckets
+    assert 'auditor_handler_seconds_bucket{{{},le="0.0005"}} 3'.format(
+        labels) in buckets
+    assert 'auditor_handler_seconds_bucket{{{},le="1.0"}} 3'.format(
+        labels) in buckets
+    assert 'auditor_handler_seconds_bucket{{{},le="+Inf"}} 4'.format(
+        labels) in buckets
+    assert samples(text, "auditor_handler_seconds_count") == [
+        'auditor_handler_seconds_count{{{}}} 4'.format(labels)]
+    assert "# TYPE auditor_handler_seconds histogram" in text
+    assert samples(text, "auditor_queue_depth") == ["auditor_queue_depth 7"]
+    assert samples(text, "auditor_uptime_seconds") == [
+        "auditor_uptime_seconds 60.0"]
+    # A gauge that fails is left out.
+    assert "auditor_broken" not in text
+
+
+def test_label_values_are_escaped():
+    registry = metrics.Metrics()
+    registry.observe_latency('Say "hi"\\', "M", 0.001)
+
+    assert 'handler="Say \\"hi\\"\\\\"' in registry.render()
+
+
+def test_dump_replaces_the_file(workdir):
+    registry = metrics.Metrics()
+    registry.gauge("auditor_queue_depth", "Messages waiting.", lambda: 7)
+
+    registry.dump("metrics.prom")
+
+    with open("metrics.prom") as infile:
+        assert "auditor_queue_depth 7" in infile.read()
+    assert not (workdir / "metrics.prom.tmp").exists()
@@ -0,0 +1,62 @@
+import os
+import signal
+import time
+
+from modules import profiling
+
+
+def busy(m, callbacks):
+    """A handler that takes long enough to be sampled."""
+    end = time.perf_counter() + 0.02
+    while time.perf_counter() < end:
+        pass
+    callbacks.append(m['method'])
+    return True
+
+
+def test_toggling_profiles_each_method(workdir):
+    profiler = profiling.Profiler(out_dir=str(workdir / "profiles"),
+                                  interval=0.001)
+    handled = list()
+    # Not profiling, the message is just dispatched.
+    assert profiler.run(busy, {"method": "Page.frameNavigated"}, handled)
+    assert not profiler.enabled and not os.path.exists("profiles")
+
+    profiler.toggle = True
+    profiler.run(busy, {"method": "Network.requestWillBeSent"}, handled)
+    assert profiler.enabled
+    profiler.run(busy, {"method": "Page.frameNavigated"}, handled)
+    profiler.toggle = True
+    profiler.run(busy, {"method": "Network.loadingFinished"}, handled)
+
+    # The last message toggled profiling off, it wasn't profiled.
+    assert not profiler.enabled
+    assert handled == ["Page.frameNavigated", "Network.requestWillBeSent",
+                       "Page.frameNavigated", "Network.loadingFinished"]
+    [path] = os.listdir("profiles")
+    assert path.startswith("{}.".format(os.getpid()))
+    files = os.listdir(os.path.join("profiles", path))
+    assert sorted(files) == ["Network.requestWillBeSent.prof",
+                             "Page.frameNavigated.prof",
+                             "stacks.collapsed", "summary.txt"]
+    with open(os.path.join("profiles", path, "stacks.collapsed")) as infile:
+        stacks = infile.read()
+    assert "Network.requestWillBeSent;" in stacks
+    assert "test_profiling.py:busy" in stacks
+
+
+def test_the_signal_toggles_at_the_next_message(workdir):
+    profiler = profiling.Profiler(out_dir=str(workdir / "profiles"))
+    previous = signal.getsignal(signal.SIGUSR2)
+    try:
+        profiler.install_signal_handler()
+        os.kill(os.getpid(), signal.SIGUSR2)
+    finally:
+        signal.signal(signal.SIGUSR2, previous)
+
+    assert profiler.toggle and not profiler.enabled
+    profiler.run(busy, {"method": "Page.frameNavigated"}, list())
+    assert profiler.enabled and not profiler.toggle
+    assert profiler.stop() is not None
+    # Stopping twice is fine.
+    assert profiler.stop() is None
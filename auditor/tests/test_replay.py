@@ -0,0 +1,70 @@
+import pytest
+import websocket
+
+from modules import replay
+
+
+def record(filename):
+    recorder = replay.MessageRecorder(filename)
+    recorder.record_version({"Browser": "HeadlessChrome/1"})
+    recorder.record_events([
+        {"method": "Page.frameNavigated", "params": {"frame": {"id": "F"}}},
+        {"method": "Network.dataReceived", "params": {"requestId": "1"}},
+    ])
+    recorder.record_reply("Target.getTargets", {"result": {"targetInfos": []}},
+                          [{"method": "Network.dataReceived", "params": {}},
+                           {"method": "Page.frameAttached", "params": {}}])
+    # Not in the layout event_method() recognizes, decoded and then dropped.
+    recorder.record_events([
+        {"params": {"requestId": "2"}, "method": "Network.dataReceived"},
+        {"method": "Page.frameDetached", "params": {"frameId": "F"}},
+    ])
+    recorder.close()
+    return recorder.count
+
+
+@pytest.mark.parametrize("filename", ["s.jsonl", "s.jsonl.gz"])
+def test_recordings_round_trip(workdir, filename):
+    assert record(filename) == 6
+    chrome = replay.ReplayInterface(filename)
+    decoded = list()
+    loads = chrome.loads
+    chrome.loads = lambda line: decoded.append(line) or loads(line)
+    chrome.subscribe(["Page.frameNavigated", "Page.frameAttached",
+                      "Page.frameDetached"])
+
+    assert chrome.attach_to_browser_target() == {
+        "Browser": "HeadlessChrome/1"}
+    assert chrome.Target.getTargets() == (
+        {"result": {"targetInfos": []}},
+        [{"method": "Page.frameAttached", "params": {}}])
+    # The reply is only served once.
+    assert chrome.reply("Target.getTargets") == ("Timeout", [])
+
+    # Looking for a reply read the events ahead.
+    messages = chrome.pop_messages()
+    assert [m["method"] for m in messages] == [
+        "Page.frameNavigated", "Page.frameDetached"]
+    with pytest.raises(
+            websocket._exceptions.WebSocketConnectionClosedException):
+        chrome.pop_messages()
+
+    assert chrome.events_dropped == 3
+    assert chrome.events_served == 2
+    # The dataReceived event that starts with its method was never decoded.
+    assert not [line for line in decoded
+                if line.startswith('{"k":"e","m":{"method":'
+                                   '"Network.dataReceived"')]
+    assert len(decoded) == 5
+
+
+def test_unsubscribed_replays_serve_every_event(workdir):
+    record("s.jsonl")
+    chrome = replay.ReplayInterface("s.jsonl")
+
+    messages = chrome.pop_messages() + chrome.pop_messages()
+
+    assert [m["method"] for m in messages] == [
+        "Page.frameNavigated", "Network.dataReceived",
+        "Network.dataReceived", "Page.frameDetached"]
+    assert chrome.events_dropped == 0
@@ -0,0 +1,133 @@
+import pytest
+
+from modules import graph
+from modules import request_tracker
+
+
+@pytest.fixture(autouse=True)
+def session(workdir):
+    return graph.Session("S", "test")
+
+
+class FakeLogger(object):
+    """Keeps the rows an ObjectManager would log, by label."""
+
+    def __init__(self):
+        self.rows = list()
+
+    def add(self, label, obj):
+        self.rows.append((label, dict(obj.properties)))
+
+    def responses(self):
+        return [p for label, p in self.rows if label == graph.RESPONSE_EDGE]
+
+
+def sent(tracker, request_id, timestamp, redirect_status=None):
+    request = graph.RequestEdge("script", "resource-" + request_id,
+                                request_id)
+    request.p['requestId'] = request_id
+    params = {"requestId": request_id, "timestamp": timestamp}
+    if redirect_status:
+        params["redirectResponse"] = {"status": redirect_status,
+                                      "url": "http://a.com/", "headers": {}}
+    tracker.request_sent({"params": params}, request)
+    return request
+
+
+def received(tracker, request_id, status=200):
+    tracker.response_received({"params": {
+        "requestId": request_id,
+        "response": {"status": status, "url": "http://a.com/", "headers": {},
+                     "remoteIPAddress": "1.1.1.1"}}})
+
+
+def test_responses_are_logged_once_the_request_finishes():
+    log = FakeLogger()
+    tracker = request_tracker.RequestTracker(log)
+    sent(tracker, "1", 10.0)
+    received(tracker, "1")
+    assert log.rows == []
+
+    tracker.loading_finished({"params": {"requestId": "1", "timestamp": 10.5,
+                                         "encodedDataLength": 300}})
+
+    assert "1" not in tracker
+    [response] = log.responses()
+    assert response["status"] == "200"
+    assert response["rip"] == "1.1.1.1"
+    assert response["encodedDataLength"] == "300"
+    assert response["duration"] == "0.5"
+    assert tracker.stats()["completed"] == 1
+
+
+def test_redirects_complete_the_previous_hop():
+    log = FakeLogger()
+    tracker = request_tracker.RequestTracker(log)
+    sent(tracker, "1", 10.0)
+    sent(tracker, "1", 11.0, redirect_status=302)
+    assert [r["status"] for r in log.responses()] == ["302"]
+    assert len(tracker) == 1
+
+    received(tracker, "1")
+    tracker.loading_finished({"params": {"requestId": "1", "timestamp": 12.0}})
+
+    assert [r["status"] for r in log.responses()] == ["302", "200"]
+    assert [r["duration"] for r in log.responses()] == ["1.0", "1.0"]
+    assert tracker.stats()["redirects"] == 1
+
+
+def test_failed_loads_log_the_error():
+    log = FakeLogger()
+    tracker = request_tracker.RequestTracker(log)
+    sent(tracker, "1", 10.0)
+
+    tracker.loading_failed({"params": {"requestId": "1", "timestamp": 10.25,
+                                       "errorText": "net::ERR_ABORTED",
+                                       "canceled": True}})
+
+    [response] = log.responses()
+    assert response["errorText"] == "net::ERR_ABORTED"
+    assert response["canceled"] == "True"
+    assert "status" not in response
+    assert len(tracker) == 0 and tracker.stats()["failed"] == 1
+
+
+def test_unfinished_requests_expire_when_others_finish():
+    log = FakeLogger()
+    tracker = request_tracker.RequestTracker(log, ttl=30)
+    sent(tracker, "1", 10.0)
+    received(tracker, "1")
+    sent(tracker, "2", 15.0)
+
+    # No request starts after this one; its completion expires request 1.
+    tracker.loading_finished({"params": {"requestId": "2", "timestamp": 45.0}})
+
+    assert len(tracker) == 0
+    assert tracker.stats()["expired"] == 1
+    # The expired request's response is logged, without a duration.
+    assert [r["status"] for r in log.responses()] == ["200"]
+    assert "duration" not in log.responses()[0]
+
+
+def test_the_oldest_requests_are_evicted_over_the_bound():
+    log = FakeLogger()
+    tracker = request_tracker.RequestTracker(log, max_requests=2)
+    for i in range(4):
+        sent(tracker, str(i), 10.0)
+
+    assert list(tracker.requests) == ["2", "3"]
+    assert tracker.stats()["evicted"] == 2
+
+
+def test_flush_logs_the_requests_in_flight():
+    log = FakeLogger()
+    tracker = request_tracker.RequestTracker(log)
+    sent(tracker, "1", 10.0)
+    received(tracker, "1")
+    sent(tracker, "2", 10.0)
+
+    tracker.flush()
+
+    assert len(tracker) == 0
+    # Only requests that got a response have an edge to log.
+    assert [r["status"] for r in log.responses()] == ["200"]
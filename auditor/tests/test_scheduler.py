@@ -0,0 +1,57 @@
+from modules import scheduler
+
+
+def event(method, **params):
+    return {"method": method, "params": params}
+
+
+def attached(frame_id, parent_id):
+    return event("Page.frameAttached", frameId=frame_id,
+                 parentFrameId=parent_id)
+
+
+def request(frame_id, request_id):
+    return event("Network.requestWillBeSent", frameId=frame_id,
+                 requestId=request_id)
+
+
+def drain(queue):
+    messages = list()
+    while len(queue):
+        messages.append(queue.pop())
+    return messages
+
+
+def test_structural_events_overtake_unrelated_bulk_events():
+    queue = scheduler.EventScheduler()
+    queue.extend([request("A", "1"), request("A", "2"), attached("C", "B")])
+
+    assert drain(queue) == [attached("C", "B"), request("A", "1"),
+                            request("A", "2")]
+    assert queue.stats()["promoted"] == 1
+
+
+def test_structural_events_wait_for_the_frames_they_refer_to():
+    queue = scheduler.EventScheduler()
+    messages = [request("B", "1"), attached("C", "B"), request("C", "2")]
+    queue.extend(messages)
+
+    assert drain(queue) == messages
+
+
+def test_teardown_events_keep_their_order():
+    queue = scheduler.EventScheduler()
+    detached = event("Page.frameDetached", frameId="A")
+    messages = [request("A", "1"), detached, attached("A", "B")]
+    queue.extend(messages)
+
+    # The attach of the new A may not overtake the detach of the old one.
+    assert drain(queue) == messages
+
+
+def test_window_bounds_how_far_an_event_jumps():
+    queue = scheduler.EventScheduler(window=2)
+    bulk = [request("A", str(i)) for i in range(5)]
+    queue.extend(bulk + [attached("C", "B")])
+
+    assert drain(queue) == bulk[:3] + [attached("C", "B")] + bulk[3:]
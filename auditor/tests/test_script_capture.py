@@ -0,0 +1,86 @@
+import gzip
+import os
+from concurrent.futures import Future
+
+from modules import script_capture
+from modules import utils
+
+
+class FakeChrome(object):
+    """Answers Debugger.getScriptSource with the source of @sources."""
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.fetched = list()
+
+    def submit(self, method, sessionId=None, scriptId=None):
+        self.fetched.append(scriptId)
+        future = Future()
+        if scriptId in self.sources:
+            future.set_result(
+                {"result": {"scriptSource": self.sources[scriptId]}})
+        else:
+            future.set_result({"error": {"message": "No script"}})
+        return future
+
+
+def parsed(script_id, s_hash):
+    return {"method": "Debugger.scriptParsed", "sessionId": "S",
+            "params": {"scriptId": script_id, "hash": s_hash}}
+
+
+def test_scripts_are_fetched_once_per_hash(workdir):
+    cache = utils.FileCache("script-cache", is_bytes=True)
+    chrome = FakeChrome({"1": "var a;", "3": "var c;"})
+    capture = script_capture.ScriptCapture(chrome, cache, workers=2)
+    for script_id, s_hash in [("1", "AA"), ("2", "BB"), ("3", "CC")]:
+        capture.submit(parsed(script_id, s_hash))
+    capture.close(timeout=5)
+    # Cached by now.
+    capture.submit(parsed("4", "AA"))
+
+    with gzip.open(cache.path("AA.gz")) as infile:
+        assert infile.read() == b"var a;"
+    stats = capture.stats()
+    assert stats["submitted"] == 3
+    assert stats["captured"] == 2
+    assert stats["failed"] == 1
+    assert stats["cached"] == 1
+    assert stats["queued"] == 0
+
+
+def test_the_queue_is_bounded(workdir):
+    cache = utils.FileCache("script-cache", is_bytes=True)
+    # No workers, so nothing leaves the queue.
+    capture = script_capture.ScriptCapture(FakeChrome({}), cache, workers=0,
+                                           max_pending=2)
+    for i in range(5):
+        capture.submit(parsed(str(i), "H{}".format(i)))
+    # Coalesced with the queued one.
+    capture.submit(parsed("9", "H0"))
+
+    stats = capture.stats()
+    assert (stats["submitted"], stats["overflowed"], stats["queued"]) == \
+        (2, 3, 2)
+    # A skipped script is queued again once there is room.
+    capture.queue.get_nowait()
+    capture.submit(parsed("4", "H4"))
+    assert capture.stats()["submitted"] == 3
+    assert capture.pending == {"H0", "H1", "H4"}
+
+
+def test_sources_of_the_legacy_cache_are_not_fetched_again(workdir):
+    # The flat, uncompressed layout of the old cache, without an index.
+    os.makedirs("script-cache")
+    with open("script-cache/3ad48bc2", 'w') as outfile:
+        outfile.write("var a;")
+    cache = utils.FileCache("script-cache", is_bytes=True)
+    assert os.path.exists(cache.path("3ad48bc2"))
+    chrome = FakeChrome({"1": "var a;"})
+    capture = script_capture.ScriptCapture(chrome, cache, workers=1)
+
+    capture.submit(parsed("1", "3ad48bc2"))
+    capture.close(timeout=5)
+
+    assert chrome.fetched == []
+    assert capture.stats()["cached"] == 1
@@ -0,0 +1,94 @@
+import pytest
+
+from modules import frame_handler
+from modules import graph
+from modules import script_handler
+from test_frame_handler import FakeHandler
+
+
+@pytest.fixture(autouse=True)
+def session(workdir):
+    return graph.Session("S", "test")
+
+
+@pytest.fixture
+def frames():
+    frames = frame_handler.FrameHandler(FakeHandler())
+    frames.logged = list()
+    # The scripts the ScriptHandler logs, as (id, loaderId, url).
+    frames.script_handler.add = lambda label, script: frames.logged.append(
+        (script.id, script.p['loaderId'], script.p['url']))
+    return frames
+
+
+def parsed(frames, script_id, frame_id, url="http://a.com/a.js"):
+    m = {"params": {"scriptId": script_id, "executionContextId": 7,
+                    "hash": "H" + script_id,
+                    "executionContextAuxData": {"frameId": frame_id}}}
+    if url is not None:
+        m["params"]["url"] = url
+    frames.handle_script_parsed(m)
+    frames.script_handler.handle_script_parsed(m)
+
+
+def navigated(frames, frame_id, loader_id):
+    frames.handle_frame_navigated({"params": {"frame": {
+        "id": frame_id, "loaderId": loader_id, "url": "http://a.com/",
+        "securityOrigin": "http://a.com", "mimeType": "text/html"}}})
+
+
+def test_scripts_wait_for_the_frame_to_navigate(frames):
+    parsed(frames, "1", "F")
+    parsed(frames, "2", "F", url=None)
+    frame = frames.get_frame("F")
+    assert [r.script_id for r in frame.pending_scripts] == ["1", "2"]
+    assert frames.logged == []
+
+    navigated(frames, "F", "L1")
+
+    assert frame.pending_scripts == []
+    assert [(script_id, loader_id) for script_id, loader_id, url
+            in frames.logged] == [("1-F-L1", "L1"), ("2-F-L1", "L1")]
+    # Logged with the same properties as Script.from_m.
+    assert [url for _, _, url in frames.logged] == ["http://a.com/a.js",
+                                                    "None"]
+
+
+def test_scripts_of_navigated_frames_are_logged_right_away(frames):
+    navigated(frames, "F", "L1")
+
+    parsed(frames, "1", "F")
+
+    assert frames.get_frame("F").pending_scripts == []
+    assert [script_id for script_id, _, _ in frames.logged] == ["1-F-L1"]
+
+
+def test_logging_a_frame_flushes_its_scripts(frames):
+    parsed(frames, "1", "F")
+    frames.handle_target_destroyed("F")
+
+    assert [script_id for script_id, _, _ in frames.logged] == ["1-F-0"]
+
+
+def test_scripts_without_a_cached_frame_are_ignored(frames):
+    frames.script_handler.handle_script_parsed({"params": {
+        "scriptId": "1", "executionContextId": 7, "hash": "H",
+        "executionContextAuxData": {"frameId": "X"}}})
+    frames.script_handler.handle_script_parsed({"params": {
+        "scriptId": "2", "executionContextId": 7, "hash": "H"}})
+
+    assert frames.logged == []
+    assert frames.script_handler.flush(None) is None
+
+
+def test_records_log_the_same_script_as_the_message():
+    m = {"params": {"scriptId": 12, "executionContextId": 7, "hash": "H",
+                    "url": "http://a.com/a.js"}}
+    for params in [m["params"], {k: v for k, v in m["params"].items()
+                                 if k != "url"}]:
+        m = {"params": params}
+        record = script_handler.ScriptHandler.record(m)
+        from_record = graph.Script.from_record(record, "F", "L")
+        from_m = graph.Script.from_m(m, "F", "L")
+        assert from_record.id == from_m.id
+        assert from_record.properties == from_m.properties
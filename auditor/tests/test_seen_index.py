@@ -0,0 +1,42 @@
+import csv
+import glob
+
+from conftest import Row
+from modules import common
+from modules import utils
+
+
+def read_rows(pattern):
+    rows = list()
+    for path in sorted(glob.glob(pattern)):
+        with open(path, newline='') as infile:
+            rows.extend(csv.DictReader(infile, delimiter=common.DELIM))
+    return rows
+
+
+def test_seen_index_is_exact():
+    seen = utils.SeenIndex()
+    assert seen.add("hosts", "1.1.1.1")
+    assert not seen.add("hosts", "1.1.1.1")
+    assert seen.add("resources", "1.1.1.1")
+    assert len(seen) == 2
+
+
+def test_nodes_are_written_once_across_rotations(workdir):
+    manager = utils.ObjectManager("logs", flush_threshold=2)
+    for i in range(10):
+        manager.add("hosts", Row("h{}".format(i % 3), id="h{}".format(i % 3)))
+        # Edges aren't deduplicated.
+        manager.add("frame-edges", Row("e{}".format(i), id="e{}".format(i)))
+    manager.flush_all(exiting=True)
+
+    assert len(glob.glob("logs/frame-edges.*.csv")) > 1
+    assert sorted(row["id"] for row in read_rows("logs/hosts.*.csv")) == \
+        ["h0", "h1", "h2"]
+    assert len(read_rows("logs/frame-edges.*.csv")) == 10
+
+    # Later sightings are counted per rotation instead.
+    counts = dict()
+    for row in read_rows("logs/{}.*.csv".format(common.OCCURRENCES)):
+        counts[row["node"]] = counts.get(row["node"], 0) + int(row["count"])
+    assert counts == {"h0": 3, "h1": 2, "h2": 2}
@@ -0,0 +1,60 @@
+import pytest
+
+from conftest import Row
+from modules import segment
+from modules import utils
+
+
+def rows():
+    for i in range(10):
+        properties = {"id": "r{}".format(i), "count": i, "url": None}
+        if i >= 5:
+            # A column that only shows up in a later block.
+            properties["domain"] = "d{}.com".format(i % 2)
+        yield Row(properties["id"], **properties)
+
+
+def test_segment_round_trips_to_the_csv_layout(workdir):
+    csv_logger = utils.CSVLogger(str(workdir / "hosts.csv"), debug=False)
+    seg_logger = segment.SegmentLogger(str(workdir / "hosts.seg"),
+                                       debug=False, block_rows=3)
+    for row in rows():
+        csv_logger.add(row)
+        seg_logger.add(row)
+    csv_logger.flush()
+    seg_logger.flush()
+
+    assert list(segment.iter_rows(str(workdir / "hosts.seg")))[:2] == [
+        ["id", "count", "url", "domain"], ["r0", "0", "", ""]]
+    converted = segment.to_csv(str(workdir / "hosts.seg"),
+                               str(workdir / "converted.csv"))
+    with open(converted) as a, open(str(workdir / "hosts.csv")) as b:
+        assert a.read() == b.read()
+
+
+def test_objects_logged_again_replace_their_row(workdir):
+    csv_logger = utils.CSVLogger(str(workdir / "hosts.csv"), debug=False)
+    seg_logger = segment.SegmentLogger(str(workdir / "hosts.seg"),
+                                       debug=False, block_rows=3)
+    updates = [Row("r1", id="r1", count=10), Row("r7", id="r7", count=70),
+               Row("r1", id="r1", count=11, domain="new.com")]
+    for row in list(rows()) + updates:
+        csv_logger.add(row)
+        seg_logger.add(row)
+    csv_logger.flush()
+    seg_logger.flush()
+
+    logged = list(segment.iter_rows(str(workdir / "hosts.seg")))
+    assert len(logged) == 11
+    assert logged[2] == ["r1", "11", "", "new.com"]
+    assert logged[8][:2] == ["r7", "70"]
+    converted = segment.to_csv(str(workdir / "hosts.seg"),
+                               str(workdir / "converted.csv"))
+    with open(converted) as a, open(str(workdir / "hosts.csv")) as b:
+        assert a.read() == b.read()
+
+
+def test_segment_rejects_other_files(workdir):
+    (workdir / "hosts.seg").write_text("id;rip\n")
+    with pytest.raises(segment.SegmentError):
+        list(segment.iter_rows(str(workdir / "hosts.seg")))
@@ -0,0 +1,67 @@
+import hashlib
+from urllib.parse import urlparse
+
+import pytest
+
+from modules import graph
+
+
+URLS = [
+    "https://cdn.example.com/lib/jquery.min.js?v=3.1#top",
+    "http://user:pw@example.com:8080/a/b;params?q=1",
+    "https://[2001:db8::1]:443/ipv6",
+    "https://example.com",
+    "https://bücher.example/ä.js",
+    "data:text/javascript;base64,dmFyIGE7",
+    "about:blank",
+    "blob:https://example.com/5c1f-4a",
+    "",
+]
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    for func in [graph.parse_url, graph.resource_id]:
+        func.cache_clear()
+
+
+@pytest.mark.parametrize("url", URLS)
+def test_parse_url_matches_urlparse(url):
+    parsed = urlparse(url)
+    expected = (parsed.netloc, parsed.path)
+
+    assert graph.parse_url.__wrapped__(url) == expected
+    # A miss, then a hit.
+    assert graph.parse_url(url) == expected
+    assert graph.parse_url(url) == expected
+    assert graph.parse_url.cache_info().hits == 1
+
+
+@pytest.mark.parametrize("url", URLS)
+def test_resource_id_matches_the_uncached_hash(url):
+    domain, path = graph.parse_url(url)
+    expected = hashlib.sha256(str.encode(domain + path)).hexdigest()
+
+    assert graph.resource_id.__wrapped__(domain + path) == expected
+    assert graph.resource_id(domain + path) == expected
+    assert graph.resource_id(domain + path) == expected
+
+
+def test_results_survive_eviction():
+    small = graph.functools.lru_cache(maxsize=2)(graph.parse_url.__wrapped__)
+    for url in URLS * 2:
+        assert small(url) == graph.parse_url.__wrapped__(url)
+    assert small.cache_info().currsize == 2
+
+
+def test_resources_get_the_same_id_cached_or_not(workdir):
+    graph.Session("S", "test")
+    m = {"params": {"request": {"url": URLS[0]}, "type": "Script"}}
+    first = graph.Resource.from_request_m(m)
+    second = graph.Resource.from_request_m(m)
+
+    domain, path = urlparse(URLS[0]).netloc, urlparse(URLS[0]).path
+    assert first.id == second.id == hashlib.sha256(
+        str.encode(domain + path)).hexdigest()
+    assert graph.url_cache_info()["resource_id"]["hits"] == 1
+    assert graph.url_cache_info()["parse_url"]["hit_rate"] == 0.5
@@ -0,0 +1,31 @@
+import json
+import os
+
+from modules import replay
+from modules import workload
+from test_csv_logger import read_csv
+
+
+def test_small_workload_is_logged_and_journals_are_removed(workdir):
+    from auditor import ChromeHandler
+
+    lines = [json.dumps(r) for r in
+             workload.Workload(**workload.SCENARIOS["small"]).records()]
+    chrome = replay.ReplayInterface(lines)
+    handler = ChromeHandler(chrome=chrome)
+    # One table: our callbacks, then the frame cache's, then the scripts'.
+    assert [h.__class__.__name__ for h, func in
+            handler.dispatch["Debugger.scriptParsed"]] == \
+        ["ChromeHandler", "FrameHandler", "ScriptHandler"]
+    assert "Page.frameNavigated" in handler.subscriptions()
+    handler.msg_loop()
+
+    logs = [f for f in os.listdir("neo4j-csvs") if f.endswith(".csv")]
+    labels = {f.split('.', 1)[0] for f in logs}
+    assert {"request-edges", "frames"} <= labels
+    requests = sum(len(read_csv(os.path.join("neo4j-csvs", f))) - 1
+                   for f in logs if f.startswith("request-edges."))
+    assert requests >= 2 * 2 * 50
+    assert not [f for f in os.listdir("neo4j-csvs") if f.startswith('.')]
+    assert not os.path.isdir("journal") or not os.listdir("journal")
+    assert handler.dispatch_stats()["handled"]["Page.frameAttached"] == 8
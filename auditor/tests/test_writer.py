@@ -0,0 +1,76 @@
+import os
+import queue
+
+from conftest import Row
+from modules import journal
+from modules import utils
+from modules import writer
+from test_csv_logger import read_csv
+
+
+def segment(workdir, name):
+    """A rotated segment of one log, and its journal."""
+    wal = journal.Journal("logs", "csv", journal_dir=str(workdir / "journal"))
+    logger = utils.CSVLogger(str(workdir / "{}.csv".format(name)),
+                             debug=False)
+    wal.add_file("hosts", logger.filename)
+    for row in [Row("a", id="a", rip="1.1.1.1"), Row("b", id="b")]:
+        logger.add(row)
+        wal.add("hosts", row)
+    return logger, wal
+
+
+def test_drain_waits_for_the_segments_to_be_finalized(workdir):
+    background = writer.BackgroundWriter(max_pending=1)
+    for name in ["hosts.1", "hosts.2", "hosts.3"]:
+        logger, wal = segment(workdir, name)
+        background.register(wal)
+        background.submit([logger], wal)
+
+    background.drain()
+
+    for name in ["hosts.1", "hosts.2", "hosts.3"]:
+        assert read_csv(str(workdir / "{}.csv".format(name))) == [
+            ["id", "rip"], ["a", "1.1.1.1"], ["b", ""]]
+    assert os.listdir("journal") == []
+    stats = background.stats()
+    assert (stats["rotations"], stats["loggers_flushed"], stats["errors"],
+            stats["queued"]) == (3, 3, 0, 0)
+
+
+def test_a_forked_child_starts_its_own_writer(workdir):
+    background = writer.BackgroundWriter()
+    # What a forked child inherits: its parent's pid, and a queue whose
+    # thread didn't survive the fork.
+    background.pid = os.getppid()
+    background.queue = queue.Queue()
+    background.queue.put(([], None))
+    logger, wal = segment(workdir, "hosts.1")
+    wal.pid = os.getppid()
+
+    # Neither waits for the parent's queue, nor syncs the parent's journal.
+    background.drain()
+    assert len(background) == 0
+    assert wal.sync() == 0
+
+    logger, wal = segment(workdir, "hosts.2")
+    background.register(wal)
+    background.submit([logger], wal)
+    background.drain()
+
+    assert background.pid == os.getpid()
+    assert read_csv(logger.filename)[1:] == [["a", "1.1.1.1"], ["b", ""]]
+    assert not os.path.exists(wal.path)
+
+
+def test_finalize_keeps_the_journal_when_a_logger_fails(workdir):
+    background = writer.BackgroundWriter()
+    logger, wal = segment(workdir, "hosts.1")
+
+    def flush():
+        raise OSError("No space left on device")
+    logger.flush = flush
+    background.finalize([logger], wal)
+
+    assert os.path.exists(wal.path)
+    assert background.stats()["errors"] == 1